@@ -20,7 +20,11 @@ UPLOAD_COTIZACION_FOLDER = os.path.join(BASE_DIR, "uploads_cotizacion")
 for folder in [UPLOAD_FOLDER, OUTSTANDING_FOLDER, RESULTS_FOLDER, UPLOAD_COTIZACION_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
-def create_app():
+def create_app(tareas_de_fondo=True):
+    """
+    tareas_de_fondo=False no arranca los hilos del espejo SAP ni del outbox
+    (p. ej. en el proceso padre del reloader, que solo vigila los archivos).
+    """
     app = Flask(__name__)
     CORS(app)
 
@@ -46,12 +50,17 @@ def create_app():
     from controllers_sap.sap_open_docs import sap_open_docs_bp
     from controllers_sap.sap_service import validacion_bp
     from controllers_sap.sap_convert import sap_convert_bp
+    from controllers_sap.sap_cache import sap_cache_bp
+    from controllers_sap.sap_mirror import sap_mirror_bp, iniciar_sincronizacion
+    from controllers_sap.sap_metrics import sap_metrics_bp
+    from controllers_sap.sap_outbox import sap_outbox_bp, iniciar_outbox
     from controllers_sap.sap_handler import actualizar_codigos_ocr
     from controllers_user.user_solicitud import request_user_bp
     from controllers_sap.sap_actions import sap_actions_bp
     from controllers.pdf_handler import pdfs_bp
     from controllers.auth_controller import auth_bp
     from controllers.users_controller import users_bp
+    from controllers.eventos import eventos_bp
     
     app.register_blueprint(users_bp)
     app.register_blueprint(auth_bp)
@@ -69,10 +78,23 @@ def create_app():
     app.register_blueprint(sap_actions_bp)
     app.register_blueprint(validacion_bp)
     app.register_blueprint(sap_convert_bp)
+    app.register_blueprint(sap_cache_bp)
+    app.register_blueprint(sap_mirror_bp)
+    app.register_blueprint(sap_metrics_bp)
+    app.register_blueprint(sap_outbox_bp)
+    app.register_blueprint(eventos_bp)
+
+    if tareas_de_fondo:
+        # Espejo local de documentos SAP abiertos (SAP_MIRROR_ENABLED=1)
+        iniciar_sincronizacion()
+        # Workers del outbox de escrituras SAP (trabajos asíncronos y reintentos)
+        iniciar_outbox()
     return app
 
 
 if __name__ == "__main__":
-    app = create_app()
+    # Con debug=True el reloader ejecuta este archivo dos veces: los hilos solo corren en el
+    # proceso hijo que atiende los requests (WERKZEUG_RUN_MAIN=true), no en el que vigila los archivos
+    app = create_app(tareas_de_fondo=os.environ.get("WERKZEUG_RUN_MAIN") == "true")
     app.run(debug=True, port=4003)
 
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import threading
+import collections
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+# Eventos que se conservan en memoria para retomar con Last-Event-ID
+EVENTOS_BUFFER = int(os.getenv("EVENTOS_BUFFER", "500"))
+# Segundos entre comentarios de keep-alive (evita que proxies corten la conexión)
+EVENTOS_HEARTBEAT_S = float(os.getenv("EVENTOS_HEARTBEAT_S", "15"))
+# Milisegundos que el navegador espera antes de reconectar
+EVENTOS_RETRY_MS = int(os.getenv("EVENTOS_RETRY_MS", "3000"))
+
+
+class BusEventos:
+    """
+    Publicación de eventos en memoria con un buffer circular.
+    Los ids son '<arranque>-<n>': si el cliente trae un id de otro arranque del
+    proceso, o uno que ya salió del buffer, se le pide recargar (evento 'resync').
+    Cada proceso tiene su propio bus; con varios workers cada cliente ve los
+    eventos del worker que atiende su conexión.
+    """
+
+    def __init__(self, capacidad=EVENTOS_BUFFER):
+        self._buffer = collections.deque(maxlen=capacidad)
+        self._cond = threading.Condition()
+        self._arranque = str(int(time.time()))
+        self._seq = 0
+
+    def publicar(self, tipo, datos):
+        with self._cond:
+            self._seq += 1
+            evento = {"id": f"{self._arranque}-{self._seq}", "seq": self._seq, "tipo": tipo, "datos": datos}
+            self._buffer.append(evento)
+            self._cond.notify_all()
+        return evento["id"]
+
+    def _posicion(self, ultimo_id):
+        """seq desde el que se retoma, o None si hay que recargar."""
+        if not ultimo_id:
+            return self._seq
+        arranque, _, seq = str(ultimo_id).partition("-")
+        if arranque != self._arranque or not seq.isdigit():
+            return None
+        seq = int(seq)
+        primero = self._buffer[0]["seq"] if self._buffer else self._seq + 1
+        if seq > self._seq or seq < primero - 1:
+            return None
+        return seq
+
+    def posicion(self, ultimo_id):
+        with self._cond:
+            return self._posicion(ultimo_id)
+
+    def esperar(self, desde_seq, timeout):
+        """Eventos posteriores a desde_seq; bloquea hasta timeout si no hay ninguno."""
+        with self._cond:
+            if self._seq <= desde_seq:
+                self._cond.wait(timeout)
+            return [e for e in self._buffer if e["seq"] > desde_seq]
+
+    def estado(self):
+        with self._cond:
+            return {"arranque": self._arranque, "ultimo": self._seq, "en_buffer": len(self._buffer)}
+
+
+bus_eventos = BusEventos()
+
+
+def publicar_evento(tipo, **datos):
+    """Publica un evento para los tableros; nunca interrumpe el flujo que lo emite."""
+    try:
+        bus_eventos.publicar(tipo, datos)
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar evento {tipo}: {e}")
+
+
+def _formato_sse(evento):
+    datos = json.dumps(evento["datos"], ensure_ascii=False, default=str)
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {datos}\n\n"
+
+
+eventos_bp = Blueprint("eventos_bp", __name__)
+
+
+@eventos_bp.route("/eventos", methods=["GET"])
+def stream_eventos():
+    """
+    Stream Server-Sent Events con los cambios que muestran los tableros:
+    'log' (nuevo registro en LOGS), 'factura' (nueva factura) y 'documento'
+    (solicitud → pedido → entrada en SAP).
+    Retoma desde el header Last-Event-ID (o ?last_event_id=); si ya no es
+    posible, envía 'resync' para que el cliente recargue los datos completos.
+    """
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
+    def generar():
+        yield f"retry: {EVENTOS_RETRY_MS}\n\n"
+        seq = bus_eventos.posicion(ultimo_id)
+        if seq is None:
+            yield "event: resync\ndata: {}\n\n"
+            seq = bus_eventos.posicion(None)
+
+        while True:
+            eventos = bus_eventos.esperar(seq, EVENTOS_HEARTBEAT_S)
+            if not eventos:
+                yield ": keep-alive\n\n"
+                continue
+            if eventos[0]["seq"] > seq + 1:
+                # El cliente se atrasó más que el buffer
+                yield "event: resync\ndata: {}\n\n"
+            for evento in eventos:
+                yield _formato_sse(evento)
+            seq = eventos[-1]["seq"]
+
+    return Response(stream_with_context(generar()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@eventos_bp.route("/eventos/estado", methods=["GET"])
+def estado_eventos():
+    return jsonify({"status": "ok", "data": bus_eventos.estado()}), 200
@@ -2,6 +2,7 @@ import datetime
 from flask import Blueprint, request, jsonify
 from bd import get_connection
 from controllers.validations import parse_fecha, validar_estanques, litros_totales_factura
+from controllers.eventos import publicar_evento
 
 insert_bp = Blueprint("insert_bp", __name__)
 
@@ -119,6 +120,8 @@ def insert_factura():
 
         conn.commit()
         conn.close()
+        publicar_evento("factura", ID_FACTURA=id_factura, NUMERO_FACTURA=factura.get("Número de factura"),
+                        NUMERO_SOLICITUD_SAP=numero_solicitud_sap, NOMBRE_EMISOR=factura.get("Empresa del combustible"))
 
         return jsonify({
             "status": "ok",
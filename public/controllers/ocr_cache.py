@@ -0,0 +1,221 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+
+from bd import get_connection
+
+# Desactiva el cache de resultados OCR con "0"
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+# Días sin uso tras los que una entrada se elimina
+OCR_CACHE_TTL_DIAS = int(os.getenv("OCR_CACHE_TTL_DIAS", "30"))
+# Entradas máximas; al superarlo se eliminan las usadas hace más tiempo
+OCR_CACHE_MAX = int(os.getenv("OCR_CACHE_MAX", "5000"))
+
+_DDL = [
+    """
+    IF OBJECT_ID('OCR_CACHE', 'U') IS NULL
+    CREATE TABLE OCR_CACHE (
+        HASH CHAR(64) NOT NULL PRIMARY KEY,
+        HTTP INT NOT NULL,
+        RESULTADO NVARCHAR(MAX) NOT NULL,
+        CREADO DATETIME NOT NULL,
+        ULTIMO_USO DATETIME NOT NULL,
+        USOS INT NOT NULL
+    )
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OCR_CACHE_USO')
+    CREATE INDEX IX_OCR_CACHE_USO ON OCR_CACHE (ULTIMO_USO)
+    """,
+    """
+    IF OBJECT_ID('OCR_PAGINAS', 'U') IS NULL
+    CREATE TABLE OCR_PAGINAS (
+        HASH CHAR(64) NOT NULL PRIMARY KEY,
+        TEXTO NVARCHAR(MAX) NOT NULL,
+        CREADO DATETIME NOT NULL,
+        ULTIMO_USO DATETIME NOT NULL
+    )
+    """,
+]
+
+_tablas_listas = False
+_stats = {"hits": 0, "misses": 0, "guardados": 0, "eliminados": 0, "errores": 0, "paginas_hits": 0, "paginas_misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _contar(clave, n=1):
+    with _stats_lock:
+        _stats[clave] += n
+
+
+def asegurar_tablas():
+    global _tablas_listas
+    if _tablas_listas:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    for ddl in _DDL:
+        cur.execute(ddl)
+    conn.commit()
+    conn.close()
+    _tablas_listas = True
+
+
+def hash_pdf(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def leer_cache_ocr(hash_contenido):
+    """(http_status, cuerpo) guardado para este contenido, o None. Un error de BD cuenta como miss."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT HTTP, RESULTADO FROM OCR_CACHE WHERE HASH = ?", (hash_contenido,))
+        row = cur.fetchone()
+        cuerpo = json.loads(row[1]) if row else None
+        if cuerpo and cuerpo.get("status") != "ok":
+            # Rechazo guardado antes de cachear solo los OK: se elimina y se reintenta
+            cur.execute("DELETE FROM OCR_CACHE WHERE HASH = ?", (hash_contenido,))
+            cuerpo = None
+        elif cuerpo:
+            cur.execute("UPDATE OCR_CACHE SET ULTIMO_USO = ?, USOS = USOS + 1 WHERE HASH = ?",
+                        (datetime.datetime.now(), hash_contenido))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ No se pudo leer OCR_CACHE: {e}")
+        _contar("errores")
+        return None
+
+    if not cuerpo:
+        _contar("misses")
+        return None
+    _contar("hits")
+    return int(row[0]), cuerpo
+
+
+def guardar_cache_ocr(hash_contenido, http, cuerpo):
+    """
+    Guarda el resultado de un OCR exitoso y aplica la expiración; nunca interrumpe
+    el upload. Los rechazos no se guardan: dependen de la respuesta del LLM y al
+    volver a subir el PDF deben reintentarse.
+    """
+    if not OCR_CACHE_ENABLED or cuerpo.get("status") != "ok":
+        return
+    ahora = datetime.datetime.now()
+    resultado = json.dumps(cuerpo, ensure_ascii=False, default=str)
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("UPDATE OCR_CACHE SET HTTP = ?, RESULTADO = ?, ULTIMO_USO = ? WHERE HASH = ?",
+                    (http, resultado, ahora, hash_contenido))
+        if cur.rowcount == 0:
+            cur.execute("""
+                INSERT INTO OCR_CACHE (HASH, HTTP, RESULTADO, CREADO, ULTIMO_USO, USOS)
+                VALUES (?, ?, ?, ?, ?, 0)
+            """, (hash_contenido, http, resultado, ahora, ahora))
+        conn.commit()
+        _contar("guardados")
+        _expirar(cur, ahora)
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar en OCR_CACHE: {e}")
+        _contar("errores")
+
+
+def eliminar_cache_ocr(hash_contenido):
+    """Elimina la entrada de un PDF (p. ej. un OCR incorrecto). Retorna True si existía."""
+    asegurar_tablas()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM OCR_CACHE WHERE HASH = ?", (hash_contenido,))
+    eliminado = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    if eliminado:
+        _contar("eliminados")
+    return eliminado
+
+
+def _expirar(cur, ahora):
+    cur.execute("DELETE FROM OCR_CACHE WHERE ULTIMO_USO < ?", (ahora - datetime.timedelta(days=OCR_CACHE_TTL_DIAS),))
+    eliminados = max(cur.rowcount, 0)
+
+    cur.execute("SELECT COUNT(*) FROM OCR_CACHE")
+    exceso = cur.fetchone()[0] - OCR_CACHE_MAX
+    if exceso > 0:
+        cur.execute(f"SELECT TOP {int(exceso)} HASH FROM OCR_CACHE ORDER BY ULTIMO_USO ASC")
+        hashes = [r[0] for r in cur.fetchall()]
+        cur.execute(f"DELETE FROM OCR_CACHE WHERE HASH IN ({', '.join('?' * len(hashes))})", hashes)
+        eliminados += len(hashes)
+
+    if eliminados:
+        _contar("eliminados", eliminados)
+        print(f"🧹 OCR_CACHE: {eliminados} entradas eliminadas")
+
+
+# === TEXTO DE PÁGINAS ESCANEADAS (OCR local) ===
+def leer_texto_pagina(hash_pagina):
+    """Texto OCR guardado para una página escaneada, o None."""
+    if not OCR_CACHE_ENABLED:
+        return None
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT TEXTO FROM OCR_PAGINAS WHERE HASH = ?", (hash_pagina,))
+        row = cur.fetchone()
+        if row:
+            cur.execute("UPDATE OCR_PAGINAS SET ULTIMO_USO = ? WHERE HASH = ?", (datetime.datetime.now(), hash_pagina))
+            conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ No se pudo leer OCR_PAGINAS: {e}")
+        _contar("errores")
+        return None
+    _contar("paginas_hits" if row else "paginas_misses")
+    return row[0] if row else None
+
+
+def guardar_texto_pagina(hash_pagina, texto):
+    if not OCR_CACHE_ENABLED:
+        return
+    ahora = datetime.datetime.now()
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("UPDATE OCR_PAGINAS SET TEXTO = ?, ULTIMO_USO = ? WHERE HASH = ?", (texto, ahora, hash_pagina))
+        if cur.rowcount == 0:
+            cur.execute("INSERT INTO OCR_PAGINAS (HASH, TEXTO, CREADO, ULTIMO_USO) VALUES (?, ?, ?, ?)",
+                        (hash_pagina, texto, ahora, ahora))
+        cur.execute("DELETE FROM OCR_PAGINAS WHERE ULTIMO_USO < ?", (ahora - datetime.timedelta(days=OCR_CACHE_TTL_DIAS),))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar en OCR_PAGINAS: {e}")
+        _contar("errores")
+
+
+def estado_cache_ocr():
+    with _stats_lock:
+        estado = dict(_stats)
+    estado["habilitado"] = OCR_CACHE_ENABLED
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM OCR_CACHE")
+        estado["entradas"] = cur.fetchone()[0]
+        conn.close()
+    except Exception as e:
+        estado["entradas"] = None
+        estado["error"] = str(e)
+    return estado
@@ -0,0 +1,114 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Facturas que se procesan en paralelo (lectura PDF + SAP + OpenAI)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "3"))
+# Segundos que se conserva un trabajo terminado para consultar su resultado
+OCR_JOBS_TTL_S = int(os.getenv("OCR_JOBS_TTL_S", "3600"))
+
+EN_COLA, EN_PROCESO, OK, RECHAZADO, ERROR = "en_cola", "en_proceso", "ok", "rechazado", "error"
+_TERMINADOS = (OK, RECHAZADO, ERROR)
+
+_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+_trabajos = {}
+_lock = threading.Lock()
+_terminado = threading.Condition(_lock)
+
+
+class Avance:
+    """Reporta la etapa en curso de un trabajo OCR; se pasa a la función que lo ejecuta."""
+
+    def __init__(self, id_job):
+        self.id_job = id_job
+
+    def __call__(self, etapa, progreso):
+        _actualizar(self.id_job, etapa=etapa, progreso=progreso)
+        print(f"🔎 OCR {self.id_job[:8]}: {etapa} ({progreso}%)")
+
+
+def _actualizar(id_job, **campos):
+    with _lock:
+        trabajo = _trabajos.get(id_job)
+        if trabajo is None:
+            return
+        trabajo.update(campos)
+        trabajo["actualizado"] = time.time()
+        if "etapa" in campos:
+            trabajo["etapas"].append({"etapa": campos["etapa"], "progreso": campos.get("progreso"),
+                                      "t": round(trabajo["actualizado"] - trabajo["creado"], 3)})
+        if campos.get("estado") in _TERMINADOS:
+            _terminado.notify_all()
+
+
+def _purgar():
+    limite = time.time() - OCR_JOBS_TTL_S
+    with _lock:
+        for id_job in [k for k, t in _trabajos.items() if t["estado"] in _TERMINADOS and t["actualizado"] < limite]:
+            del _trabajos[id_job]
+
+
+def _ejecutar(id_job, funcion, args):
+    _actualizar(id_job, estado=EN_PROCESO)
+    try:
+        http, cuerpo = funcion(*args, avance=Avance(id_job))
+    except Exception as e:
+        print(f"❌ OCR {id_job[:8]} falló: {e}")
+        _actualizar(id_job, estado=ERROR, progreso=100, http=500, resultado={"error": str(e)})
+        return
+    if http >= 500:
+        estado = ERROR
+    else:
+        estado = RECHAZADO if cuerpo.get("status") == "rechazado" else OK
+    _actualizar(id_job, estado=estado, etapa="Terminado", progreso=100, http=http, resultado=cuerpo)
+
+
+def encolar_ocr(funcion, *args, archivo=None):
+    """
+    Agenda funcion(*args, avance=Avance) en el pool OCR y retorna el id del trabajo.
+    La función retorna (http_status, cuerpo) como las rutas de upload.
+    """
+    _purgar()
+    id_job = str(uuid.uuid4())
+    ahora = time.time()
+    with _lock:
+        _trabajos[id_job] = {
+            "id": id_job, "archivo": archivo, "estado": EN_COLA, "etapa": "En cola", "progreso": 0,
+            "etapas": [], "http": None, "resultado": None, "creado": ahora, "actualizado": ahora,
+        }
+    _executor.submit(_ejecutar, id_job, funcion, args)
+    return id_job
+
+
+def consultar_ocr(id_job):
+    """Copia del estado del trabajo (None si no existe o ya expiró)."""
+    with _lock:
+        trabajo = _trabajos.get(id_job)
+        if trabajo is None:
+            return None
+        copia = dict(trabajo, etapas=list(trabajo["etapas"]))
+    copia["terminado"] = copia["estado"] in _TERMINADOS
+    copia["segundos"] = round(copia["actualizado"] - copia["creado"], 3)
+    if copia["estado"] == EN_COLA:
+        with _lock:
+            copia["en_cola_antes"] = sum(1 for t in _trabajos.values()
+                                         if t["estado"] == EN_COLA and t["creado"] < copia["creado"])
+    return copia
+
+
+def esperar_ocr(ids, timeout):
+    """
+    Ids de `ids` que ya terminaron; si ninguno terminó, espera hasta `timeout`
+    segundos a que alguno lo haga. Un id expirado cuenta como terminado.
+    """
+    def listos():
+        return [i for i in ids if i not in _trabajos or _trabajos[i]["estado"] in _TERMINADOS]
+
+    with _terminado:
+        terminados = listos()
+        if not terminados:
+            _terminado.wait(timeout)
+            terminados = listos()
+    return terminados
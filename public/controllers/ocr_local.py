@@ -0,0 +1,84 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from controllers.ocr_cache import hash_pdf, leer_texto_pagina, guardar_texto_pagina
+
+# OCR local (Tesseract) para páginas escaneadas; "0" lo desactiva
+OCR_LOCAL_ENABLED = os.getenv("OCR_LOCAL_ENABLED", "1") == "1"
+# Ejecutables: Tesseract lee imágenes, pdftoppm (poppler) rasteriza la página
+TESSERACT_CMD = os.getenv("TESSERACT_CMD") or shutil.which("tesseract")
+PDFTOPPM_CMD = os.getenv("PDFTOPPM_CMD") or shutil.which("pdftoppm")
+# Idioma de Tesseract y resolución de la imagen
+OCR_LOCAL_IDIOMA = os.getenv("OCR_LOCAL_IDIOMA", "spa")
+OCR_LOCAL_DPI = int(os.getenv("OCR_LOCAL_DPI", "300"))
+# Páginas en OCR a la vez y tiempo máximo por página (segundos)
+OCR_LOCAL_PARALELO = int(os.getenv("OCR_LOCAL_PARALELO", "2"))
+OCR_LOCAL_TIMEOUT_S = float(os.getenv("OCR_LOCAL_TIMEOUT_S", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=OCR_LOCAL_PARALELO, thread_name_prefix="ocr-local")
+_aviso_mostrado = False
+
+
+def disponible():
+    global _aviso_mostrado
+    if OCR_LOCAL_ENABLED and not (TESSERACT_CMD and PDFTOPPM_CMD) and not _aviso_mostrado:
+        _aviso_mostrado = True
+        print("⚠️ OCR local no disponible: faltan tesseract o pdftoppm (poppler) en el PATH")
+    return OCR_LOCAL_ENABLED and bool(TESSERACT_CMD and PDFTOPPM_CMD)
+
+
+def _ocr_pagina(pdf_pagina):
+    """Rasteriza un PDF de una página y lo pasa por Tesseract. Retorna el texto."""
+    with tempfile.TemporaryDirectory(prefix="ocr_") as carpeta:
+        entrada = os.path.join(carpeta, "pagina.pdf")
+        with open(entrada, "wb") as f:
+            f.write(pdf_pagina)
+        imagen = os.path.join(carpeta, "pagina")
+        subprocess.run([PDFTOPPM_CMD, "-r", str(OCR_LOCAL_DPI), "-png", "-singlefile", entrada, imagen],
+                       check=True, capture_output=True, timeout=OCR_LOCAL_TIMEOUT_S)
+        resultado = subprocess.run([TESSERACT_CMD, imagen + ".png", "stdout", "-l", OCR_LOCAL_IDIOMA],
+                                   check=True, capture_output=True, timeout=OCR_LOCAL_TIMEOUT_S)
+    return resultado.stdout.decode("utf-8", "ignore")
+
+
+def _texto_pagina(pdf_pagina):
+    """(texto, ms, cache_hit) de una página escaneada; usa el cache por hash de la página."""
+    inicio = time.perf_counter()
+    hash_pagina = hash_pdf(pdf_pagina)
+    texto = leer_texto_pagina(hash_pagina)
+    if texto is not None:
+        return texto, round((time.perf_counter() - inicio) * 1000, 1), True
+    texto = _ocr_pagina(pdf_pagina)
+    guardar_texto_pagina(hash_pagina, texto)
+    return texto, round((time.perf_counter() - inicio) * 1000, 1), False
+
+
+def completar_con_ocr_local(lectura):
+    """
+    Reemplaza en `lectura` (resultado de leer_texto_pdf) el texto de las páginas
+    sin capa de texto por el de Tesseract, en paralelo. Una página que falla
+    queda con su texto original.
+    """
+    sin_texto = lectura.get("sin_texto") or {}
+    if not sin_texto or not disponible():
+        return lectura
+
+    numeros = sorted(sin_texto)
+    futuros = {n: _executor.submit(_texto_pagina, sin_texto[n]) for n in numeros}
+    por_pagina = {p["pagina"]: p for p in lectura["paginas"]}
+    for numero, futuro in futuros.items():
+        try:
+            texto, ms, cache_hit = futuro.result()
+        except Exception as e:
+            print(f"⚠️ OCR local falló en la página {numero}: {e}")
+            continue
+        lectura["textos"][numero - 1] = texto
+        por_pagina[numero].update({"ocr_local": True, "ms_ocr": ms, "cache_hit": cache_hit, "caracteres": len(texto)})
+
+    lectura["texto"] = "".join(lectura["textos"])
+    print(f"🔠 OCR local en {len(numeros)} página(s) sin texto")
+    return lectura
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+import openai
+
+from controllers.validations import extract_json, litros_totales_factura
+from controllers.ocr_plantillas import descuadre, numero_cl
+from controllers.ocr_prompt import construir_prompt, registrar_uso_llm, registrar_resultado_modelo, registrar_ruta
+
+# Modelos en orden de prueba: el primero rápido/barato, el último el de mayor precisión.
+# Se pasa al siguiente solo si la extracción no valida; la del último se acepta siempre.
+OCR_MODELOS = [m.strip() for m in os.getenv("OCR_MODELOS", "gpt-4o-mini,gpt-4o").split(",") if m.strip()]
+# Llamadas al LLM en curso a la vez en todo el proceso (uploads y cargas masivas)
+OCR_LLM_PARALELO = int(os.getenv("OCR_LLM_PARALELO", "2"))
+
+_llm_cupos = threading.BoundedSemaphore(OCR_LLM_PARALELO)
+
+_CAMPOS_DETALLE = ("Cantidad (litros)", "PBASE_SI_U")
+_CAMPOS_PAGO = ("Base Afecta", "FEEP", "IEV", "IEF", "IVA", "Total")
+
+
+def _numero(valor):
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    return numero_cl(str(valor or "0").strip() or "0")
+
+
+def validar_extraccion(data):
+    """
+    Problemas de la extracción de un modelo: estructura incompleta, litros en cero
+    o totales de 'Detalle de Pago' que no cuadran. Lista vacía si es válida.
+    """
+    factura = (data or {}).get("Factura")
+    if not isinstance(factura, dict):
+        return ["sin 'Factura'"]
+
+    detalle = factura.get("Detalle de productos")
+    pago = factura.get("Detalle de Pago")
+    if not isinstance(detalle, list) or not detalle or not isinstance(detalle[0], dict):
+        return ["sin 'Detalle de productos'"]
+    if not isinstance(pago, dict):
+        return ["sin 'Detalle de Pago'"]
+    faltantes = [c for c in _CAMPOS_DETALLE if c not in detalle[0]] + [c for c in _CAMPOS_PAGO if c not in pago]
+    if not factura.get("Número de factura"):
+        faltantes.append("Número de factura")
+    if faltantes:
+        return [f"faltan campos: {', '.join(faltantes)}"]
+
+    try:
+        linea = {c: _numero(detalle[0].get(c)) for c in _CAMPOS_DETALLE}
+        montos = {c: _numero(pago.get(c)) for c in _CAMPOS_PAGO}
+    except ValueError as e:
+        return [f"número ilegible: {e}"]
+
+    litros = litros_totales_factura(factura)
+    if litros <= 0:
+        return ["litros en cero"]
+    motivo = descuadre(litros, linea["PBASE_SI_U"], montos["Base Afecta"], montos["FEEP"], montos["IEV"],
+                       montos["IEF"], montos["IVA"], montos["Total"])
+    return [motivo] if motivo else []
+
+
+def extraer_con_modelos(pdf_text, archivo):
+    """
+    Extrae la factura probando OCR_MODELOS en orden y escalando al siguiente
+    cuando la respuesta no valida (o la llamada falla). Si el último falla, se
+    usa la extracción con 'Factura' más reciente de un modelo anterior (valida=False).
+    Retorna (data, uso_llm); lanza la excepción del último modelo si ninguno
+    trajo 'Factura', o ValueError si todos respondieron sin ella.
+    """
+    mensajes, detalle = construir_prompt(pdf_text)
+    intentos = []
+    data, problemas, usado = None, None, None
+    for i, modelo in enumerate(OCR_MODELOS):
+        ultimo = i == len(OCR_MODELOS) - 1
+        inicio = time.perf_counter()
+        try:
+            with _llm_cupos:
+                response = openai.chat.completions.create(
+                    model=modelo,
+                    messages=mensajes,
+                    response_format={"type": "json_object"},
+                    temperature=0
+                )
+        except Exception as e:
+            registrar_resultado_modelo(modelo, "errores", (time.perf_counter() - inicio) * 1000)
+            intentos.append({"modelo": modelo, "error": str(e)})
+            if ultimo and usado is None:
+                raise
+            print(f"⚠️ {modelo} falló ({e}); " + ("se usa la extracción de " + usado if ultimo else "se escala"))
+            continue
+
+        uso = registrar_uso_llm(archivo, modelo, response, (time.perf_counter() - inicio) * 1000, detalle)
+        extraido = extract_json(response.choices[0].message.content)
+        problemas_modelo = validar_extraccion(extraido)
+        registrar_resultado_modelo(modelo, "invalidas" if problemas_modelo else "validas")
+        intentos.append({**uso, "problemas": problemas_modelo})
+        # Se conserva la última extracción con estructura, por si los modelos siguientes fallan
+        if extraido and "Factura" in extraido:
+            data, problemas, usado = extraido, problemas_modelo, modelo
+        if not problemas_modelo:
+            break
+        if not ultimo:
+            print(f"⚠️ Extracción de {modelo} no valida ({'; '.join(problemas_modelo)}); se escala")
+
+    registrar_ruta(escalada=len(intentos) > 1)
+    if not data or "Factura" not in data:
+        raise ValueError("OCR sin estructura valida")
+    return data, {"modelo": usado, "escalado": len(intentos) > 1, "valida": not problemas, "intentos": intentos}
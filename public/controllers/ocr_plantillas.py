@@ -0,0 +1,227 @@
+import os
+import re
+
+# "1" activa las plantillas por proveedor; por defecto todo pasa por el LLM
+OCR_PLANTILLAS_ENABLED = os.getenv("OCR_PLANTILLAS_ENABLED", "0") == "1"
+# Diferencia máxima en pesos al cuadrar Base Afecta + FEEP + IEV + IEF + IVA contra el Total
+OCR_PLANTILLA_TOLERANCIA = float(os.getenv("OCR_PLANTILLA_TOLERANCIA", "2"))
+
+_NUM = r"(-?\$?\s*\d{1,3}(?:\.\d{3})*(?:,\d+)?|-?\$?\s*\d+(?:[.,]\d+)?)"
+_MESES = ["ENE", "FEB", "MAR", "ABR", "MAY", "JUN", "JUL", "AGO", "SEP", "OCT", "NOV", "DIC"]
+_MESES_LARGOS = {"ENERO": 1, "FEBRERO": 2, "MARZO": 3, "ABRIL": 4, "MAYO": 5, "JUNIO": 6, "JULIO": 7,
+                 "AGOSTO": 8, "SEPTIEMBRE": 9, "SETIEMBRE": 9, "OCTUBRE": 10, "NOVIEMBRE": 11, "DICIEMBRE": 12}
+_RUT = re.compile(r"(\d{1,2}\.?\d{3}\.?\d{3}-[\dkK])")
+
+
+def _re(patron):
+    return re.compile(patron, re.I)
+
+
+# Etiquetas de una factura electrónica SII de combustible; cada proveedor
+# reemplaza las que difieren en su formato
+ETIQUETAS_DTE = {
+    "numero": _re(r"(?:FOLIO|FACTURA\s+ELECTR[OÓ]NICA)\s*N?[°ºo]?\.?\s*:?\s*(\d+)"),
+    "guia": _re(r"GU[IÍ]A(?:\s+DE\s+DESPACHO)?\s*N?[°ºo]?\.?\s*:?\s*(\d+)"),
+    "fecha": _re(r"FECHA(?:\s+DE)?\s+EMISI[OÓ]N\s*:?\s*(\d{1,2}[-/.]\d{1,2}[-/.]\d{4}|\d{1,2}\s+DE\s+[A-Z]+\s+DEL?\s+\d{4})"),
+    "receptor": _re(r"SE[ÑN]OR(?:\(?ES\)?)?\s*:?\s*([^\n]+)"),
+    "direccion": _re(r"DIRECCI[OÓ]N\s*:?\s*([^\n]+)"),
+    "despacho": _re(r"(?:LUGAR\s+DE\s+)?DESPACHO\s*:\s*([^\n]+)"),
+    "producto": _re(r"((?:PETR[OÓ]LEO\s+)?DI[EÉ]SEL(?:[ \t]+[A-Z]+\d*)*)"),
+    "litros": _re(_NUM + r"\s*(?:LTS?\b\.?|LITROS\b)"),
+    "pbase_u": _re(r"PRECIO\s+(?:BASE|NETO|UNITARIO)[^\n\d$-]*" + _NUM),
+    "iev_u": _re(r"IEV\s+(?:U\b|UNIT\w*)[^\n\d$-]*" + _NUM),
+    "ief_u": _re(r"IEF\s+(?:U\b|UNIT\w*)[^\n\d$-]*" + _NUM),
+    "base_afecta": _re(r"(?:BASE\s+AFECTA|MONTO\s+NETO)[^\n\d$-]*" + _NUM),
+    "feep": _re(r"\bFEEP\b[^\n\d$-]*" + _NUM),
+    "iev": _re(r"(?:\bIEV\b|IMPUESTO\s+ESPEC[IÍ]FICO\s+VARIABLE)(?!\s+(?:U\b|UNIT))[^\n\d$-]*" + _NUM),
+    "ief": _re(r"(?:\bIEF\b|IMPUESTO\s+ESPEC[IÍ]FICO\s+FIJO)(?!\s+(?:U\b|UNIT))[^\n\d$-]*" + _NUM),
+    "iva": _re(r"\bI\.?V\.?A\b\.?(?:\s*\(?\d+(?:[.,]\d+)?\s*%\)?)?[^\n\d$-]*" + _NUM),
+    "total": _re(r"\bTOTAL\b(?:\s+A\s+PAGAR)?[^\n\d$-]*" + _NUM),
+}
+
+# Sin "producto" no se sabe si es combustible: esa factura la decide el LLM
+_OBLIGATORIOS = ("numero", "fecha", "producto", "litros", "pbase_u", "base_afecta", "iva", "total")
+
+
+def numero_cl(texto):
+    """'1.234.567' → 1234567.0 ; '1.234,56' → 1234.56 ; '$ 980,5' → 980.5"""
+    texto = texto.replace("$", "").replace(" ", "")
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    elif texto.count(".") > 1 or re.fullmatch(r"-?\d{1,3}\.\d{3}", texto):
+        texto = texto.replace(".", "")
+    return float(texto)
+
+
+def _fecha_ocr(texto):
+    """Fecha en el formato dd-MMM-yyyy que espera parse_fecha."""
+    texto = texto.strip().upper()
+    m = re.match(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})", texto)
+    if m:
+        dia, mes, anio = int(m.group(1)), int(m.group(2)), m.group(3)
+    else:
+        m = re.match(r"(\d{1,2})\s+DE\s+([A-Z]+)\s+DEL?\s+(\d{4})", texto)
+        if not m or m.group(2) not in _MESES_LARGOS:
+            return None
+        dia, mes, anio = int(m.group(1)), _MESES_LARGOS[m.group(2)], m.group(3)
+    if not 1 <= mes <= 12:
+        return None
+    return f"{dia:02d}-{_MESES[mes - 1]}-{anio}"
+
+
+def descuadre(litros, pbase_u, base_afecta, feep, iev, ief, iva, total):
+    """
+    Cuadratura de una factura de combustible: Base Afecta + FEEP + IEV + IEF + IVA
+    contra el Total, y litros × precio base contra la Base Afecta (1%).
+    Retorna el motivo si no cuadra, o None.
+    """
+    suma = base_afecta + feep + iev + ief + iva
+    if abs(suma - total) > OCR_PLANTILLA_TOLERANCIA:
+        return f"no cuadra: neto + impuestos = {suma:.0f}, total = {total:.0f}"
+    if litros <= 0 or abs(litros * pbase_u - base_afecta) > max(OCR_PLANTILLA_TOLERANCIA, 0.01 * base_afecta):
+        return f"no cuadra: litros × precio base ≠ base afecta ({base_afecta:.0f})"
+    return None
+
+
+class Plantilla:
+    """Extractor por expresiones regulares para el formato fijo de un proveedor."""
+
+    def __init__(self, nombre, ruts, etiquetas=None, ultimo=("total",), muestras=()):
+        self.nombre = nombre
+        self.ruts = ruts
+        self.etiquetas = {**ETIQUETAS_DTE, **(etiquetas or {})}
+        # Campos que aparecen repetidos (p. ej. TOTAL por línea) y se toman del final
+        self.ultimo = ultimo
+        # (texto de una factura real del proveedor, {campo de "Factura" o "Detalle de Pago": valor esperado})
+        self.muestras = muestras
+
+    def verificar(self):
+        """Problemas de la plantilla contra sus muestras; lista vacía si las extrae todas tal cual."""
+        if not self.muestras:
+            return ["sin muestras de facturas reales"]
+        problemas = []
+        for i, (texto, esperado) in enumerate(self.muestras, start=1):
+            data, motivo = self.extraer(texto)
+            if data is None:
+                problemas.append(f"muestra {i}: {motivo}")
+                continue
+            factura = {**data["Factura"], **data["Factura"]["Detalle de Pago"]}
+            problemas += [f"muestra {i}: {campo} = {factura.get(campo)!r}, se esperaba {valor!r}"
+                          for campo, valor in esperado.items() if factura.get(campo) != valor]
+        return problemas
+
+    def _buscar(self, campo, texto):
+        coincidencias = self.etiquetas[campo].findall(texto)
+        if not coincidencias:
+            return None
+        valor = coincidencias[-1] if campo in self.ultimo else coincidencias[0]
+        return valor.strip() if isinstance(valor, str) else valor
+
+    def extraer(self, texto):
+        """
+        Retorna (data, motivo): data en la misma forma {"Factura": {...}} que
+        entrega el LLM, o None con el motivo si falta un campo o no cuadra.
+        """
+        crudo = {campo: self._buscar(campo, texto) for campo in self.etiquetas}
+        faltantes = [c for c in _OBLIGATORIOS if not crudo.get(c)]
+        if faltantes:
+            return None, f"sin {', '.join(faltantes)}"
+
+        try:
+            n = {c: numero_cl(crudo[c]) if crudo.get(c) else 0.0
+                 for c in ("litros", "pbase_u", "iev_u", "ief_u", "base_afecta", "feep", "iev", "ief", "iva", "total")}
+        except ValueError as e:
+            return None, f"número ilegible: {e}"
+        fecha = _fecha_ocr(crudo["fecha"])
+        if not fecha:
+            return None, f"fecha ilegible: {crudo['fecha']}"
+
+        motivo = descuadre(n["litros"], n["pbase_u"], n["base_afecta"], n["feep"], n["iev"], n["ief"], n["iva"], n["total"])
+        if motivo:
+            return None, motivo
+
+        litros = n["litros"]
+        iev_u = n["iev_u"] or round(n["iev"] / litros, 4)
+        ief_u = n["ief_u"] or round(n["ief"] / litros, 4)
+        ruts = _RUT.findall(texto)
+        return {
+            "Factura": {
+                "Empresa del combustible": self.nombre,
+                "RUT_EMISOR": ruts[0] if ruts else "",
+                "Número de factura": crudo["numero"],
+                "Número de guía": crudo.get("guia") or "",
+                "FECHA_EMISION": fecha,
+                "RUT_RECEPTOR": ruts[1] if len(ruts) > 1 else "",
+                "Nombre_Receptor": crudo.get("receptor") or "",
+                "Direccion_Receptor": crudo.get("direccion") or "",
+                "Despacho_Receptor": crudo.get("despacho") or "",
+                "Detalle de productos": [{
+                    "Nombre del producto": crudo["producto"].upper(),
+                    "Cantidad (litros)": litros,
+                    "PBASE_SI_U": n["pbase_u"],
+                    "IEV U": iev_u,
+                    "IEF U": ief_u,
+                    "PTOTAL U": round(n["pbase_u"] + iev_u + ief_u, 4),
+                    "SUBTOTAL": n["base_afecta"],
+                }],
+                "Detalle de Pago": {
+                    "Subtotal": n["base_afecta"],
+                    "Base Afecta": n["base_afecta"],
+                    "FEEP": n["feep"],
+                    "IEV": n["iev"],
+                    "IEF": n["ief"],
+                    "IVA": n["iva"],
+                    "Total": n["total"],
+                },
+            }
+        }, None
+
+
+_PLANTILLAS = {}
+
+
+def _normalizar_rut(rut):
+    return (rut or "").upper().replace("PN", "", 1).replace(".", "").strip()
+
+
+def registrar_plantilla(plantilla):
+    """
+    Activa la plantilla solo si extrae correctamente todas sus muestras: un
+    acierto de plantilla omite el LLM, así que no se usan patrones sin probar.
+    """
+    problemas = plantilla.verificar()
+    if problemas:
+        print(f"⚠️ Plantilla {plantilla.nombre} no registrada: {'; '.join(problemas)}")
+        return None
+    for rut in plantilla.ruts:
+        _PLANTILLAS[_normalizar_rut(rut)] = plantilla
+    return plantilla
+
+
+def plantilla_para(rut):
+    return _PLANTILLAS.get(_normalizar_rut(rut))
+
+
+def extraer_con_plantilla(rut, texto):
+    """
+    Extrae la factura con la plantilla del emisor `rut` (formato de detectar_rut_factura).
+    Retorna (data, nombre_plantilla) o (None, motivo) si no hay plantilla o no cuadra,
+    en cuyo caso se usa el LLM.
+    """
+    if not OCR_PLANTILLAS_ENABLED:
+        return None, "plantillas desactivadas"
+    plantilla = plantilla_para(rut)
+    if plantilla is None:
+        return None, f"sin plantilla para {rut}"
+    data, motivo = plantilla.extraer(texto)
+    if data is None:
+        print(f"⚠️ Plantilla {plantilla.nombre} descartada: {motivo}")
+        return None, f"plantilla {plantilla.nombre}: {motivo}"
+    return data, plantilla.nombre
+
+
+# === PROVEEDORES ===
+# Vacío hasta contar con el texto de facturas reales de cada proveedor. Se agregan con
+# registrar_plantilla(Plantilla("COPEC", ["99520000-7"], etiquetas={campo: regex},
+#                               muestras=[(texto, {"Total": 1234567.0, ...})]))
+# (ENEX 92011000-2, ESMAX 79588870-5).
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import threading
+
+# Tokens máximos del texto de la factura dentro del prompt
+OCR_PROMPT_MAX_TOKENS = int(os.getenv("OCR_PROMPT_MAX_TOKENS", "1500"))
+# Líneas de contexto que se conservan alrededor de cada línea relevante al recortar
+OCR_PROMPT_CONTEXTO = int(os.getenv("OCR_PROMPT_CONTEXTO", "1"))
+# Emite una línea JSON por cada llamada al LLM (tokens y latencia por factura)
+OCR_LLM_LOG = os.getenv("OCR_LLM_LOG", "1") == "1"
+
+try:
+    import tiktoken
+    _codificador = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _codificador = None
+
+
+def contar_tokens(texto):
+    """Tokens del texto (tiktoken si está instalado; si no, ~4 caracteres por token)."""
+    if not texto:
+        return 0
+    if _codificador is not None:
+        return len(_codificador.encode(texto))
+    return (len(texto) + 3) // 4
+
+
+# Misma estructura que espera el resto del pipeline, sin sangría
+PLANTILLA_FACTURA = {
+    "Factura": {
+        "Empresa del combustible": "...",
+        "RUT_EMISOR": "...",
+        "Número de factura": "...",
+        "Número de guía": "...",
+        "FECHA_EMISION": "...",
+        "RUT_RECEPTOR": "...",
+        "Nombre_Receptor": "...",
+        "Direccion_Receptor": "...",
+        "Despacho_Receptor": "...",
+        "Detalle de productos": [{
+            "Nombre del producto": "...", "Cantidad (litros)": 0, "PBASE_SI_U": 0,
+            "IEV U": 0, "IEF U": 0, "PTOTAL U": 0, "SUBTOTAL": 0,
+        }],
+        "Detalle de Pago": {
+            "Subtotal": 0, "Base Afecta": 0, "FEEP": 0, "IEV": 0, "IEF": 0, "IVA": 0, "Total": 0,
+        },
+    }
+}
+
+SISTEMA = "Eres un OCR experto en facturas SAP Business One."
+
+# Texto legal y de timbre que se repite en todas las facturas y no aporta campos
+_RUIDO = re.compile(
+    r"TIMBRE\s+ELECTR[OÓ]NICO|WWW\.SII\.CL|VERIFIQUE\s+(?:ESTE\s+)?DOCUMENTO|RES(?:OLUCI[OÓ]N)?\.?\s*(?:EX\.?|N[°º])"
+    r"|ACUSE\s+DE\s+RECIBO|LEY\s+19\.?983|CEDIBLE|RECINTO\s*:|FIRMA\s*:|P[AÁ]GINA\s+\d+\s+DE\s+\d+",
+    re.I,
+)
+# Líneas con datos que usa la factura: cabecera, detalle de productos y totales
+_RELEVANTE = re.compile(
+    r"FACTURA|FOLIO|R\.?U\.?T|FECHA|SE[ÑN]OR|DIRECCI[OÓ]N|DESPACHO|GU[IÍ]A|GIRO"
+    r"|DI[EÉ]SEL|PETR[OÓ]LEO|GASOLINA|BENCINA|LTS?\b|LITROS|PRECIO|CANTIDAD"
+    r"|\bIEV\b|\bIEF\b|FEEP|NETO|AFECT|EXENTO|I\.?V\.?A\b|TOTAL|ESPEC[IÍ]FICO",
+    re.I,
+)
+
+
+def _es_prosa(linea):
+    """Párrafo largo casi sin cifras (condiciones, cláusulas): no trae campos de la factura."""
+    return len(linea) > 100 and sum(c.isdigit() for c in linea) < len(linea) * 0.05
+
+
+def compactar_texto(texto, max_tokens=OCR_PROMPT_MAX_TOKENS):
+    """
+    Reduce el texto del PDF a lo que necesita la extracción: quita líneas vacías,
+    repetidas (encabezados de cada página) y de texto legal/timbre; si aún supera
+    max_tokens, conserva solo las líneas relevantes con su contexto y trunca.
+    Retorna (texto, detalle).
+    """
+    originales = (texto or "").splitlines()
+    lineas, vistas = [], set()
+    for linea in originales:
+        linea = re.sub(r"\s+", " ", linea).strip()
+        clave = linea.upper()
+        if not linea or clave in vistas or _RUIDO.search(linea):
+            continue
+        vistas.add(clave)
+        lineas.append(linea)
+
+    compacto = "\n".join(lineas)
+    recorte = None
+    if contar_tokens(compacto) > max_tokens:
+        relevantes = [i for i, l in enumerate(lineas) if _RELEVANTE.search(l) and not _es_prosa(l)]
+        conservar = sorted({j for i in relevantes
+                            for j in range(max(0, i - OCR_PROMPT_CONTEXTO), min(len(lineas), i + OCR_PROMPT_CONTEXTO + 1))})
+        compacto = "\n".join(lineas[i] for i in conservar if not _es_prosa(lineas[i]))
+        recorte = "relevantes"
+        if contar_tokens(compacto) > max_tokens:
+            # Se conserva el comienzo (cabecera y detalle) y el final (totales)
+            limite = max_tokens * len(compacto) // max(contar_tokens(compacto), 1)
+            compacto = compacto[:limite * 2 // 3] + "\n...\n" + compacto[-(limite // 3):]
+            recorte = "truncado"
+
+    return compacto, {
+        "tokens_texto_original": contar_tokens(texto),
+        "tokens_texto": contar_tokens(compacto),
+        "lineas_originales": len(originales),
+        "lineas": compacto.count("\n") + 1 if compacto else 0,
+        "recorte": recorte,
+    }
+
+
+def construir_prompt(pdf_text):
+    """Mensajes para el LLM con el texto compactado. Retorna (mensajes, detalle)."""
+    texto, detalle = compactar_texto(pdf_text)
+    prompt = (
+        "Extrae los datos de la siguiente factura y devuélvelos en formato JSON limpio para SAP B1, "
+        "con exactamente esta estructura:\n"
+        f"{json.dumps(PLANTILLA_FACTURA, ensure_ascii=False, separators=(',', ':'))}\n\n"
+        "SOLO responde con JSON válido, sin texto adicional.\n\n"
+        f"Texto OCR:\n{texto}\n"
+    )
+    detalle["tokens_prompt_estimados"] = contar_tokens(SISTEMA) + contar_tokens(prompt)
+    return [{"role": "system", "content": SISTEMA}, {"role": "user", "content": prompt}], detalle
+
+
+# === USO DEL LLM ===
+_uso = {"llamadas": 0, "tokens_entrada": 0, "tokens_salida": 0, "ms": 0.0, "tokens_texto_original": 0, "tokens_texto": 0,
+        "facturas": 0, "escaladas": 0}
+_por_modelo = {}
+_uso_lock = threading.Lock()
+
+
+def _modelo(modelo):
+    return _por_modelo.setdefault(modelo, {"llamadas": 0, "ms": 0.0, "max_ms": 0.0, "tokens_entrada": 0,
+                                           "tokens_salida": 0, "validas": 0, "invalidas": 0, "errores": 0})
+
+
+def registrar_uso_llm(archivo, modelo, respuesta, ms, detalle):
+    """
+    Tokens de entrada/salida informados por OpenAI para una factura, más el
+    ahorro del compactado. Retorna el dict que se agrega a la respuesta del upload.
+    """
+    usage = getattr(respuesta, "usage", None)
+    registro = {
+        "archivo": archivo,
+        "modelo": modelo,
+        "tokens_entrada": getattr(usage, "prompt_tokens", None),
+        "tokens_salida": getattr(usage, "completion_tokens", None),
+        "ms": round(ms, 1),
+        **detalle,
+    }
+    with _uso_lock:
+        _uso["llamadas"] += 1
+        _uso["ms"] += ms
+        for clave in ("tokens_entrada", "tokens_salida", "tokens_texto_original", "tokens_texto"):
+            _uso[clave] += registro.get(clave) or 0
+        m = _modelo(modelo)
+        m["llamadas"] += 1
+        m["ms"] += ms
+        m["max_ms"] = max(m["max_ms"], ms)
+        m["tokens_entrada"] += registro["tokens_entrada"] or 0
+        m["tokens_salida"] += registro["tokens_salida"] or 0
+    if OCR_LLM_LOG:
+        print(json.dumps({"ocr_llm": registro}, ensure_ascii=False, default=str))
+    return registro
+
+
+def registrar_resultado_modelo(modelo, resultado, ms=None):
+    """resultado: 'validas', 'invalidas' o 'errores' (la llamada falló; ms = tiempo perdido)."""
+    with _uso_lock:
+        m = _modelo(modelo)
+        m[resultado] += 1
+        if ms is not None:
+            m["ms"] += ms
+
+
+def registrar_ruta(escalada):
+    """Una factura resuelta por el router; escalada=True si necesitó más de un modelo."""
+    with _uso_lock:
+        _uso["facturas"] += 1
+        _uso["escaladas"] += 1 if escalada else 0
+
+
+def estado_llm():
+    with _uso_lock:
+        uso = dict(_uso)
+        por_modelo = {k: dict(v) for k, v in _por_modelo.items()}
+    n = uso["llamadas"] or 1
+    uso["promedio"] = {
+        "tokens_entrada": round(uso["tokens_entrada"] / n, 1),
+        "tokens_salida": round(uso["tokens_salida"] / n, 1),
+        "ms": round(uso["ms"] / n, 1),
+    }
+    uso["ms"] = round(uso["ms"], 1)
+    uso["reduccion_texto"] = (round(1 - uso["tokens_texto"] / uso["tokens_texto_original"], 3)
+                              if uso["tokens_texto_original"] else None)
+    uso["tasa_escalamiento"] = round(uso["escaladas"] / uso["facturas"], 3) if uso["facturas"] else None
+    for m in por_modelo.values():
+        intentos = m["llamadas"] + m["errores"]
+        m["promedio_ms"] = round(m["ms"] / intentos, 1) if intentos else None
+        m["tasa_validas"] = round(m["validas"] / m["llamadas"], 3) if m["llamadas"] else None
+        m["ms"] = round(m["ms"], 1)
+        m["max_ms"] = round(m["max_ms"], 1)
+    uso["por_modelo"] = por_modelo
+    return uso
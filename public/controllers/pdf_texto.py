@@ -0,0 +1,140 @@
+import io
+import os
+import re
+import time
+import queue
+import threading
+import multiprocessing
+
+import PyPDF2
+
+# Procesos que extraen texto de PDFs (trabajo de CPU, fuera del GIL de los requests)
+OCR_PDF_PROCESOS = int(os.getenv("OCR_PDF_PROCESOS", "2"))
+# Páginas máximas que se leen por documento
+OCR_PDF_MAX_PAGINAS = int(os.getenv("OCR_PDF_MAX_PAGINAS", "10"))
+# Tiempo máximo de lectura por documento (segundos)
+OCR_PDF_TIMEOUT_S = float(os.getenv("OCR_PDF_TIMEOUT_S", "20"))
+# Una página con menos caracteres que esto se considera escaneada (sin capa de texto)
+OCR_PDF_MIN_CARACTERES = int(os.getenv("OCR_PDF_MIN_CARACTERES", "20"))
+
+# Bloque de totales de la factura: con él ya está todo lo que usa el OCR
+_TOTALES = re.compile(r"\bI\.?V\.?A\b.*?\bTOTAL\b[^\n\d]*\$?\s*\d", re.I | re.S)
+
+# spawn: el proceso de Flask tiene hilos (requests, outbox, espejo, SSE) y un fork heredaría sus locks tomados
+_contexto = multiprocessing.get_context("spawn")
+_cupos = threading.BoundedSemaphore(max(OCR_PDF_PROCESOS, 1))
+_libres = queue.LifoQueue()
+
+
+def _pagina_suelta(pagina):
+    """PDF de una sola página; mismo contenido → mismos bytes (sirve de clave de cache)."""
+    writer = PyPDF2.PdfWriter()
+    writer.add_page(pagina)
+    salida = io.BytesIO()
+    writer.write(salida)
+    return salida.getvalue()
+
+
+def extraer_paginas(pdf_bytes, max_paginas=OCR_PDF_MAX_PAGINAS, limite_s=OCR_PDF_TIMEOUT_S):
+    """
+    Lee el PDF página a página y se detiene al encontrar el bloque de totales,
+    al llegar a max_paginas o al pasar limite_s. Se ejecuta en el pool de procesos.
+    Retorna {"texto", "textos", "paginas": [{"pagina", "ms", "caracteres"}], "total_paginas",
+    "corte", "sin_texto": {pagina: PDF de esa sola página}} (sin_texto: páginas para OCR local).
+    """
+    inicio = time.perf_counter()
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    total_paginas = len(reader.pages)
+    textos, paginas, sin_texto, corte = [], [], {}, None
+
+    for numero, pagina in enumerate(reader.pages, start=1):
+        if numero > max_paginas:
+            corte = "paginas"
+            break
+        if time.perf_counter() - inicio > limite_s:
+            corte = "tiempo"
+            break
+        t = time.perf_counter()
+        texto = pagina.extract_text() or ""
+        textos.append(texto)
+        paginas.append({"pagina": numero, "ms": round((time.perf_counter() - t) * 1000, 1), "caracteres": len(texto)})
+        if len(texto.strip()) < OCR_PDF_MIN_CARACTERES:
+            sin_texto[numero] = _pagina_suelta(pagina)
+        if _TOTALES.search(texto):
+            if numero < total_paginas:
+                corte = "totales"
+            break
+
+    return {"texto": "".join(textos), "textos": textos, "paginas": paginas, "total_paginas": total_paginas,
+            "corte": corte, "sin_texto": sin_texto, "ms": round((time.perf_counter() - inicio) * 1000, 1)}
+
+
+def _servir(conexion):
+    """Ciclo del proceso lector: recibe PDFs por la conexión y responde (ok, resultado | excepción)."""
+    while True:
+        try:
+            pdf_bytes = conexion.recv()
+        except EOFError:
+            return
+        try:
+            conexion.send((True, extraer_paginas(pdf_bytes)))
+        except Exception as e:
+            conexion.send((False, ValueError(f"{type(e).__name__}: {e}")))
+
+
+class _Lector:
+    """
+    Proceso dedicado que lee un PDF a la vez. Si un documento excede el tiempo
+    se termina solo este proceso; los demás siguen con sus lecturas.
+    """
+
+    def __init__(self):
+        self.conexion, hijo = _contexto.Pipe()
+        self.proceso = _contexto.Process(target=_servir, args=(hijo,), name="pdf-texto", daemon=True)
+        self.proceso.start()
+        hijo.close()
+
+    def leer(self, pdf_bytes, timeout):
+        self.conexion.send(pdf_bytes)
+        if not self.conexion.poll(timeout):
+            raise TimeoutError(f"Lectura de PDF excedió {OCR_PDF_TIMEOUT_S:.0f}s")
+        ok, resultado = self.conexion.recv()
+        if not ok:
+            raise resultado
+        return resultado
+
+    def cerrar(self):
+        self.proceso.terminate()
+        self.proceso.join(1)
+        self.conexion.close()
+
+
+def leer_texto_pdf(pdf_bytes):
+    """
+    Extrae el texto en un proceso lector (ver extraer_paginas), hasta
+    OCR_PDF_PROCESOS a la vez. Lanza TimeoutError si el documento supera
+    OCR_PDF_TIMEOUT_S y ValueError si el archivo no es un PDF válido.
+    """
+    if OCR_PDF_PROCESOS <= 0:
+        return extraer_paginas(pdf_bytes)
+    with _cupos:
+        try:
+            lector = _libres.get_nowait()
+        except queue.Empty:
+            lector = _Lector()
+        try:
+            # Margen sobre el límite interno: una sola página puede tardar más que el resto
+            resultado = lector.leer(pdf_bytes, OCR_PDF_TIMEOUT_S + 5)
+        except ValueError:
+            _libres.put(lector)
+            raise
+        except TimeoutError:
+            # No se puede interrumpir una página a medias: se termina el proceso para liberar la CPU
+            lector.cerrar()
+            raise
+        except (EOFError, OSError) as e:
+            lector.cerrar()
+            print(f"⚠️ Proceso de lectura PDF caído ({e}); se lee en el hilo actual")
+            return extraer_paginas(pdf_bytes)
+        _libres.put(lector)
+        return resultado
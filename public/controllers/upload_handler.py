@@ -1,17 +1,25 @@
 import os
+import io
 import json
+import time
 import shutil
+import zipfile
+import threading
 import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import openai
 
 from controllers.validations import (
-    registrar_log, leer_pdf, extract_json, es_factura_combustible
+    registrar_log, leer_pdf_detallado, es_factura_combustible
 )
-from controllers_sap.sap_service import SAPServiceLayer
+from controllers.ocr_cache import hash_pdf, leer_cache_ocr, guardar_cache_ocr, eliminar_cache_ocr, estado_cache_ocr
+from controllers.ocr_plantillas import extraer_con_plantilla
+from controllers.ocr_prompt import estado_llm
+from controllers.ocr_modelos import extraer_con_modelos
+from controllers.ocr_jobs import encolar_ocr, consultar_ocr, esperar_ocr
+from controllers_sap.sap_service import sap_session
 from controllers_sap.sap_getters import (
-    get_vendor_by_rut, get_item_by_description, get_warehouse_by_code
+    get_vendor_by_rut, get_item_by_description, get_item_candidates, get_warehouse_by_code
 )
 
 upload_bp = Blueprint("upload_bp", __name__)
@@ -22,6 +30,23 @@ PUBLIC_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
 OUTSTANDING_DIR = os.path.join(PUBLIC_DIR, "outstanding")
 UPLOADS_DIR = os.path.join(PUBLIC_DIR, "uploads")
 
+# "1" encola el OCR de /upload y responde con el id del trabajo; "0" procesa en el request
+OCR_ASYNC = os.getenv("OCR_ASYNC", "1") == "1"
+# Máximo de PDFs por carga masiva (sumando los que vienen dentro de ZIPs)
+OCR_LOTE_MAX = int(os.getenv("OCR_LOTE_MAX", "100"))
+# PDFs de una misma carga masiva en proceso a la vez (el pool OCR_WORKERS es compartido)
+OCR_LOTE_PARALELO = int(os.getenv("OCR_LOTE_PARALELO", "2"))
+# MB máximos de cada PDF de una carga masiva (descomprimido, si viene en un ZIP)
+OCR_LOTE_MAX_MB = float(os.getenv("OCR_LOTE_MAX_MB", "20"))
+# MB máximos de una carga masiva completa, sumando los PDFs descomprimidos
+OCR_LOTE_MAX_TOTAL_MB = float(os.getenv("OCR_LOTE_MAX_TOTAL_MB", "300"))
+# Consultas a SAP del pipeline OCR en curso a la vez en todo el proceso (uploads y cargas masivas)
+OCR_SAP_PARALELO = int(os.getenv("OCR_SAP_PARALELO", "2"))
+
+_sap_cupos = threading.BoundedSemaphore(OCR_SAP_PARALELO)
+# Segundos entre líneas de avance del stream mientras no termina ningún PDF
+OCR_LOTE_AVANCE_S = float(os.getenv("OCR_LOTE_AVANCE_S", "2"))
+
 def detectar_rut_factura(pdf_text: str) -> str:
     import re
     rut_pattern = re.compile(r"(\d{1,2}\.?\d{3}\.?\d{3}-[\dkK])")
@@ -45,10 +70,8 @@ def detectar_almacen(pdf_text: str) -> str:
 def obtener_ultima_solicitud_sap():
 
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("PurchaseRequests?$orderby=DocNum desc&$top=1")
-        sap.logout()
+        with _sap_cupos, sap_session() as sap:
+            ok, data = sap.get("PurchaseRequests?$orderby=DocNum desc&$top=1")
 
         if ok and data.get("value"):
             ultimo_docnum = int(data["value"][0].get("DocNum", 0))
@@ -84,93 +107,96 @@ def upload_temp():
         print(f"Error guardando PDF temporal: {e}")
         return jsonify({"status": "error", "error": str(e)}), 500
 
-@upload_bp.route("/upload", methods=["POST"])
-def upload_file():
-    """Procesa OCR, genera el JSON y lo mueve a Uploads."""
-    print("[UPLOAD] Procesando OCR...")
+def _mover_a_uploads(temp_path, filename, data, solicitud_sap_num):
+    """Escribe el JSON OCR y mueve JSON + PDF de Outstanding a Uploads."""
+    # === GUARDAR JSON TEMPORAL ===
+    json_name = filename.replace(".pdf", ".json")
+    json_path_temp = os.path.join(OUTSTANDING_DIR, json_name)
+    with open(json_path_temp, "w", encoding="utf-8") as jf:
+        json.dump(data, jf, indent=2, ensure_ascii=False)
+    print(f"JSON OCR guardado en Outstanding: {json_path_temp}")
 
-    if "file" not in request.files:
-        return jsonify({"error": "Falta archivo PDF"}), 400
+    # === MOVER JSON + PDF ===
+    fecha_hoy = datetime.datetime.now().strftime("%Y%m%d")
+    json_final_name = f"{solicitud_sap_num}_{fecha_hoy}_{json_name}"
+    pdf_final_name = f"{solicitud_sap_num}_{fecha_hoy}_{filename}"
 
-    file = request.files["file"]
-    if not file.filename:
-        return jsonify({"error": "Archivo vacio"}), 400
+    destino_json = os.path.join(UPLOADS_DIR, json_final_name)
+    destino_pdf = os.path.join(UPLOADS_DIR, pdf_final_name)
 
-    filename = secure_filename(file.filename)
-    temp_path = os.path.join(OUTSTANDING_DIR, filename)
-    file.save(temp_path)
-    print(f"Archivo temporal guardado en: {temp_path}")
+    try:
+        shutil.move(json_path_temp, destino_json)
+        print(f"JSON movido a Uploads → {destino_json}")
+    except Exception as e:
+        print(f"No se pudo mover JSON a Uploads: {e}")
 
+    try:
+        shutil.move(temp_path, destino_pdf)
+        print(f" PDF movido a Uploads → {destino_pdf}")
+    except Exception as e:
+        print(f" No se pudo mover PDF a Uploads: {e}")
+
+
+def _desde_cache(hash_contenido, temp_path, filename):
+    """
+    Resultado de un OCR anterior del mismo PDF (mismo contenido), o None.
+    Solo se vuelve a pedir a SAP el número sugerido de solicitud, que cambia con el tiempo.
+    """
+    en_cache = leer_cache_ocr(hash_contenido)
+    if en_cache is None:
+        return None
+    http, cuerpo = en_cache
+    print(f"⚡ OCR en cache para {filename} ({hash_contenido[:12]})")
+
+    solicitud_sap_num = obtener_ultima_solicitud_sap() or "000"
+    _mover_a_uploads(temp_path, filename, cuerpo["ocr_data"], solicitud_sap_num)
+    return http, {**cuerpo, "archivo_pdf": filename, "solicitud_sap": solicitud_sap_num, "cache_hit": True}
+
+
+def _sin_avance(etapa, progreso):
+    pass
+
+
+def procesar_factura(temp_path, filename, revisar_cache=True, avance=_sin_avance):
+    """
+    Pipeline OCR de una factura ya guardada en Outstanding: lee el PDF, consulta
+    OpenAI y SAP, y deja JSON + PDF en Uploads. avance(etapa, progreso) recibe
+    cada etapa. revisar_cache=False cuando quien llama ya consultó el cache.
+    Retorna (http_status, cuerpo).
+    """
     try:
         # === LEER PDF ===
+        avance("Leyendo PDF", 5)
         with open(temp_path, "rb") as f:
             pdf_bytes = f.read()
-        ok_pdf, pdf_text = leer_pdf(pdf_bytes)
+        hash_contenido = hash_pdf(pdf_bytes)
+        en_cache = _desde_cache(hash_contenido, temp_path, filename) if revisar_cache else None
+        if en_cache:
+            return en_cache
+
+        ok_pdf, pdf_text, lectura_pdf = leer_pdf_detallado(pdf_bytes)
         if not ok_pdf:
             registrar_log(None, "RECHAZADO", pdf_text)
-            return jsonify({"status": "rechazado", "mensaje": pdf_text}), 400
+            return 400, {"status": "rechazado", "mensaje": pdf_text}
 
         # === DETECTAR DATOS BASE ===
+        avance("Detectando proveedor y almacén", 15)
         rut_proveedor = detectar_rut_factura(pdf_text)
         almacen = detectar_almacen(pdf_text)
         solicitud_sap_num = obtener_ultima_solicitud_sap() or "000"
 
-        # === GPT OCR ===
-        prompt = f"""
-Extrae los datos de la siguiente factura y devuélvelos en formato JSON limpio para SAP B1:
-
-{{
-  "Factura": {{
-    "Empresa del combustible": "...",
-    "RUT_EMISOR": "...",
-    "Número de factura": "...",
-    "Número de guía": "...",
-    "FECHA_EMISION": "...",
-    "RUT_RECEPTOR": "...",
-    "Nombre_Receptor": "...",
-    "Direccion_Receptor": "...",
-    "Despacho_Receptor": "...",
-    "Detalle de productos": [
-      {{
-        "Nombre del producto": "...",
-        "Cantidad (litros)": 0,
-        "PBASE_SI_U": 0,
-        "IEV U": 0,
-        "IEF U": 0,
-        "PTOTAL U": 0,
-        "SUBTOTAL: 0
-      }}
-    ],
-    "Detalle de Pago": {{
-      "Subtotal": 0,
-      "Base Afecta": 0,
-      "FEEP": 0,
-      "IEV": 0,
-      "IEF": 0,
-      "IVA": 0,
-      "Total": 0
-    }}
-  }}
-}}
-
-SOLO responde con JSON válido, sin texto adicional.
-
-Texto OCR:
-{pdf_text}
-"""
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Eres un OCR experto en facturas SAP Business One."},
-                {"role": "user", "content": prompt},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0
-        )
-
-        data = extract_json(response.choices[0].message.content)
-        if not data or "Factura" not in data:
-            raise ValueError("OCR sin estructura valida")
+        # === EXTRACCIÓN: plantilla del proveedor o GPT ===
+        uso_llm = None
+        data, extractor = extraer_con_plantilla(rut_proveedor, pdf_text)
+        if data:
+            avance(f"Datos extraídos con plantilla {extractor}", 70)
+            extractor = f"plantilla:{extractor}"
+        else:
+            print(f"[UPLOAD] Extracción con LLM ({extractor})")
+            avance("Extrayendo datos con OCR", 25)
+            data, uso_llm = extraer_con_modelos(pdf_text, filename)
+            extractor = f"llm:{uso_llm['modelo']}"
+            avance("Validando datos extraídos", 70)
 
         factura = data["Factura"]
         detalle = factura.get("Detalle de productos", [{}])[0]
@@ -179,12 +205,16 @@ Texto OCR:
 
         if not es_factura_combustible(data):
             registrar_log(None, "RECHAZADO", "Factura no corresponde a combustible")
-            return jsonify({"status": "rechazado", "mensaje": "Factura no corresponde a combustible"}), 200
+            return 200, {"status": "rechazado", "mensaje": "Factura no corresponde a combustible",
+                         "cache_hit": False, "lectura_pdf": lectura_pdf, "uso_llm": uso_llm}
 
         # === DATOS SAP
-        sap_vendor = get_vendor_by_rut(rut_proveedor.replace("PN", ""))
-        sap_item = get_item_by_description(desc_producto)
-        sap_whs = get_warehouse_by_code(almacen)
+        avance("Buscando proveedor, artículo y almacén en SAP", 80)
+        with _sap_cupos:
+            sap_vendor = get_vendor_by_rut(rut_proveedor.replace("PN", ""))
+            sap_item = get_item_by_description(desc_producto)
+            item_alternativas = get_item_candidates(desc_producto)
+            sap_whs = get_warehouse_by_code(almacen)
 
         def safe_utf8(val):
             if isinstance(val, str):
@@ -201,52 +231,260 @@ Texto OCR:
         precio_unitario = float(detalle.get("PBASE_SI_U", 0))
         tax_code = "FUEL" if es_factura_combustible(data) else "FUEL"
 
-        # === GUARDAR JSON TEMPORAL ===
-        json_name = filename.replace(".pdf", ".json")
-        json_path_temp = os.path.join(OUTSTANDING_DIR, json_name)
-        with open(json_path_temp, "w", encoding="utf-8") as jf:
-            json.dump(data, jf, indent=2, ensure_ascii=False)
-        print(f"JSON OCR guardado en Outstanding: {json_path_temp}")
-
-        # === MOVER JSON + PDF ===
-        fecha_hoy = datetime.datetime.now().strftime("%Y%m%d")
-        json_final_name = f"{solicitud_sap_num}_{fecha_hoy}_{json_name}"
-        pdf_final_name = f"{solicitud_sap_num}_{fecha_hoy}_{filename}"
-
-        destino_json = os.path.join(UPLOADS_DIR, json_final_name)
-        destino_pdf = os.path.join(UPLOADS_DIR, pdf_final_name)
-
-        try:
-            shutil.move(json_path_temp, destino_json)
-            print(f"JSON movido a Uploads → {destino_json}")
-        except Exception as e:
-            print(f"No se pudo mover JSON a Uploads: {e}")
-
-        try:
-            shutil.move(temp_path, destino_pdf)
-            print(f" PDF movido a Uploads → {destino_pdf}")
-        except Exception as e:
-            print(f" No se pudo mover PDF a Uploads: {e}")
+        # === GUARDAR JSON + PDF EN UPLOADS ===
+        avance("Guardando resultado", 95)
+        _mover_a_uploads(temp_path, filename, data, solicitud_sap_num)
 
         # === RESPUESTA FINAL AL FRONT ===
-        return jsonify({
+        cuerpo = {
             "status": "ok",
             "mensaje": "OCR procesado correctamente",
-            "archivo_pdf": filename,
-            "solicitud_sap": solicitud_sap_num,
             "litros": litros_factura,
             "precio_unitario": precio_unitario,
             "tax_code": tax_code,
             "item_code": item_code,
             "descripcion": item_name,
+            "item_alternativas": item_alternativas,
             "sap_vendor_name": proveedor_nombre,
             "sap_vendor_code": proveedor_rut,
             
             "sap_whs_name": whs_name,
-            "ocr_data": data
-        }), 200
+            "ocr_data": data,
+            "extractor": extractor,
+        }
+        guardar_cache_ocr(hash_contenido, 200, cuerpo)
+        return 200, {**cuerpo, "archivo_pdf": filename, "solicitud_sap": solicitud_sap_num, "cache_hit": False,
+                     "lectura_pdf": lectura_pdf, "uso_llm": uso_llm}
 
     except Exception as e:
         print(f"❌ Error procesando PDF: {e}")
         registrar_log(None, "ERROR_UPLOAD", str(e))
-        return jsonify({"error": str(e)}), 500
+        return 500, {"error": str(e)}
+
+
+@upload_bp.route("/upload", methods=["POST"])
+def upload_file():
+    """
+    Guarda el PDF en Outstanding y encola el OCR; responde 202 con el id del
+    trabajo para consultar su avance en /upload/estado/<id_job>.
+    Con ?async=0 (u OCR_ASYNC=0) procesa en el mismo request como antes;
+    con ?refrescar=1 ignora el cache y vuelve a hacer el OCR.
+    """
+    print("[UPLOAD] Procesando OCR...")
+
+    if "file" not in request.files:
+        return jsonify({"error": "Falta archivo PDF"}), 400
+
+    file = request.files["file"]
+    if not file.filename:
+        return jsonify({"error": "Archivo vacio"}), 400
+
+    filename = secure_filename(file.filename)
+    temp_path = os.path.join(OUTSTANDING_DIR, filename)
+    file.save(temp_path)
+    print(f"Archivo temporal guardado en: {temp_path}")
+
+    # Un PDF ya procesado responde de inmediato, sin pasar por la cola
+    en_cache = None
+    if request.args.get("refrescar") != "1":
+        with open(temp_path, "rb") as f:
+            en_cache = _desde_cache(hash_pdf(f.read()), temp_path, filename)
+    if en_cache:
+        http, cuerpo = en_cache
+        return jsonify(cuerpo), http
+
+    if request.args.get("async", "1" if OCR_ASYNC else "0") != "1":
+        http, cuerpo = procesar_factura(temp_path, filename, False)
+        return jsonify(cuerpo), http
+
+    id_job = encolar_ocr(procesar_factura, temp_path, filename, False, archivo=filename)
+    return jsonify({
+        "status": "encolado",
+        "mensaje": "OCR en proceso",
+        "id_job": id_job,
+        "estado_url": f"/upload/estado/{id_job}",
+    }), 202
+
+
+@upload_bp.route("/upload/estado/<id_job>", methods=["GET"])
+def estado_upload(id_job):
+    trabajo = consultar_ocr(id_job)
+    if trabajo is None:
+        return jsonify({"status": "error", "mensaje": f"No existe el trabajo OCR {id_job}."}), 404
+    return jsonify({"status": "ok", "data": trabajo}), 200
+
+
+@upload_bp.route("/upload/cache", methods=["GET"])
+def estado_cache():
+    return jsonify({"status": "ok", "data": estado_cache_ocr()}), 200
+
+
+@upload_bp.route("/upload/cache/<hash_contenido>", methods=["DELETE"])
+def eliminar_cache(hash_contenido):
+    try:
+        eliminado = eliminar_cache_ocr(hash_contenido.lower())
+    except Exception as e:
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+    if not eliminado:
+        return jsonify({"status": "error", "mensaje": f"No hay OCR en cache para {hash_contenido}."}), 404
+    return jsonify({"status": "ok", "mensaje": "Entrada eliminada del cache OCR."}), 200
+
+
+@upload_bp.route("/upload/llm", methods=["GET"])
+def estado_uso_llm():
+    return jsonify({"status": "ok", "data": estado_llm()}), 200
+
+
+# === CARGA MASIVA ===
+def _nombre_unico(nombre, usados):
+    """Evita que dos PDFs de la misma carga se pisen en Outstanding."""
+    base, ext = os.path.splitext(nombre)
+    candidato, n = nombre, 1
+    while candidato in usados:
+        n += 1
+        candidato = f"{base}_{n}{ext}"
+    usados.add(candidato)
+    return candidato
+
+
+def _leer_limitado(origen, limite):
+    """Lee hasta limite bytes; None si el contenido es más grande (no se confía en el tamaño declarado del ZIP)."""
+    contenido = origen.read(limite + 1)
+    return None if len(contenido) > limite else contenido
+
+
+def _pdfs_del_request(archivos):
+    """
+    Lista de (nombre, bytes | None, motivo_rechazo) con los PDFs enviados,
+    sueltos o dentro de ZIPs. Dentro de un ZIP solo se consideran los PDFs (los
+    ZIP del SII traen además el XML de cada factura). Un PDF de más de
+    OCR_LOTE_MAX_MB se rechaza sin leerlo completo. Lanza ValueError si se supera OCR_LOTE_MAX o OCR_LOTE_MAX_TOTAL_MB.
+    """
+    limite = int(OCR_LOTE_MAX_MB * 1024 * 1024)
+    limite_total = int(OCR_LOTE_MAX_TOTAL_MB * 1024 * 1024)
+    excede = f"PDF supera {OCR_LOTE_MAX_MB:g} MB"
+    pdfs, total = [], 0
+
+    def agregar(nombre, contenido, motivo=None):
+        nonlocal total
+        if contenido is None and not motivo:
+            motivo = excede
+        pdfs.append((nombre, contenido, motivo))
+        total += len(contenido or b"")
+        if len(pdfs) > OCR_LOTE_MAX:
+            raise ValueError(f"Máximo {OCR_LOTE_MAX} archivos por carga.")
+        if total > limite_total:
+            raise ValueError(f"La carga supera {OCR_LOTE_MAX_TOTAL_MB:g} MB descomprimidos.")
+
+    for file in archivos:
+        nombre = secure_filename(file.filename or "")
+        if nombre.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(file.read())) as zf:
+                    miembros = [info for info in zf.infolist()
+                                if not info.is_dir() and not info.filename.startswith("__MACOSX")
+                                and info.filename.lower().endswith(".pdf")]
+                    if not miembros:
+                        agregar(nombre, None, "ZIP sin PDFs")
+                    for info in miembros:
+                        interno = secure_filename(os.path.basename(info.filename)) or "factura.pdf"
+                        if info.file_size > limite:
+                            agregar(interno, None)
+                        else:
+                            with zf.open(info) as miembro:
+                                agregar(interno, _leer_limitado(miembro, limite))
+            except zipfile.BadZipFile:
+                agregar(nombre, None, "ZIP inválido")
+        elif nombre.lower().endswith(".pdf"):
+            agregar(nombre, _leer_limitado(file, limite))
+        else:
+            agregar(nombre or "(sin nombre)", None, "No es un PDF")
+    return pdfs
+
+
+def _linea(**datos):
+    return json.dumps(datos, ensure_ascii=False, default=str) + "\n"
+
+
+@upload_bp.route("/upload/lote", methods=["POST"])
+def upload_lote():
+    """
+    Carga masiva: recibe varios PDFs y/o ZIPs en el campo 'files' y los pasa por
+    el pipeline OCR, OCR_LOTE_PARALELO a la vez. Responde NDJSON: una línea
+    'inicio', una 'resultado' por archivo a medida que terminan (con líneas
+    'avance' entre medio) y una 'fin' con el resumen. ?refrescar=1 ignora el cache.
+    """
+    archivos = request.files.getlist("files") or request.files.getlist("file")
+    refrescar = request.args.get("refrescar") == "1"
+    if not archivos:
+        return jsonify({"status": "error", "mensaje": "No se recibieron archivos"}), 400
+    try:
+        pdfs = _pdfs_del_request(archivos)
+    except ValueError as e:
+        return jsonify({"status": "error", "mensaje": str(e)}), 400
+
+    # Se guardan antes de empezar el stream: el request ya no está disponible dentro del generador
+    usados, nombres, pendientes, inmediatos = set(), [], [], []
+    for indice, (nombre, contenido, motivo) in enumerate(pdfs):
+        nombre = _nombre_unico(nombre, usados)
+        nombres.append(nombre)
+        if motivo:
+            inmediatos.append((indice, nombre, 400, {"status": "rechazado", "mensaje": motivo}))
+            continue
+        temp_path = os.path.join(OUTSTANDING_DIR, nombre)
+        with open(temp_path, "wb") as f:
+            f.write(contenido)
+        pendientes.append((indice, nombre, temp_path, hash_pdf(contenido)))
+    print(f"[UPLOAD] Carga masiva: {len(pendientes)} PDFs ({len(inmediatos)} rechazados sin procesar)")
+
+    def generar():
+        inicio = time.time()
+        resumen = {"ok": 0, "rechazados": 0, "errores": 0, "cache_hits": 0}
+
+        def resultado(indice, nombre, http, cuerpo):
+            if http >= 500:
+                resumen["errores"] += 1
+            elif cuerpo.get("status") == "ok":
+                resumen["ok"] += 1
+            else:
+                resumen["rechazados"] += 1
+            if cuerpo.get("cache_hit"):
+                resumen["cache_hits"] += 1
+            return _linea(tipo="resultado", indice=indice, archivo=nombre, http=http, **cuerpo)
+
+        yield _linea(tipo="inicio", total=len(pdfs), archivos=nombres)
+        for indice, nombre, http, cuerpo in inmediatos:
+            yield resultado(indice, nombre, http, cuerpo)
+
+        en_vuelo = {}
+        while pendientes or en_vuelo:
+            while pendientes and len(en_vuelo) < OCR_LOTE_PARALELO:
+                indice, nombre, temp_path, hash_contenido = pendientes.pop(0)
+                en_cache = None if refrescar else _desde_cache(hash_contenido, temp_path, nombre)
+                if en_cache:
+                    yield resultado(indice, nombre, *en_cache)
+                    continue
+                id_job = encolar_ocr(procesar_factura, temp_path, nombre, False, archivo=nombre)
+                en_vuelo[id_job] = (indice, nombre)
+
+            if not en_vuelo:
+                continue
+            terminados = esperar_ocr(list(en_vuelo), OCR_LOTE_AVANCE_S)
+            if not terminados:
+                avance = [consultar_ocr(i) or {} for i in en_vuelo]
+                yield _linea(tipo="avance", en_proceso=[
+                    {"archivo": t.get("archivo"), "etapa": t.get("etapa"), "progreso": t.get("progreso")}
+                    for t in avance
+                ])
+                continue
+            for id_job in terminados:
+                indice, nombre = en_vuelo.pop(id_job)
+                trabajo = consultar_ocr(id_job) or {"http": 500, "resultado": {"error": "Trabajo expirado"}}
+                yield resultado(indice, nombre, trabajo["http"], {**trabajo["resultado"], "id_job": id_job})
+
+        yield _linea(tipo="fin", total=len(pdfs), segundos=round(time.time() - inicio, 3), **resumen)
+
+    return Response(stream_with_context(generar()), mimetype="application/x-ndjson", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
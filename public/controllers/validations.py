@@ -1,8 +1,9 @@
-import io
 import json
 import datetime
-import PyPDF2
 from bd import get_connection
+from controllers.eventos import publicar_evento
+from controllers.pdf_texto import leer_texto_pdf
+from controllers.ocr_local import completar_con_ocr_local
 
 # === PARSEAR FECHA (dd-MMM-yyyy) ===
 def parse_fecha(fecha_str):
@@ -83,12 +84,16 @@ def registrar_log(id_factura, estado, comentario):
 
         cursor.execute("""
             INSERT INTO LOGS (ID_FACTURA, FECHA, HORA, ESTADO, COMENTARIO)
+            OUTPUT INSERTED.ID_LOGS
             VALUES (?, ?, ?, ?, ?)
         """, (id_factura, fecha, hora, estado, comentario))
+        id_log = cursor.fetchone()[0]
 
         conn.commit()
         conn.close()
         print(f"🧾 Log registrado → Estado: {estado} | {comentario}")
+        publicar_evento("log", ID_LOGS=id_log, ID_FACTURA=id_factura, FECHA=str(fecha), HORA=hora,
+                        ESTADO=estado, COMENTARIO=comentario)
     except Exception as e:
         print(f"⚠️ Error al registrar log: {e}")
 
@@ -137,15 +142,30 @@ def validar_estanques(distribuciones):
 
 
 # === LEER CONTENIDO DE UN PDF ===
-def leer_pdf(pdf_bytes: bytes):
+def leer_pdf_detallado(pdf_bytes: bytes):
+    """
+    Como leer_pdf, más el detalle de la lectura (páginas leídas, ms por página
+    y motivo de corte) para reportarlo en la respuesta del upload.
+    Las páginas escaneadas pasan por OCR local; las de texto no.
+    """
     try:
-        reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-        pdf_text = "".join(page.extract_text() or "" for page in reader.pages)
-        registrar_log(None, "LECTURA", "PDF leído correctamente")
-        return True, pdf_text
+        lectura = completar_con_ocr_local(leer_texto_pdf(pdf_bytes))
+    except TimeoutError as e:
+        registrar_log(None, "ERROR", f"Error leyendo PDF: {e}")
+        return False, "El PDF tardó demasiado en leerse", None
     except Exception as e:
         registrar_log(None, "ERROR", f"Error leyendo PDF: {e}")
-        return False, "Archivo no es PDF válido"
+        return False, "Archivo no es PDF válido", None
+
+    detalle = {k: v for k, v in lectura.items() if k not in ("texto", "textos", "sin_texto")}
+    registrar_log(None, "LECTURA", f"PDF leído correctamente ({len(lectura['paginas'])}/"
+                                   f"{lectura['total_paginas']} páginas, {lectura['ms']:.0f} ms)")
+    return True, lectura["texto"], detalle
+
+
+def leer_pdf(pdf_bytes: bytes):
+    ok, texto, _ = leer_pdf_detallado(pdf_bytes)
+    return ok, texto
 
 
 # === CALCULAR LITROS TOTALES DE UNA FACTURA ===
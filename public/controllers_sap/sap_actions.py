@@ -2,13 +2,19 @@ import datetime
 import os
 import json
 from flask import Blueprint, request, jsonify, current_app
-from controllers_sap.sap_service import SAPServiceLayer
+from controllers_sap.sap_service import sap_pool, sap_session
+from controllers_sap.sap_outbox import encolar, responder, tarea_outbox, obtener_de_sap, Transitorio
+from controllers_sap.sap_lotes import (
+    SAP_CONVERSION_LOTE_MAX, items_del_body, leer_documentos, crear_en_lote, creados_por_etiqueta,
+    valores_sql, en_tramos, con_claves_int, con_claves_str
+)
+from controllers_sap.sap_mirror import invalidar_espejo
+from controllers.eventos import publicar_evento
 from bd import get_connection  
 
 sap_actions_bp = Blueprint("sap_actions_bp", __name__)
 @sap_actions_bp.route("/sap/actualizar_pedido", methods=["POST"])
 def actualizar_pedido():
-    sap = None
     conn = None
     try:
         data = request.get_json()
@@ -22,72 +28,66 @@ def actualizar_pedido():
 
         print(f"📦 Actualizando pedido DocEntry={doc_entry}, Item={item_code}, Cant={cantidad_ui}, Precio={precio_ui}")
 
-        # === Obtener DocNum y datos desde SAP ===
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, pedido_data = sap.get(f"PurchaseOrders({int(doc_entry)})")
+        # La sesión se devuelve al pool una sola vez, al salir del bloque
+        with sap_session() as sap:
+            # === Obtener DocNum y datos desde SAP ===
+            ok, pedido_data = sap.get(f"PurchaseOrders({int(doc_entry)})")
 
-        if not ok or not pedido_data:
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": f"No se encontró el pedido {doc_entry} en SAP."}), 404
+            if not ok or not pedido_data:
+                return jsonify({"status": "error", "mensaje": f"No se encontró el pedido {doc_entry} en SAP."}), 404
 
-        doc_num = pedido_data.get("DocNum")
-        lineas = pedido_data.get("DocumentLines", [])
-        if not lineas:
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": "El pedido no tiene líneas para actualizar."}), 400
+            doc_num = pedido_data.get("DocNum")
+            lineas = pedido_data.get("DocumentLines", [])
+            if not lineas:
+                return jsonify({"status": "error", "mensaje": "El pedido no tiene líneas para actualizar."}), 400
 
-        # === Buscar factura asociada en BD (NUMERO_PEDIDO = DocNum) ===
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT TOP 1 ID_FACTURA FROM FACTURAS WHERE NUMERO_PEDIDO = ?
-        """, (str(doc_num),))
-        row = cursor.fetchone()
-        conn.close()
+            # === Buscar factura asociada en BD (NUMERO_PEDIDO = DocNum) ===
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT TOP 1 ID_FACTURA FROM FACTURAS WHERE NUMERO_PEDIDO = ?
+            """, (str(doc_num),))
+            row = cursor.fetchone()
+            conn.close()
+            conn = None
 
-        if not row:
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": f"No se encontró factura con NUMERO_PEDIDO={doc_num}."}), 404
+            if not row:
+                return jsonify({"status": "error", "mensaje": f"No se encontró factura con NUMERO_PEDIDO={doc_num}."}), 404
 
-        print(f" Factura asociada encontrada para pedido {doc_num}")
+            print(f" Factura asociada encontrada para pedido {doc_num}")
 
-        # === Actualizar solo la línea coincidente (ItemCode) ===
-        for l in lineas:
-            if l.get("ItemCode") == item_code:
-                l["Quantity"] = cantidad_ui
-                l["UnitPrice"] = precio_ui
+            # === Actualizar solo la línea coincidente (ItemCode) ===
+            for l in lineas:
+                if l.get("ItemCode") == item_code:
+                    l["Quantity"] = cantidad_ui
+                    l["UnitPrice"] = precio_ui
 
-        payload_update = {
-            "DocumentLines": [
-                {
-                    "LineNum": l.get("LineNum"),
-                    "ItemCode": l.get("ItemCode"),
-                    "Quantity": l.get("Quantity"),
-                    "WarehouseCode": l.get("WarehouseCode"),
-                    "TaxCode": l.get("TaxCode", "FUEL"),
-                    "UnitPrice": l.get("UnitPrice"),
-                }
-                for l in lineas
-            ]
-        }
+            payload_update = {
+                "DocumentLines": [
+                    {
+                        "LineNum": l.get("LineNum"),
+                        "ItemCode": l.get("ItemCode"),
+                        "Quantity": l.get("Quantity"),
+                        "WarehouseCode": l.get("WarehouseCode"),
+                        "TaxCode": l.get("TaxCode", "FUEL"),
+                        "UnitPrice": l.get("UnitPrice"),
+                    }
+                    for l in lineas
+                ]
+            }
 
-        print("📤 PATCH enviado a SAP:")
-        print(json.dumps(payload_update, indent=2, ensure_ascii=False))
+            print("📤 PATCH enviado a SAP:")
+            print(json.dumps(payload_update, indent=2, ensure_ascii=False))
 
-        ok_patch, response = sap.patch(f"PurchaseOrders({int(doc_entry)})", payload_update)
-        sap.logout()
+            ok_patch, response = sap.patch(f"PurchaseOrders({int(doc_entry)})", payload_update)
 
         if not ok_patch:
-            mensaje = (
-                response.get("error", {}).get("message", {}).get("value")
-                if isinstance(response, dict)
-                else str(response)
-            )
+            mensaje = _mensaje_error_sap(response)
             print(f"❌ Error SAP al actualizar: {mensaje}")
             return jsonify({"status": "error", "mensaje": mensaje, "detalle": response}), 400
 
         print(f"✅ Pedido actualizado correctamente en SAP (DocEntry={doc_entry}, DocNum={doc_num})")
+        invalidar_espejo("PurchaseOrders")
         return jsonify({
             "status": "ok",
             "mensaje": f"Pedido {doc_num} actualizado correctamente.",
@@ -100,15 +100,21 @@ def actualizar_pedido():
     except Exception as e:
         if conn:
             conn.close()
-        if sap:
-            try:
-                sap.logout()
-            except:
-                pass
         print(f"❌ Error general en actualizar_pedido: {e}")
         return jsonify({"status": "error", "mensaje": str(e)}), 500
 
 
+def _mensaje_error_sap(response):
+    """Texto del error de SAP: {"error": {"message": {"value"}}}, {"error": {"message": "..."}} o un string."""
+    if not isinstance(response, dict):
+        return str(response)
+    error = response.get("error")
+    mensaje = error.get("message") if isinstance(error, dict) else error
+    if isinstance(mensaje, dict):
+        mensaje = mensaje.get("value")
+    return str(mensaje or response)
+
+
 # ==========================================================
 # 🔹 CONVERTIR PEDIDO A BORRADOR DE ENTRADA
 # ==========================================================
@@ -128,39 +134,35 @@ def convertir_a_borrador_entrada():
                 "mensaje": "Falta el número de pedido (DocEntry)."
             }), 400
 
-        sap = SAPServiceLayer()
-        sap.login()
-
-        ok, pedido = sap.get(f"PurchaseOrders({int(doc_entry)})")
-        if not ok or not pedido:
-            sap.logout()
-            return jsonify({
-                "status": "error",
-                "mensaje": f"No se encontró el pedido {doc_entry} en SAP."
-            }), 404
-
-        payload_draft = {
-            "DocObjectCode": "oPurchaseDeliveryNotes", 
-            "DocDate": pedido.get("DocDate"),
-            "DocDueDate": pedido.get("DocDueDate"),
-            "CardCode": pedido.get("CardCode"),
-            "Comments": f"Borrador creado automáticamente desde Pedido {pedido.get('DocNum')}",
-            "DocumentLines": [
-                {
-                    "BaseType": 22,
-                    "BaseEntry": pedido.get("DocEntry"),
-                    "BaseLine": l.get("LineNum"),
-                    "Quantity": l.get("Quantity"),
-                    "WarehouseCode": l.get("WarehouseCode"),
-                    "ItemCode": l.get("ItemCode"),
-                    "ItemDescription": l.get("ItemDescription"),
-                }
-                for l in pedido.get("DocumentLines", [])
-            ],
-        }
+        with sap_session() as sap:
+            ok, pedido = sap.get(f"PurchaseOrders({int(doc_entry)})")
+            if not ok or not pedido:
+                return jsonify({
+                    "status": "error",
+                    "mensaje": f"No se encontró el pedido {doc_entry} en SAP."
+                }), 404
+
+            payload_draft = {
+                "DocObjectCode": "oPurchaseDeliveryNotes", 
+                "DocDate": pedido.get("DocDate"),
+                "DocDueDate": pedido.get("DocDueDate"),
+                "CardCode": pedido.get("CardCode"),
+                "Comments": f"Borrador creado automáticamente desde Pedido {pedido.get('DocNum')}",
+                "DocumentLines": [
+                    {
+                        "BaseType": 22,
+                        "BaseEntry": pedido.get("DocEntry"),
+                        "BaseLine": l.get("LineNum"),
+                        "Quantity": l.get("Quantity"),
+                        "WarehouseCode": l.get("WarehouseCode"),
+                        "ItemCode": l.get("ItemCode"),
+                        "ItemDescription": l.get("ItemDescription"),
+                    }
+                    for l in pedido.get("DocumentLines", [])
+                ],
+            }
 
-        ok, draft = sap.post("Drafts", payload_draft)
-        sap.logout()
+            ok, draft = sap.post("Drafts", payload_draft)
 
         if not ok:
             print("❌ Error al crear borrador:", draft)
@@ -208,13 +210,25 @@ def confirmar_borrador_con_ocr():
         if not draft_entry:
             return jsonify({"status": "error", "mensaje": "Falta el DraftEntry del borrador."}), 400
 
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, draft = sap.get(f"Drafts({int(draft_entry)})")
+        id_job = encolar("confirmar_borrador_con_ocr", {"DraftEntry": int(draft_entry)},
+                         cadena=f"Drafts:{int(draft_entry)}")
+        return responder(id_job)
+
+    except Exception as e:
+        print(f"❌ Error en confirmar_borrador_con_ocr: {e}")
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+
+
+@tarea_outbox("confirmar_borrador_con_ocr")
+def _confirmar_borrador_con_ocr(job):
+    draft_entry = job.payload["DraftEntry"]
+
+    sap = sap_pool.acquire()
+    try:
+        ok, draft = obtener_de_sap(sap, f"Drafts({int(draft_entry)})")
 
         if not ok or not draft:
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": f"No se encontró el borrador {draft_entry}."}), 404
+            return 404, {"status": "error", "mensaje": f"No se encontró el borrador {draft_entry}."}
 
         # Obtener base + impuestos desde BD
         base_entry = draft.get("DocumentLines", [{}])[0].get("BaseEntry")
@@ -229,8 +243,7 @@ def confirmar_borrador_con_ocr():
         conn.close()
 
         if not row:
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": f"No hay datos de impuestos para pedido {base_entry}."}), 404
+            return 404, {"status": "error", "mensaje": f"No hay datos de impuestos para pedido {base_entry}."}
 
         base_afecta, ief, iva = float(row[0] or 0), float(row[1] or 0), float(row[2] or 0)
 
@@ -250,7 +263,7 @@ def confirmar_borrador_con_ocr():
             "DocDate": draft.get("DocDate"),
             "DocDueDate": draft.get("DocDueDate"),
             "CardCode": draft.get("CardCode"),
-            "Comments": f"Entrada generada desde borrador {draft_entry}",
+            "Comments": job.comentario(f"Entrada generada desde borrador {draft_entry}"),
             "DocumentLines": [
                 {
                     "BaseType": 22,
@@ -268,25 +281,73 @@ def confirmar_borrador_con_ocr():
         print("🚛 Enviando entrada de mercancía definitiva a SAP:")
         print(json.dumps(payload, indent=2, ensure_ascii=False))
 
-        ok, entrada = sap.post("PurchaseDeliveryNotes", payload)
-        sap.logout()
+        ok, entrada = job.crear_en_sap(sap, "PurchaseDeliveryNotes", payload)
 
         if not ok:
             print("❌ Error al crear entrada:", entrada)
-            return jsonify({"status": "error", "mensaje": "Error creando entrada", "detalle": entrada}), 400
+            return 400, {"status": "error", "mensaje": "Error creando entrada", "detalle": entrada}
 
         print(f"✅ Entrada final creada (DocNum={entrada.get('DocNum')})")
-        return jsonify({
+        publicar_evento("documento", entidad="PurchaseDeliveryNotes", DocEntry=entrada.get("DocEntry"),
+                        DocNum=entrada.get("DocNum"), origen="Drafts", DocEntryOrigen=draft_entry)
+        invalidar_espejo("PurchaseOrders", "PurchaseDeliveryNotes")
+        return 200, {
             "status": "ok",
             "mensaje": f"Entrada creada correctamente (DocNum={entrada.get('DocNum')}).",
             "entrada": entrada
-        }), 200
+        }
+    finally:
+        sap_pool.release(sap)
 
-    except Exception as e:
-        print(f"❌ Error en confirmar_borrador_con_ocr: {e}")
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
 
 
+def _payload_entrada(pedido, ief_total, comentario):
+    """
+    Payload de la Entrada de Mercancía (BaseType 22) desde un pedido, con el IEF de la
+    factura repartido en las líneas según su base como jurisdicción FUEL.
+    """
+    lineas = pedido.get("DocumentLines", [])
+    base_linea_total = sum([(l.get("Quantity") or 0) * (l.get("UnitPrice") or 0) for l in lineas]) or 1
+
+    payload = {
+        "DocDate": datetime.date.today().strftime("%Y-%m-%d"),
+        "DocDueDate": pedido.get("DocDueDate"),
+        "CardCode": pedido.get("CardCode"),
+        "Comments": comentario,
+        "DocumentLines": []
+    }
+
+    for l in lineas:
+        cantidad = float(l.get("Quantity") or 0)
+        precio = float(l.get("UnitPrice") or 0)
+        base_linea = cantidad * precio
+        proporcion = base_linea / base_linea_total
+        ief_linea = round(ief_total * proporcion, 2)
+
+        payload["DocumentLines"].append({
+            "BaseType": 22,  # Pedido de compra
+            "BaseEntry": pedido.get("DocEntry"),
+            "BaseLine": l.get("LineNum"),
+            "ItemCode": l.get("ItemCode"),
+            "Quantity": cantidad,
+            "WarehouseCode": l.get("WarehouseCode"),
+            "UnitPrice": precio,
+            "TaxCode": "FUEL",
+            "LineTaxJurisdictions": [
+                {
+                    "JurisdictionCode": "FUEL",
+                    "JurisdictionType": 2,
+                    "TaxRate": 1.0,
+                    "BaseSum": base_linea,
+                    "TaxAmount": ief_linea,
+                    "TaxAmountSC": ief_linea,
+                    "TaxAmountFC": ief_linea,
+                    "TaxOnly": "tNO"
+                }
+            ]
+        })
+    return payload
+
 
 @sap_actions_bp.route("/sap/convertir_a_entrada_directa", methods=["POST"])
 def convertir_a_entrada_directa():
@@ -305,19 +366,30 @@ def convertir_a_entrada_directa():
                 "mensaje": "Falta el DocEntry del pedido"
             }), 400
 
-        print(f"📦 Iniciando conversión directa del pedido {doc_entry} → Entrada de mercancía")
+        # La entrada se registra en el outbox SAP y se ejecuta en orden por pedido
+        id_job = encolar("convertir_a_entrada_directa", {"DocEntry": int(doc_entry)},
+                         cadena=f"PurchaseOrders:{int(doc_entry)}")
+        return responder(id_job)
+
+    except Exception as e:
+        print(f"❌ Error en convertir_a_entrada_directa: {e}")
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+
 
-        sap = SAPServiceLayer()
-        sap.login()
+@tarea_outbox("convertir_a_entrada_directa")
+def _convertir_a_entrada_directa(job):
+    doc_entry = job.payload["DocEntry"]
+    print(f"📦 Iniciando conversión directa del pedido {doc_entry} → Entrada de mercancía")
 
+    sap = sap_pool.acquire()
+    try:
         # === Obtener pedido desde SAP ===
-        ok, pedido = sap.get(f"PurchaseOrders({int(doc_entry)})")
+        ok, pedido = obtener_de_sap(sap, f"PurchaseOrders({int(doc_entry)})")
         if not ok or not pedido:
-            sap.logout()
-            return jsonify({
+            return 404, {
                 "status": "error",
                 "mensaje": f"No se encontró el pedido {doc_entry} en SAP."
-            }), 404
+            }
 
         doc_num = pedido.get("DocNum")
         print(f"✅ Pedido obtenido → DocEntry={doc_entry}, DocNum={doc_num}")
@@ -338,61 +410,23 @@ def convertir_a_entrada_directa():
         print(f"Datos BD → Base={base_total}, IEF={ief_total}")
 
         # === Construir payload SAP ===
-        lineas = pedido.get("DocumentLines", [])
-        base_linea_total = sum([(l.get("Quantity") or 0) * (l.get("UnitPrice") or 0) for l in lineas]) or 1
-
-        payload = {
-            "DocDate": datetime.date.today().strftime("%Y-%m-%d"),
-            "DocDueDate": pedido.get("DocDueDate"),
-            "CardCode": pedido.get("CardCode"),
-            "Comments": f"Entrada automática generada desde Pedido {doc_num}",
-            "DocumentLines": []
-        }
-
-        for l in lineas:
-            cantidad = float(l.get("Quantity") or 0)
-            precio = float(l.get("UnitPrice") or 0)
-            base_linea = cantidad * precio
-            proporcion = base_linea / base_linea_total
-            ief_linea = round(ief_total * proporcion, 2)
-
-            payload["DocumentLines"].append({
-                "BaseType": 22,  # Pedido de compra
-                "BaseEntry": pedido.get("DocEntry"),
-                "BaseLine": l.get("LineNum"),
-                "ItemCode": l.get("ItemCode"),
-                "Quantity": cantidad,
-                "WarehouseCode": l.get("WarehouseCode"),
-                "UnitPrice": precio,
-                "TaxCode": "FUEL",
-                "LineTaxJurisdictions": [
-                    {
-                        "JurisdictionCode": "FUEL",
-                        "JurisdictionType": 2,
-                        "TaxRate": 1.0,
-                        "BaseSum": base_linea,
-                        "TaxAmount": ief_linea,
-                        "TaxAmountSC": ief_linea,
-                        "TaxAmountFC": ief_linea,
-                        "TaxOnly": "tNO"
-                    }
-                ]
-            })
+        payload = _payload_entrada(
+            pedido, ief_total, job.comentario(f"Entrada automática generada desde Pedido {doc_num}")
+        )
 
         print("📤 Payload final a enviar a SAP:")
         print(json.dumps(payload, indent=2, ensure_ascii=False))
 
         # === Crear entrada definitiva directamente en SAP ===
-        ok_final, entrada = sap.post("PurchaseDeliveryNotes", payload)
-        sap.logout()
+        ok_final, entrada = job.crear_en_sap(sap, "PurchaseDeliveryNotes", payload)
 
         if not ok_final:
             print("❌ Error al crear la entrada definitiva:", entrada)
-            return jsonify({
+            return 400, {
                 "status": "error",
                 "mensaje": "Error al crear entrada definitiva en SAP",
                 "detalle": entrada
-            }), 400
+            }
 
         entrada_docnum = entrada.get("DocNum")
         print(f"✅ Entrada definitiva creada correctamente (DocNum={entrada_docnum})")
@@ -417,18 +451,182 @@ def convertir_a_entrada_directa():
         finally:
             conn.close()
 
+        publicar_evento("documento", entidad="PurchaseDeliveryNotes", DocEntry=entrada.get("DocEntry"),
+                        DocNum=entrada_docnum, origen="PurchaseOrders", DocEntryOrigen=doc_entry, DocNumOrigen=doc_num)
+        invalidar_espejo("PurchaseOrders", "PurchaseDeliveryNotes")
+
         # Retornar resultado exitoso cuando todo haya finalizado
-        return jsonify({
+        return 200, {
             "status": "ok",
             "mensaje": f"Entrada creada correctamente (DocNum={entrada_docnum})",
             "DocNumEntrada": entrada_docnum
-        }), 200
+        }
+    finally:
+        sap_pool.release(sap)
+
+
+# ==========================================================
+# 🔹 CONVERTIR VARIOS PEDIDOS → ENTRADAS DE MERCANCÍA (MASIVO)
+# ==========================================================
+@sap_actions_bp.route("/sap/convertir_a_entrada_directa/lote", methods=["POST"])
+def convertir_a_entradas_lote():
+    """
+    Crea entradas de mercancía para varios pedidos: lee los pedidos en $batch,
+    trae las facturas de todos en una consulta, reparte el IEF (FUEL) de cada uno,
+    crea las entradas en un $batch con resultado por pedido y registra
+    ENTRADA_MERCANCIA en una sola sentencia.
+
+    Body: {"DocEntries": [31, 32, 40]}
+    """
+    try:
+        data = request.get_json() or {}
+        try:
+            items = items_del_body(data.get("DocEntries"))
+        except ValueError as e:
+            return jsonify({"status": "error", "mensaje": str(e)}), 400
+
+        if not items:
+            return jsonify({"status": "error", "mensaje": "Falta la lista DocEntries de pedidos"}), 400
+        if len(items) > SAP_CONVERSION_LOTE_MAX:
+            return jsonify({
+                "status": "error",
+                "mensaje": f"Máximo {SAP_CONVERSION_LOTE_MAX} pedidos por lote (recibidos {len(items)})"
+            }), 400
+
+        # Misma cadena por documento que /sap/convertir_a_entrada_directa: no corren a la vez sobre un pedido
+        id_job = encolar("convertir_a_entradas_lote", {"items": items},
+                         cadena=[f"PurchaseOrders:{it['DocEntry']}" for it in items])
+        return responder(id_job)
 
     except Exception as e:
-        # Asegurar logout si ocurrió antes de cualquier retorno y retornar error
+        print(f"❌ Error en convertir_a_entradas_lote: {e}")
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+
+
+def _ief_por_pedido(docnums):
+    """{NUMERO_PEDIDO: IEF} de la primera factura de cada pedido, en una sola consulta."""
+    ief = {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for tramo in en_tramos([str(n) for n in docnums]):
+            marcadores = ", ".join("?" * len(tramo))
+            cursor.execute(f"""
+                SELECT NUMERO_PEDIDO, IEF
+                FROM FACTURAS
+                WHERE NUMERO_PEDIDO IN ({marcadores})
+                ORDER BY NUMERO_PEDIDO, ID_FACTURA
+            """, tramo)
+            for numero, valor in cursor.fetchall():
+                ief.setdefault(numero, float(valor) if valor else 0)
+    finally:
+        conn.close()
+    return ief
+
+
+@tarea_outbox("convertir_a_entradas_lote")
+def _convertir_a_entradas_lote(job):
+    items = job.payload["items"]
+    entradas = con_claves_int(job.contexto.get("creados"))
+    errores = con_claves_int(job.contexto.get("errores"))
+    pedidos_num = con_claves_int(job.contexto.get("docnums"))
+
+    sap = sap_pool.acquire()
+    try:
+        # === Reconciliar un envío anterior sin respuesta ===
+        if job.contexto.get("enviando"):
+            entradas.update(creados_por_etiqueta(sap, job, "PurchaseDeliveryNotes"))
+            job.checkpoint("Entradas existentes verificadas", enviando=None, creados=con_claves_str(entradas))
+
+        pendientes = [it["DocEntry"] for it in items if it["DocEntry"] not in entradas and it["DocEntry"] not in errores]
+        if pendientes:
+            # === Leer pedidos en $batch ===
+            pedidos, no_encontrados = leer_documentos(
+                sap, "PurchaseOrders", pendientes, "DocEntry,DocNum,DocDueDate,CardCode,DocumentStatus,DocumentLines"
+            )
+            errores.update(no_encontrados)
+            print(f"📦 Convirtiendo {len(pedidos)} pedidos → Entradas de mercancía en lote...")
+
+            # === IEF de todas las facturas en una consulta ===
+            ief = _ief_por_pedido([p.get("DocNum") for p in pedidos.values()])
+
+            por_enviar = []
+            for doc_entry in pendientes:
+                pedido = pedidos.get(doc_entry)
+                if pedido is None:
+                    continue
+                doc_num = pedido.get("DocNum")
+                pedidos_num[doc_entry] = doc_num
+                if pedido.get("DocumentStatus", "bost_Open") != "bost_Open":
+                    errores[doc_entry] = f"El pedido {doc_num} ya no está abierto"
+                    continue
+                por_enviar.append((doc_entry, _payload_entrada(
+                    pedido, ief.get(str(doc_num), 0),
+                    job.comentario(f"Entrada automática generada desde Pedido {doc_num}")
+                )))
+
+            # === Crear entradas en $batch, un changeset por entrada ===
+            if por_enviar:
+                job.checkpoint(f"Enviando {len(por_enviar)} entradas a SAP", enviando=True,
+                               docnums=con_claves_str(pedidos_num), errores=con_claves_str(errores))
+                creadas, rechazadas, sin_respuesta = crear_en_lote(sap, "PurchaseDeliveryNotes", por_enviar)
+                entradas.update(creadas)
+                errores.update(rechazadas)
+
+                job.checkpoint(f"{len(entradas)} entradas creadas en SAP", enviando=sin_respuesta > 0,
+                               creados=con_claves_str(entradas), errores=con_claves_str(errores))
+                if sin_respuesta:
+                    raise Transitorio(f"{sin_respuesta} entradas sin respuesta de SAP")
+    finally:
+        sap_pool.release(sap)
+
+    if entradas:
+        invalidar_espejo("PurchaseOrders", "PurchaseDeliveryNotes")
+
+    # === Registrar ENTRADA_MERCANCIA en una sola sentencia ===
+    if entradas and not job.hecho("bd_local"):
+        conn = get_connection()
+        cursor = conn.cursor()
         try:
-            sap.logout()
+            pares = [(str(pedidos_num.get(doc_entry)), str(entrada.get("DocNum")))
+                     for doc_entry, entrada in entradas.items()]
+            for tramo in en_tramos(pares):
+                marcadores, params = valores_sql(tramo)
+                cursor.execute(f"""
+                    UPDATE FACTURAS
+                    SET ENTRADA_MERCANCIA = v.ENTRADA
+                    FROM (VALUES {marcadores}) AS v (PEDIDO, ENTRADA)
+                    WHERE FACTURAS.NUMERO_PEDIDO = v.PEDIDO
+                """, params)
+            conn.commit()
+            print(f"💾 ENTRADA_MERCANCIA actualizada → {len(pares)} pedidos")
         except Exception:
-            pass
-        print(f"❌ Error en convertir_a_entrada_directa: {e}")
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        job.marcar("bd_local")
+        for doc_entry, entrada in entradas.items():
+            publicar_evento("documento", entidad="PurchaseDeliveryNotes", DocEntry=entrada.get("DocEntry"),
+                            DocNum=entrada.get("DocNum"), origen="PurchaseOrders",
+                            DocEntryOrigen=doc_entry, DocNumOrigen=pedidos_num.get(doc_entry))
+
+    # === Respuesta por ítem ===
+    resultados = []
+    for it in items:
+        doc_entry = it["DocEntry"]
+        entrada = entradas.get(doc_entry)
+        if entrada:
+            resultados.append({"DocEntry": doc_entry, "ok": True, "DocNum": pedidos_num.get(doc_entry),
+                               "DocNumEntrada": entrada.get("DocNum"), "DocEntryEntrada": entrada.get("DocEntry")})
+        else:
+            resultados.append({"DocEntry": doc_entry, "ok": False, "DocNum": pedidos_num.get(doc_entry),
+                               "mensaje": errores.get(doc_entry, "Error al crear entrada definitiva en SAP")})
+
+    creadas = sum(1 for r in resultados if r["ok"])
+    print(f"✅ Entradas masivas: {creadas}/{len(items)} pedidos convertidos")
+    return (200 if creadas else 400), {
+        "status": "ok" if creadas else "error",
+        "mensaje": f"{creadas} de {len(items)} entradas creadas correctamente.",
+        "data": {"creadas": creadas, "fallidas": len(items) - creadas, "resultados": resultados}
+    }
@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+from flask import Blueprint, jsonify
+
+from controllers_sap.sap_service import sap_pool, sap_breaker, SAPError
+
+# === DATOS MAESTROS CACHEADOS ===
+# TTL en segundos por entidad; pasado el TTL se sirve el dato anterior
+# mientras se recarga en segundo plano (stale-while-revalidate).
+MASTER_DATA = {
+    "items": {
+        "entity": "Items",
+        "select": "ItemCode,ItemName,ForeignName",
+        "filter": None,
+        "ttl": int(os.getenv("SAP_CACHE_TTL_ITEMS", "21600")),
+    },
+    "vendors": {
+        "entity": "BusinessPartners",
+        "select": "CardCode,CardName,FederalTaxID",
+        "filter": "CardType eq 'S'",
+        "ttl": int(os.getenv("SAP_CACHE_TTL_VENDORS", "21600")),
+    },
+    "warehouses": {
+        "entity": "Warehouses",
+        "select": "WarehouseCode,WarehouseName",
+        "filter": None,
+        "ttl": int(os.getenv("SAP_CACHE_TTL_WAREHOUSES", "86400")),
+    },
+    "taxcodes": {
+        "entity": "VatGroups",
+        "select": "Code,Name",
+        "filter": None,
+        "ttl": int(os.getenv("SAP_CACHE_TTL_TAXCODES", "86400")),
+    },
+}
+
+
+class MasterDataCache:
+    """
+    Cache en memoria de datos maestros SAP con TTL por entidad.
+    Un dato vencido se sigue entregando mientras un hilo lo recarga,
+    así los requests no esperan a SAP salvo en la primera carga.
+    """
+
+    def __init__(self, definiciones):
+        self.definiciones = definiciones
+        self._entradas = {}
+        self._refrescando = set()
+        self._locks = {nombre: threading.Lock() for nombre in definiciones}
+        self._lock = threading.Lock()
+        self._stats = {
+            nombre: {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+            for nombre in definiciones
+        }
+
+    def get(self, nombre):
+        """Retorna las filas de la entidad; lanza SAPError si no hay dato y SAP falla."""
+        with self._lock:
+            entrada = self._entradas.get(nombre)
+
+        if entrada is not None:
+            if time.time() - entrada["cargado"] < self.definiciones[nombre]["ttl"]:
+                self._count(nombre, "hits")
+            else:
+                self._count(nombre, "stale_hits")
+                # Con SAP caído se sigue sirviendo el dato vencido sin reintentar
+                if not sap_breaker.abierto:
+                    self._refrescar_en_segundo_plano(nombre)
+            return entrada["filas"]
+
+        self._count(nombre, "misses")
+        with self._locks[nombre]:
+            # Otro hilo pudo haberla cargado mientras se esperaba el lock
+            with self._lock:
+                entrada = self._entradas.get(nombre)
+            if entrada is not None:
+                return entrada["filas"]
+            return self._cargar(nombre)
+
+    def invalidate(self, nombre=None):
+        """Descarta una entidad (o todas) para forzar su recarga en el próximo acceso."""
+        with self._lock:
+            if nombre is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(nombre, None)
+
+    def stats(self):
+        ahora = time.time()
+        with self._lock:
+            resumen = {}
+            for nombre, contadores in self._stats.items():
+                entrada = self._entradas.get(nombre)
+                resumen[nombre] = {
+                    **contadores,
+                    "rows": len(entrada["filas"]) if entrada else 0,
+                    "age_s": round(ahora - entrada["cargado"], 1) if entrada else None,
+                    "ttl_s": self.definiciones[nombre]["ttl"],
+                    "refreshing": nombre in self._refrescando,
+                }
+        return resumen
+
+    def _cargar(self, nombre):
+        definicion = self.definiciones[nombre]
+        sap = sap_pool.acquire()
+        try:
+            filas = list(sap.iter_collection(
+                definicion["entity"],
+                select=definicion["select"],
+                filter=definicion["filter"],
+            ))
+        except SAPError:
+            self._count(nombre, "errors")
+            raise
+        finally:
+            sap_pool.release(sap)
+
+        with self._lock:
+            self._entradas[nombre] = {"filas": filas, "cargado": time.time()}
+            self._stats[nombre]["refreshes"] += 1
+        print(f"🗂️ Cache SAP '{nombre}' cargada ({len(filas)} filas)")
+        return filas
+
+    def _refrescar_en_segundo_plano(self, nombre):
+        with self._lock:
+            if nombre in self._refrescando:
+                return
+            self._refrescando.add(nombre)
+
+        def tarea():
+            try:
+                with self._locks[nombre]:
+                    self._cargar(nombre)
+            except Exception as e:
+                print(f"⚠️ No se pudo refrescar cache SAP '{nombre}': {e}")
+            finally:
+                with self._lock:
+                    self._refrescando.discard(nombre)
+
+        threading.Thread(target=tarea, name=f"sap-cache-{nombre}", daemon=True).start()
+
+    def _count(self, nombre, contador):
+        with self._lock:
+            self._stats[nombre][contador] += 1
+
+
+master_data = MasterDataCache(MASTER_DATA)
+
+
+sap_cache_bp = Blueprint("sap_cache_bp", __name__)
+
+
+@sap_cache_bp.route("/sap/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({"status": "ok", "data": master_data.stats()}), 200
+
+
+@sap_cache_bp.route("/sap/cache/invalidar", methods=["POST"])
+@sap_cache_bp.route("/sap/cache/invalidar/<entidad>", methods=["POST"])
+def cache_invalidar(entidad=None):
+    if entidad is not None and entidad not in MASTER_DATA:
+        return jsonify({"status": "error", "mensaje": f"Entidad '{entidad}' no está cacheada."}), 404
+
+    master_data.invalidate(entidad)
+    print(f"🧹 Cache SAP invalidada: {entidad or 'todas'}")
+    return jsonify({"status": "ok", "mensaje": f"Cache invalidada ({entidad or 'todas'})."}), 200
@@ -2,11 +2,63 @@ import os
 import json
 import datetime
 from flask import Blueprint, request, jsonify
-from controllers_sap.sap_service import SAPServiceLayer
+from controllers_sap.sap_service import sap_session
+from controllers_sap.sap_outbox import encolar, responder, tarea_outbox, obtener_de_sap, Transitorio
+from controllers_sap.sap_lotes import (
+    SAP_CONVERSION_LOTE_MAX, items_del_body, leer_documentos, crear_en_lote, creados_por_etiqueta,
+    valores_sql, en_tramos, con_claves_int, con_claves_str
+)
+from controllers_sap.sap_mirror import invalidar_espejo
+from controllers.eventos import publicar_evento
 from bd import get_connection
 
 sap_convert_bp = Blueprint("sap_convert_bp", __name__)
 
+# Proveedor por defecto de los pedidos generados desde solicitudes
+CARD_CODE_DEFECTO = "PN99520000-7"
+# Producto asignado al DETALLE_PRODUCTO de los pedidos convertidos
+ID_PRODUCTO_PEDIDO = 3
+
+
+def _payload_pedido(solicitud, card_code, comentario):
+    """Payload del Pedido de Compra que copia las líneas de la solicitud (BaseType 1470000113)."""
+    fecha_hoy = datetime.datetime.now()
+    return {
+        "DocDate": fecha_hoy.strftime("%Y-%m-%d"),
+        "DocDueDate": (fecha_hoy + datetime.timedelta(days=30)).strftime("%Y-%m-%d"),
+        "CardCode": card_code,
+        "Comments": comentario,
+        "DocumentLines": [
+            {
+                "BaseType": 1470000113,  # Tipo base: Solicitud de compra
+                "BaseEntry": solicitud["DocEntry"],
+                "BaseLine": linea["LineNum"],
+                "ItemCode": linea["ItemCode"],
+                "Quantity": linea["Quantity"],
+                "WarehouseCode": linea["WarehouseCode"],
+                "TaxCode": linea["TaxCode"]
+            }
+            for linea in solicitud.get("DocumentLines", [])
+        ]
+    }
+
+
+def _truncar_4(x):
+    """Trunca a 4 decimales sin redondear."""
+    s = f"{x:.10f}"
+    return float(s[:s.find('.') + 5]) if '.' in s else float(s)
+
+
+def _detalle_unitario(base_afecta, iev_total, ief_total, cantidad):
+    """(PBASE_SI_U, IEV_U, IEF_U, PTOTAL_U, SUBTOTAL) de una factura repartida en `cantidad` unidades."""
+    pbase_si_u = _truncar_4(base_afecta / cantidad)
+    iev_u = _truncar_4(iev_total / cantidad)
+    ief_u = _truncar_4(ief_total / cantidad)
+    ptotal_u = _truncar_4(pbase_si_u + iev_u + ief_u)
+    subtotal = _truncar_4(ptotal_u * cantidad)
+    return pbase_si_u, iev_u, ief_u, ptotal_u, subtotal
+
+
 # ==========================================================
 # 🔹 CONVERTIR SOLICITUD → PEDIDO
 # ==========================================================
@@ -21,54 +73,49 @@ def convertir_a_pedido():
     try:
         data = request.get_json()
         base_entry = data.get("DocEntry")  # DocEntry de la solicitud SAP
-        card_code = data.get("CardCode", "PN99520000-7")
+        card_code = data.get("CardCode", CARD_CODE_DEFECTO)
 
         if not base_entry:
             return jsonify({"status": "error", "mensaje": "Falta DocEntry de la solicitud"}), 400
 
-        # === Conexión SAP ===
-        sap = SAPServiceLayer()
-        sap.login()
+        # La conversión se registra en el outbox SAP y se ejecuta en orden por solicitud
+        id_job = encolar("convertir_a_pedido", {"DocEntry": base_entry, "CardCode": card_code},
+                         cadena=f"PurchaseRequests:{int(base_entry)}")
+        return responder(id_job)
+
+    except Exception as e:
+        print(f"❌ Error general en conversión a pedido: {e}")
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+
 
+@tarea_outbox("convertir_a_pedido")
+def _convertir_a_pedido(job):
+    base_entry = job.payload["DocEntry"]
+    card_code = job.payload["CardCode"]
+
+    with sap_session() as sap:
         # === Obtener solicitud desde SAP ===
-        ok, solicitud = sap.get(f"PurchaseRequests({base_entry})")
+        ok, solicitud = obtener_de_sap(sap, f"PurchaseRequests({base_entry})")
         if not ok or not solicitud:
-            sap.logout()
-            return jsonify({
+            return 404, {
                 "status": "error",
                 "mensaje": f"No se encontró la solicitud {base_entry} en SAP"
-            }), 404
+            }
 
         solicitud_num = solicitud.get("DocNum")
         print(f"📋 Convirtiendo Solicitud {solicitud_num} → Pedido...")
 
         # === Crear payload del pedido ===
-        fecha_hoy = datetime.datetime.now()
-        payload = {
-            "DocDate": fecha_hoy.strftime("%Y-%m-%d"),
-            "DocDueDate": (fecha_hoy + datetime.timedelta(days=30)).strftime("%Y-%m-%d"),
-            "CardCode": card_code,
-            "Comments": f"Pedido generado automáticamente desde Solicitud {solicitud_num}",
-            "DocumentLines": [
-                {
-                    "BaseType": 1470000113,  # Tipo base: Solicitud de compra
-                    "BaseEntry": solicitud["DocEntry"],
-                    "BaseLine": linea["LineNum"],
-                    "ItemCode": linea["ItemCode"],
-                    "Quantity": linea["Quantity"],
-                    "WarehouseCode": linea["WarehouseCode"],
-                    "TaxCode": linea["TaxCode"]
-                }
-                for linea in solicitud.get("DocumentLines", [])
-            ]
-        }
+        payload = _payload_pedido(
+            solicitud, card_code,
+            job.comentario(f"Pedido generado automáticamente desde Solicitud {solicitud_num}")
+        )
 
         # === Crear pedido en SAP ===
-        ok, resp = sap.post("PurchaseOrders", payload)
+        ok, resp = job.crear_en_sap(sap, "PurchaseOrders", payload)
         if not ok:
             print("❌ Error al crear pedido:", resp)
-            sap.logout()
-            return jsonify({"status": "error", "mensaje": "Error al crear pedido en SAP"}), 500
+            return 500, {"status": "error", "mensaje": "Error al crear pedido en SAP"}
 
         pedido_docnum = resp.get("DocNum")
         pedido_docentry = resp.get("DocEntry")
@@ -112,19 +159,12 @@ def convertir_a_pedido():
                 total_factura = float(factura[4] or 0)
 
                 cantidad = float(solicitud["DocumentLines"][0]["Quantity"])
-                id_producto = 3 
+                id_producto = ID_PRODUCTO_PEDIDO
 
                 if cantidad > 0:
-                    # Truncar sin redondear
-                    def truncar_4(x):
-                        s = f"{x:.10f}"
-                        return float(s[:s.find('.') + 5]) if '.' in s else float(s)
-
-                    pbase_si_u = truncar_4(base_afecta / cantidad)
-                    iev_u = truncar_4(iev_total / cantidad)
-                    ief_u = truncar_4(ief_total / cantidad)
-                    ptotal_u = truncar_4(pbase_si_u + iev_u + ief_u)
-                    subtotal = truncar_4(ptotal_u * cantidad)
+                    pbase_si_u, iev_u, ief_u, ptotal_u, subtotal = _detalle_unitario(
+                        base_afecta, iev_total, ief_total, cantidad
+                    )
 
                     # Verificar si ya existe detalle
                     cursor.execute("SELECT COUNT(*) FROM DETALLE_PRODUCTO WHERE ID_FACTURA = ?", (id_factura,))
@@ -153,19 +193,219 @@ def convertir_a_pedido():
             print(f"⚠️ Error al actualizar DETALLE_PRODUCTO: {e}")
             conn.rollback()
 
-        # === Cerrar sesión SAP ===
-        sap.logout()
+        publicar_evento("documento", entidad="PurchaseOrders", DocEntry=pedido_docentry, DocNum=pedido_docnum,
+                        origen="PurchaseRequests", DocEntryOrigen=base_entry, DocNumOrigen=solicitud_num)
+        invalidar_espejo("PurchaseRequests", "PurchaseOrders")
 
         # === Respuesta final ===
-        return jsonify({
+        return 200, {
             "status": "ok",
             "mensaje": f"Solicitud {solicitud_num} convertida a Pedido {pedido_docnum}, detalle actualizado correctamente.",
             "data": {
                 "DocNumPedido": pedido_docnum,
                 "DocEntryPedido": pedido_docentry
             }
-        }), 200
+        }
+
+
+# ==========================================================
+# 🔹 CONVERTIR VARIAS SOLICITUDES → PEDIDOS (MASIVO)
+# ==========================================================
+@sap_convert_bp.route("/sap/convertir_a_pedido/lote", methods=["POST"])
+def convertir_a_pedidos_lote():
+    """
+    Convierte varias Solicitudes de Compra en Pedidos en una sola pasada:
+    lee las solicitudes en $batch, crea todos los pedidos en un $batch
+    (un changeset por pedido, para que cada uno tenga su propio resultado)
+    y actualiza FACTURAS / DETALLE_PRODUCTO con sentencias por conjunto.
+
+    Body: {"DocEntries": [12, 15, {"DocEntry": 18, "CardCode": "PN..."}], "CardCode": "PN..."}
+    """
+    try:
+        data = request.get_json() or {}
+        try:
+            items = items_del_body(data.get("DocEntries"), CardCode=data.get("CardCode", CARD_CODE_DEFECTO))
+        except ValueError as e:
+            return jsonify({"status": "error", "mensaje": str(e)}), 400
+
+        if not items:
+            return jsonify({"status": "error", "mensaje": "Falta la lista DocEntries de solicitudes"}), 400
+        if len(items) > SAP_CONVERSION_LOTE_MAX:
+            return jsonify({
+                "status": "error",
+                "mensaje": f"Máximo {SAP_CONVERSION_LOTE_MAX} solicitudes por lote (recibidas {len(items)})"
+            }), 400
+
+        # Misma cadena por documento que /sap/convertir_a_pedido: no corren a la vez sobre una solicitud
+        id_job = encolar("convertir_a_pedidos_lote", {"items": items},
+                         cadena=[f"PurchaseRequests:{it['DocEntry']}" for it in items])
+        return responder(id_job)
 
     except Exception as e:
-        print(f"❌ Error general en conversión a pedido: {e}")
+        print(f"❌ Error general en conversión masiva a pedidos: {e}")
         return jsonify({"status": "error", "mensaje": str(e)}), 500
+
+
+def _actualizar_bd_lote(convertidas):
+    """
+    Aplica en bloque los cambios locales de la conversión masiva.
+    convertidas: lista de (solicitud_num, pedido_num, cantidad).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # === FACTURAS.NUMERO_PEDIDO ===
+        pares = [(str(sol), str(ped)) for sol, ped, _ in convertidas]
+        for tramo in en_tramos(pares):
+            marcadores, params = valores_sql(tramo)
+            cursor.execute(f"""
+                UPDATE FACTURAS
+                SET NUMERO_PEDIDO = v.PEDIDO
+                FROM (VALUES {marcadores}) AS v (SOLICITUD, PEDIDO)
+                WHERE FACTURAS.NUMERO_SOLICITUD_SAP = v.SOLICITUD
+            """, params)
+
+        # === Facturas enlazadas (por solicitud o por pedido) ===
+        facturas = {}
+        for tramo in en_tramos(pares):
+            marcadores, params = valores_sql(tramo)
+            cursor.execute(f"""
+                SELECT v.SOLICITUD, f.ID_FACTURA, f.BASE_AFECTA, f.IEV, f.IEF
+                FROM (VALUES {marcadores}) AS v (SOLICITUD, PEDIDO)
+                JOIN FACTURAS f ON f.NUMERO_SOLICITUD_SAP = v.SOLICITUD OR f.NUMERO_PEDIDO = v.PEDIDO
+                ORDER BY v.SOLICITUD, f.ID_FACTURA
+            """, params)
+            for row in cursor.fetchall():
+                facturas.setdefault(row[0], row)
+
+        # === DETALLE_PRODUCTO ===
+        detalles = []
+        for sol, _, cantidad in convertidas:
+            factura = facturas.get(str(sol))
+            if not factura or not cantidad or cantidad <= 0:
+                continue
+            unitarios = _detalle_unitario(float(factura[2] or 0), float(factura[3] or 0),
+                                          float(factura[4] or 0), cantidad)
+            detalles.append((int(factura[1]), cantidad, *unitarios, ID_PRODUCTO_PEDIDO))
+
+        columnas = "ID_FACTURA, CANTIDAD, PBASE_SI_U, IEV_U, IEF_U, PTOTAL_U, SUBTOTAL, ID_PRODUCTO"
+        for tramo in en_tramos(detalles):
+            marcadores, params = valores_sql(tramo)
+            cursor.execute(f"""
+                UPDATE DETALLE_PRODUCTO
+                SET CANTIDAD = v.CANTIDAD, PBASE_SI_U = v.PBASE_SI_U, IEV_U = v.IEV_U, IEF_U = v.IEF_U,
+                    PTOTAL_U = v.PTOTAL_U, SUBTOTAL = v.SUBTOTAL, ID_PRODUCTO = v.ID_PRODUCTO
+                FROM (VALUES {marcadores}) AS v ({columnas})
+                WHERE DETALLE_PRODUCTO.ID_FACTURA = v.ID_FACTURA
+            """, params)
+            cursor.execute(f"""
+                INSERT INTO DETALLE_PRODUCTO ({columnas})
+                SELECT {columnas}
+                FROM (VALUES {marcadores}) AS v ({columnas})
+                WHERE NOT EXISTS (SELECT 1 FROM DETALLE_PRODUCTO d WHERE d.ID_FACTURA = v.ID_FACTURA)
+            """, params)
+
+        conn.commit()
+        print(f"🗃️ FACTURAS / DETALLE_PRODUCTO actualizados → {len(pares)} pedidos, {len(detalles)} detalles")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@tarea_outbox("convertir_a_pedidos_lote")
+def _convertir_a_pedidos_lote(job):
+    items = job.payload["items"]
+    pedidos = con_claves_int(job.contexto.get("creados"))
+    errores = con_claves_int(job.contexto.get("errores"))
+    solicitudes_num = con_claves_int(job.contexto.get("docnums"))
+    cantidades = con_claves_int(job.contexto.get("cantidades"))
+
+    with sap_session() as sap:
+        # === Reconciliar un envío anterior sin respuesta ===
+        if job.contexto.get("enviando"):
+            pedidos.update(creados_por_etiqueta(sap, job, "PurchaseOrders"))
+            job.checkpoint("Pedidos existentes verificados", enviando=None, creados=con_claves_str(pedidos))
+
+        pendientes = [it["DocEntry"] for it in items if it["DocEntry"] not in pedidos and it["DocEntry"] not in errores]
+        if pendientes:
+            # === Leer solicitudes en $batch ===
+            solicitudes, no_encontradas = leer_documentos(
+                sap, "PurchaseRequests", pendientes, "DocEntry,DocNum,DocumentStatus,DocumentLines"
+            )
+            errores.update(no_encontradas)
+            print(f"📋 Convirtiendo {len(solicitudes)} solicitudes → Pedidos en lote...")
+
+            card_codes = {it["DocEntry"]: it["CardCode"] for it in items}
+            por_enviar = []
+            for doc_entry in pendientes:
+                solicitud = solicitudes.get(doc_entry)
+                if solicitud is None:
+                    continue
+                solicitudes_num[doc_entry] = solicitud.get("DocNum")
+                lineas = solicitud.get("DocumentLines") or []
+                cantidades[doc_entry] = float(lineas[0]["Quantity"]) if lineas else 0
+                if solicitud.get("DocumentStatus", "bost_Open") != "bost_Open":
+                    errores[doc_entry] = f"La solicitud {solicitud.get('DocNum')} ya no está abierta"
+                    continue
+                if not lineas:
+                    errores[doc_entry] = f"La solicitud {solicitud.get('DocNum')} no tiene líneas"
+                    continue
+                por_enviar.append((doc_entry, _payload_pedido(
+                    solicitud, card_codes[doc_entry],
+                    job.comentario(f"Pedido generado automáticamente desde Solicitud {solicitud.get('DocNum')}")
+                )))
+
+            # === Crear pedidos en $batch, un changeset por pedido ===
+            if por_enviar:
+                job.checkpoint(f"Enviando {len(por_enviar)} pedidos a SAP", enviando=True,
+                               docnums=con_claves_str(solicitudes_num),
+                               cantidades=con_claves_str(cantidades),
+                               errores=con_claves_str(errores))
+                creados, rechazados, sin_respuesta = crear_en_lote(sap, "PurchaseOrders", por_enviar)
+                pedidos.update(creados)
+                errores.update(rechazados)
+
+                # Si algún pedido quedó sin respuesta se reintenta el trabajo; al
+                # retomarlo se buscan por etiqueta los que SAP alcanzó a crear
+                job.checkpoint(f"{len(pedidos)} pedidos creados en SAP", enviando=sin_respuesta > 0,
+                               creados=con_claves_str(pedidos), errores=con_claves_str(errores))
+                if sin_respuesta:
+                    raise Transitorio(f"{sin_respuesta} pedidos sin respuesta de SAP")
+
+    if pedidos:
+        invalidar_espejo("PurchaseRequests", "PurchaseOrders")
+
+    # === Actualizar BD local en bloque ===
+    if pedidos and not job.hecho("bd_local"):
+        _actualizar_bd_lote([
+            (solicitudes_num.get(doc_entry), pedido.get("DocNum"), cantidades.get(doc_entry, 0))
+            for doc_entry, pedido in pedidos.items()
+        ])
+        job.marcar("bd_local")
+        for doc_entry, pedido in pedidos.items():
+            publicar_evento("documento", entidad="PurchaseOrders", DocEntry=pedido.get("DocEntry"),
+                            DocNum=pedido.get("DocNum"), origen="PurchaseRequests",
+                            DocEntryOrigen=doc_entry, DocNumOrigen=solicitudes_num.get(doc_entry))
+
+    # === Respuesta por ítem ===
+    resultados = []
+    for it in items:
+        doc_entry = it["DocEntry"]
+        pedido = pedidos.get(doc_entry)
+        if pedido:
+            resultados.append({"DocEntry": doc_entry, "ok": True, "DocNum": solicitudes_num.get(doc_entry),
+                               "DocNumPedido": pedido.get("DocNum"), "DocEntryPedido": pedido.get("DocEntry")})
+        else:
+            resultados.append({"DocEntry": doc_entry, "ok": False, "DocNum": solicitudes_num.get(doc_entry),
+                               "mensaje": errores.get(doc_entry, "Error al crear pedido en SAP")})
+
+    convertidas = sum(1 for r in resultados if r["ok"])
+    print(f"✅ Conversión masiva: {convertidas}/{len(items)} solicitudes convertidas a pedido")
+    return (200 if convertidas else 400), {
+        "status": "ok" if convertidas else "error",
+        "mensaje": f"{convertidas} de {len(items)} solicitudes convertidas a Pedido.",
+        "data": {"convertidas": convertidas, "fallidas": len(items) - convertidas, "resultados": resultados}
+    }
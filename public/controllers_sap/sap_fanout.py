@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from controllers_sap.sap_service import sap_session, SAP_BATCH_SIZE, SAP_CONNECT_TIMEOUT_S, SAP_READ_TIMEOUT_S
+
+# "batch" agrupa las lecturas en $batch; "fanout" usa GETs concurrentes
+# (para versiones del Service Layer donde $batch está restringido)
+SAP_DETAIL_MODE = os.getenv("SAP_DETAIL_MODE", "batch").strip().lower()
+# Máximo de requests simultáneos hacia SAP en modo fan-out
+SAP_FANOUT_WORKERS = int(os.getenv("SAP_FANOUT_WORKERS", "4"))
+# Plazo total de un fan-out (segundos). Por defecto igual al timeout de un request a SAP:
+# un GET que sigue en curso al vencer termina (y devuelve su sesión) a más tardar entonces
+SAP_FANOUT_TIMEOUT_S = float(os.getenv("SAP_FANOUT_TIMEOUT_S", str(SAP_CONNECT_TIMEOUT_S + SAP_READ_TIMEOUT_S)))
+
+_executor = ThreadPoolExecutor(max_workers=SAP_FANOUT_WORKERS, thread_name_prefix="sap-fanout")
+
+
+def _antes_de(limite, funcion, item):
+    """Un item que sale de la cola con el plazo vencido no se ejecuta (no toma sesión SAP)."""
+    if time.monotonic() >= limite:
+        raise TimeoutError("plazo vencido antes de iniciar")
+    return funcion(item)
+
+
+def fan_out(funcion, items, timeout=SAP_FANOUT_TIMEOUT_S):
+    """
+    Ejecuta funcion(item) para cada item en el pool de hilos compartido, con un
+    único plazo de `timeout` segundos para todo el conjunto.
+    Retorna una lista de (ok, resultado) en el mismo orden que items;
+    un error o timeout en un item no interrumpe a los demás.
+    """
+    limite = time.monotonic() + timeout
+    futuros = [_executor.submit(_antes_de, limite, funcion, item) for item in items]
+    wait(futuros, timeout=max(0.0, limite - time.monotonic()))
+
+    resultados = []
+    for futuro in futuros:
+        if not futuro.done():
+            # Los que no empezaron se descartan; los que están en curso terminan solos
+            futuro.cancel()
+            resultados.append((False, f"Timeout después de {timeout}s"))
+            continue
+        try:
+            resultados.append((True, futuro.result()))
+        except Exception as e:
+            resultados.append((False, str(e)))
+    return resultados
+
+
+def _obtener_documento(endpoint):
+    """GET de un documento con una sesión propia del pool (una por hilo)."""
+    with sap_session() as sap:
+        ok, data = sap.get(endpoint)
+    if not ok:
+        raise RuntimeError(data)
+    return data
+
+
+def _detalles_fanout(entidad, doc_entries):
+    endpoints = [f"{entidad}({doc_entry})?$select=DocEntry,DocumentLines" for doc_entry in doc_entries]
+    return zip(doc_entries, fan_out(_obtener_documento, endpoints))
+
+
+def _detalles_batch(sap, entidad, doc_entries):
+    for i in range(0, len(doc_entries), SAP_BATCH_SIZE):
+        lote = doc_entries[i:i + SAP_BATCH_SIZE]
+        ops = [
+            {"method": "GET", "endpoint": f"{entidad}({doc_entry})?$select=DocEntry,DocumentLines"}
+            for doc_entry in lote
+        ]
+        yield from zip(lote, sap.batch(ops))
+
+
+def obtener_detalles(sap, entidad, doc_entries):
+    """
+    Trae el detalle (DocumentLines) de varios documentos SAP, vía $batch
+    o fan-out concurrente según SAP_DETAIL_MODE.
+    Retorna {DocEntry: documento}; los documentos que fallan no se incluyen.
+    """
+    if SAP_DETAIL_MODE == "fanout":
+        resultados = _detalles_fanout(entidad, doc_entries)
+    else:
+        resultados = _detalles_batch(sap, entidad, doc_entries)
+
+    detalles = {}
+    for doc_entry, (ok, data) in resultados:
+        if ok and isinstance(data, dict):
+            detalles[doc_entry] = data
+        else:
+            print(f"⚠️ No se pudo obtener {entidad}({doc_entry}): {data}")
+    return detalles
@@ -1,7 +1,9 @@
 
 
 from flask import Blueprint, jsonify, request
-from controllers_sap.sap_service import SAPServiceLayer
+from controllers_sap.sap_service import sap_session, SAPError
+from controllers_sap.sap_cache import master_data
+from controllers_sap.sap_indexes import vendor_index, item_index
 from bd import get_connection
 
 
@@ -60,20 +62,15 @@ def pedidos_cerrados():
 @sap_getters_bp.route("/sap/items", methods=["GET"])
 def get_items():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("Items?$select=ItemCode,ItemName,ForeignName")
-        sap.logout()
-
-        if ok and "value" in data:
-            return jsonify([
-                {
-                    "ItemCode": i["ItemCode"],
-                    "ItemName": i["ItemName"],
-                    "ForeignName": i.get("ForeignName", "")
-                }
-                for i in data["value"]
-            ])
+        return jsonify([
+            {
+                "ItemCode": i["ItemCode"],
+                "ItemName": i["ItemName"],
+                "ForeignName": i.get("ForeignName", "")
+            }
+            for i in master_data.get("items")
+        ])
+    except SAPError:
         return jsonify({"error": "No se pudieron obtener artículos"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -82,16 +79,11 @@ def get_items():
 @sap_getters_bp.route("/sap/vendors", methods=["GET"])
 def get_vendors():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("BusinessPartners?$filter=CardType eq 'S'&$select=CardCode,CardName")
-        sap.logout()
-
-        if ok and "value" in data:
-            return jsonify([
-                {"CardCode": v["CardCode"], "CardName": v["CardName"]}
-                for v in data["value"]
-            ])
+        return jsonify([
+            {"CardCode": v["CardCode"], "CardName": v["CardName"]}
+            for v in master_data.get("vendors")
+        ])
+    except SAPError:
         return jsonify({"error": "No se pudieron obtener proveedores"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -100,16 +92,11 @@ def get_vendors():
 @sap_getters_bp.route("/sap/warehouses", methods=["GET"])
 def get_warehouses():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("Warehouses?$select=WarehouseCode,WarehouseName")
-        sap.logout()
-
-        if ok and "value" in data:
-            return jsonify([
-                {"WarehouseCode": w["WarehouseCode"], "WarehouseName": w["WarehouseName"]}
-                for w in data["value"]
-            ])
+        return jsonify([
+            {"WarehouseCode": w["WarehouseCode"], "WarehouseName": w["WarehouseName"]}
+            for w in master_data.get("warehouses")
+        ])
+    except SAPError:
         return jsonify({"error": "No se pudieron obtener almacenes"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -118,28 +105,39 @@ def get_warehouses():
 @sap_getters_bp.route("/sap/taxcodes", methods=["GET"])
 def get_taxcodes():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("VatGroups?$select=Code,Name")
-        sap.logout()
-
-        if ok and "value" in data:
-            return jsonify([
-                {"TaxCode": t["Code"], "TaxName": t["Name"]}
-                for t in data["value"]
-            ])
+        return jsonify([
+            {"TaxCode": t["Code"], "TaxName": t["Name"]}
+            for t in master_data.get("taxcodes")
+        ])
+    except SAPError:
         return jsonify({"error": "No se pudieron obtener impuestos"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@sap_getters_bp.route("/sap/items/match", methods=["GET"])
+def match_items():
+    """Artículos SAP más parecidos a una descripción (?q=...&k=5), con puntaje 0-1."""
+    try:
+        q = request.args.get("q", "").strip()
+        if not q:
+            return jsonify({"status": "error", "mensaje": "Falta parámetro ?q="}), 400
+        try:
+            k = max(1, min(int(request.args.get("k", 5)), 50))
+        except ValueError:
+            return jsonify({"status": "error", "mensaje": "El parámetro k debe ser un entero."}), 400
+        return jsonify({"status": "ok", "data": get_item_candidates(q, k)}), 200
+    except SAPError:
+        return jsonify({"error": "No se pudieron obtener artículos"}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @sap_getters_bp.route("/sap/last_request", methods=["GET"])
 def get_last_request():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("PurchaseRequests?$orderby=DocNum desc&$top=1")
-        sap.logout()
+        with sap_session() as sap:
+            ok, data = sap.get("PurchaseRequests?$orderby=DocNum desc&$top=1")
 
         if ok and "value" in data and len(data["value"]) > 0:
             last = data["value"][0]
@@ -156,54 +154,39 @@ def get_last_request():
 # ==========================================================
 
 def get_vendor_by_rut(rut: str):
-    """Busca un proveedor en SAP por su RUT (CardCode o parte del nombre)."""
+    """Busca un proveedor por su RUT en el índice local (fallback a SAP solo si no está)."""
     try:
-        rut_limpio = rut.replace(".", "").replace("-", "").strip()
-        sap = SAPServiceLayer()
-        sap.login()
-
-        query = f"BusinessPartners?$filter=startswith(CardCode,'PN{rut_limpio}') or contains(CardName,'{rut_limpio}')&$select=CardCode,CardName"
-        ok, data = sap.get(query)
-        sap.logout()
-
-        if ok and "value" in data and data["value"]:
-            return data["value"][0]
+        return vendor_index.buscar(rut)
     except Exception as e:
         print(f"⚠️ Error en get_vendor_by_rut: {e}")
     return None
 
 
 def get_item_by_description(description: str):
-    """Busca un artículo por su descripción."""
+    """Busca el artículo más parecido a la descripción en el índice local de artículos."""
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-
-        desc_segura = description.replace("'", "''").strip().upper()
-        endpoint = f"Items?$filter=substringof('{desc_segura}', ItemName)&$top=1"
-
-        ok, data = sap.get(endpoint)
-        sap.logout()
-
-        if ok and data.get("value"):
-            return data["value"][0]
+        return item_index.mejor(description)
     except Exception as e:
         print(f"⚠️ Error en get_item_by_description: {e}")
     return None
 
 
+def get_item_candidates(description: str, k: int = 5):
+    """Retorna los k artículos más parecidos a la descripción, con su puntaje."""
+    try:
+        return item_index.buscar(description, k)
+    except Exception as e:
+        print(f"⚠️ Error en get_item_candidates: {e}")
+    return []
+
+
 def get_warehouse_by_code(code: str):
     """Obtiene información de un almacén por su código (BT, BL, BS, etc.)."""
     try:
         code_upper = code.strip().upper()
-        sap = SAPServiceLayer()
-        sap.login()
-        query = f"Warehouses?$filter=WarehouseCode eq '{code_upper}'&$select=WarehouseCode,WarehouseName"
-        ok, data = sap.get(query)
-        sap.logout()
-
-        if ok and "value" in data and data["value"]:
-            return data["value"][0]
+        for w in master_data.get("warehouses"):
+            if (w.get("WarehouseCode") or "").upper() == code_upper:
+                return w
     except Exception as e:
         print(f"⚠️ Error en get_warehouse_by_code: {e}")
     return None
@@ -242,91 +225,7 @@ def mapa_pedido_solicitud():
         print(f"❌ Error en /sap/mapa_pedido_solicitud: {e}")
         return jsonify({"status": "error", "mensaje": str(e)}), 500
 
-@sap_getters_bp.route("/sap/pedidos_abiertos", methods=["GET"])
-def pedidos_abiertos():
-    """
-    Trae los pedidos abiertos desde SAP y agrega el número de solicitud SAP
-    desde la tabla FACTURAS (NUMERO_SOLICITUD_SAP), comparando NUMERO_PEDIDO ↔ DocNum.
-    """
 
-    try:
-        print("🔹 [DEBUG] Cargando pedidos abiertos desde SAP...")
-
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, data = sap.get("PurchaseOrders?$filter=DocumentStatus eq 'bost_Open'")
-        sap.logout()
-
-        if not ok or "value" not in data:
-            return jsonify({"status": "error", "mensaje": "No se pudieron obtener pedidos desde SAP"}), 400
-
-        # 1. Se crea la lista de pedidos de SAP
-        pedidos = [
-            {
-                "DocEntry": p.get("DocEntry"),
-                "DocNum": int(p.get("DocNum", 0)),
-                "CardCode": p.get("CardCode"),
-                "CardName": p.get("CardName"),
-                "DocDate": p.get("DocDate"),
-                "DocDueDate": p.get("DocDueDate"),
-                "Moneda": p.get("DocCurrency", "CLP"),
-                "Total": p.get("DocTotal", 0),
-                "Estado": "Abierto",
-                "tipo": "Pedido",
-                "Lineas": [
-                    {
-                        "ItemCode": l.get("ItemCode"),
-                        "ItemDescription": l.get("ItemDescription"),
-                        "WarehouseCode": l.get("WarehouseCode"),
-                        "Quantity": l.get("Quantity"),
-                    }
-                    for l in p.get("DocumentLines", [])
-                ],
-            }
-            for p in data["value"]
-        ]
-
-        #Relaciones desde FACTURAS
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT 
-                RTRIM(LTRIM(NUMERO_PEDIDO)) AS NUM_PEDIDO,
-                RTRIM(LTRIM(NUMERO_SOLICITUD_SAP)) AS NUM_SOLICITUD
-            FROM FACTURAS
-            WHERE NUMERO_PEDIDO IS NOT NULL
-              AND NUMERO_SOLICITUD_SAP IS NOT NULL
-              AND LEN(RTRIM(LTRIM(NUMERO_PEDIDO))) > 0
-        """)
-        registros = cur.fetchall()
-        conn.close()
-        relaciones = {}
-        for pedido_db, solicitud_db in registros:
-            if not pedido_db or not solicitud_db:
-                continue
-            # Normaliza los datos
-            pedido_norm = str(pedido_db).strip().lstrip("0")
-            solicitud_norm = str(solicitud_db).strip()
-            # Se guarda la relación
-            relaciones[pedido_norm] = solicitud_norm
-        print(f"🧩 [DEBUG] Relaciones construidas: {relaciones}")
-
-
-        #VINCULAR SOLICITUDES A PEDIDOS
-        for pedido_sap in pedidos:
-            docnum_str = str(pedido_sap.get("DocNum")).strip().lstrip("0")
-            solicitud_encontrada = relaciones.get(docnum_str) 
-            pedido_sap["SolicitudSAP"] = solicitud_encontrada if solicitud_encontrada else None
-
-        print("✅ [DEBUG] Pedidos cruzados correctamente con FACTURAS")
-        return jsonify({"status": "ok", "data": pedidos}), 200
-
-    except Exception as e:
-        print(f"❌ Error en /sap/pedidos_abiertos: {e}")
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
-    
-
-    
 @sap_getters_bp.route("/sap/obtener_datos_ocr", methods=["GET"])
 def obtener_datos_ocr():
     """
@@ -13,7 +13,10 @@ from controllers.validations import (
     litros_totales_factura,
     registrar_log
 )
-from controllers_sap.sap_service import SAPServiceLayer
+from controllers_sap.sap_service import sap_pool, sap_session
+from controllers_sap.sap_outbox import encolar, responder, tarea_outbox
+from controllers_sap.sap_mirror import invalidar_espejo
+from controllers.eventos import publicar_evento
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 insert_bp = Blueprint("insert_bp", __name__)
@@ -149,6 +152,9 @@ def insert_factura():
             """, (id_factura, dist["tank"], dist["liters"]))
 
         conn.commit()
+        publicar_evento("factura", ID_FACTURA=id_factura, NUMERO_FACTURA=factura.get("Número de factura"),
+                        NUMERO_SOLICITUD_SAP=numero_solicitud_sap, NOMBRE_EMISOR=factura.get("Empresa del combustible"))
+
             # === MOVER PDF SOLO SI SAP Y BD FUERON EXITOSOS ===
         try:
             numero_factura = factura.get("Número de factura")
@@ -252,16 +258,31 @@ def crear_solicitud_compra_route():
         print("\n📦 Payload final a enviar a SAP:")
         print(json.dumps(payload, indent=2, ensure_ascii=False))
 
-        sap = SAPServiceLayer()
-        sap.login()
-        ok, response = sap.post("PurchaseRequests", payload)
+        # El POST a SAP y el movimiento del PDF se ejecutan vía outbox (un job por PDF)
+        id_job = encolar("crear_solicitud_compra", {"payload": payload, "source_pdf": source_pdf},
+                         cadena=f"pdf:{source_pdf}" if source_pdf else None)
+        return responder(id_job)
+
+    except Exception as e:
+        print(f"❌ Error general en crear_solicitud_compra: {e}")
+        registrar_log(None, "SAP_EXCEPTION", str(e))
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+
+
+@tarea_outbox("crear_solicitud_compra")
+def _crear_solicitud_compra(job):
+    payload = dict(job.payload["payload"], Comments=job.comentario(job.payload["payload"]["Comments"]))
+    source_pdf = job.payload.get("source_pdf")
+
+    sap = sap_pool.acquire()
+    try:
+        ok, response = job.crear_en_sap(sap, "PurchaseRequests", payload)
 
         if not ok:
             mensaje_error = response.get("error", {}).get("message", {}).get("value", "Error desconocido")
             registrar_log(None, "SAP_ERROR", mensaje_error)
-            sap.logout()
             print(f"❌ Error POST SAP: {mensaje_error}")
-            return jsonify({"status": "error", "mensaje": mensaje_error, "payload": payload}), 500
+            return 500, {"status": "error", "mensaje": mensaje_error, "payload": payload}
 
         # === Éxito ===
         doc_entry = response.get("DocEntry")
@@ -269,6 +290,8 @@ def crear_solicitud_compra_route():
 
         print(f"✅ Solicitud creada correctamente en SAP (DocNum={doc_num})")
         registrar_log(doc_entry, "SAP_OK", f"Solicitud SAP creada exitosamente (DocNum {doc_num})")
+        publicar_evento("documento", entidad="PurchaseRequests", DocEntry=doc_entry, DocNum=doc_num)
+        invalidar_espejo("PurchaseRequests")
 
         try:
             if source_pdf:
@@ -294,21 +317,16 @@ def crear_solicitud_compra_route():
         except Exception as move_err:
             print(f"⚠️ Error moviendo PDF tras SAP OK: {move_err}")
 
-        sap.logout()
-        print("🔒 Sesión SAP cerrada correctamente.")
-
-        return jsonify({
+        return 200, {
             "status": "ok",
             "DocNum": doc_num,
             "DocEntry": doc_entry,
             "mensaje": f"Solicitud creada correctamente (DocNum {doc_num})",
             "archivo_movido": True if source_pdf else False
-        }), 200
-
-    except Exception as e:
-        print(f"❌ Error general en crear_solicitud_compra: {e}")
-        registrar_log(None, "SAP_EXCEPTION", str(e))
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
+        }
+    finally:
+        sap_pool.release(sap)
+        print("🔒 Sesión SAP devuelta al pool.")
 
 
 # ==========================================================
@@ -330,11 +348,9 @@ def actualizar_codigos_ocr():
         if not doc_entry:
             return jsonify({"status": "error", "mensaje": "Falta DocEntry"}), 400
 
-        sap = SAPServiceLayer()
-        sap.login()
         payload = {"CostingCode": ocr1, "CostingCode2": ocr2, "CostingCode3": ocr3}
-        ok, resp = sap.patch(f"PurchaseDeliveryNotes({doc_entry})", payload)
-        sap.logout()
+        with sap_session() as sap:
+            ok, resp = sap.patch(f"PurchaseDeliveryNotes({doc_entry})", payload)
 
         if not ok:
             return jsonify({"status": "error", "mensaje": str(resp)}), 500
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import datetime
+import threading
+from collections import Counter
+
+from controllers.validations import _normalize
+from controllers_sap.sap_service import sap_session, sap_breaker
+from controllers_sap.sap_cache import master_data
+
+# Cada cuántos segundos se consultan a SAP los proveedores modificados
+SAP_VENDOR_DELTA_S = int(os.getenv("SAP_VENDOR_DELTA_S", "300"))
+# Segundos que se recuerda que un RUT no existe en SAP (evita una consulta por cada upload con ese RUT)
+SAP_VENDOR_MISS_TTL_S = int(os.getenv("SAP_VENDOR_MISS_TTL_S", "120"))
+# Puntaje mínimo (0-1) para aceptar un artículo como coincidencia del OCR
+SAP_ITEM_MATCH_MIN = float(os.getenv("SAP_ITEM_MATCH_MIN", "0.45"))
+
+
+# === NORMALIZAR RUT (99.520.000-7, PN99520000-7, 995200007 → 99520000-7) ===
+def normalizar_rut(rut: str):
+    if not rut:
+        return None
+    texto = str(rut).upper().strip().removeprefix("PN")
+    limpio = re.sub(r"[^0-9K]", "", texto)
+    cuerpo, dv = limpio[:-1].lstrip("0"), limpio[-1:]
+
+    # Sin guion y sin un DV válido al final: se asume que viene solo el cuerpo
+    if "-" not in texto and limpio.isdigit() and 7 <= len(limpio.lstrip("0")) <= 8 \
+            and digito_verificador(cuerpo) != dv:
+        cuerpo = limpio.lstrip("0")
+        dv = digito_verificador(cuerpo)
+
+    if not cuerpo.isdigit() or not 6 <= len(cuerpo) <= 9:
+        return None
+    return f"{cuerpo}-{dv}"
+
+
+def digito_verificador(cuerpo: str) -> str:
+    """Calcula el dígito verificador (módulo 11) de un RUT chileno."""
+    suma, factor = 0, 2
+    for d in reversed(cuerpo):
+        suma += int(d) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: "0", 10: "K"}.get(resto, str(resto))
+
+
+class VendorIndex:
+    """
+    Índice en memoria de proveedores SAP por RUT normalizado.
+    Se reconstruye cuando la cache de datos maestros recarga 'vendors'
+    y se actualiza incrementalmente con los proveedores modificados (UpdateDate).
+    """
+
+    def __init__(self):
+        self._por_rut = {}
+        self._ausentes = {}
+        self._origen = None
+        self._ultimo_delta = 0.0
+        self._desde = None
+        self._refrescando = False
+        self._lock = threading.Lock()
+
+    def buscar(self, rut: str):
+        """Retorna el proveedor {CardCode, CardName} para el RUT, o None."""
+        clave = normalizar_rut(rut)
+        if not clave:
+            return None
+
+        self._sincronizar()
+        with self._lock:
+            vendor = self._por_rut.get(clave)
+            ausente = self._ausentes.get(clave, 0) > time.time()
+        if vendor or ausente:
+            return vendor
+
+        return self._buscar_en_sap(clave)
+
+    def _sincronizar(self):
+        filas = master_data.get("vendors")
+        with self._lock:
+            if filas is not self._origen:
+                self._por_rut = {}
+                self._ausentes = {}
+                for v in filas:
+                    self._agregar(v)
+                self._origen = filas
+                self._desde = datetime.date.today()
+                self._ultimo_delta = time.time()
+                print(f"🗂️ Índice de proveedores reconstruido ({len(self._por_rut)} RUT)")
+            # El delta corre en segundo plano: el upload no espera a SAP; con SAP caído se omite
+            pendiente = (time.time() - self._ultimo_delta >= SAP_VENDOR_DELTA_S
+                         and not self._refrescando and not sap_breaker.abierto)
+            if pendiente:
+                self._ultimo_delta = time.time()
+                self._refrescando = True
+        if pendiente:
+            threading.Thread(target=self._refrescar_en_segundo_plano, name="sap-vendor-delta", daemon=True).start()
+
+    def _refrescar_en_segundo_plano(self):
+        try:
+            self._refrescar_incremental()
+        finally:
+            with self._lock:
+                self._refrescando = False
+
+    def _refrescar_incremental(self):
+        """Trae solo los proveedores creados o modificados desde la última sincronización."""
+        desde = self._desde or datetime.date.today()
+        try:
+            with sap_session() as sap:
+                cambios = list(sap.iter_collection(
+                    "BusinessPartners",
+                    select="CardCode,CardName,FederalTaxID",
+                    filter=f"CardType eq 'S' and UpdateDate ge '{desde.isoformat()}'",
+                ))
+        except Exception as e:
+            print(f"⚠️ No se pudo refrescar índice de proveedores: {e}")
+            return
+
+        with self._lock:
+            for v in cambios:
+                self._agregar(v)
+            self._desde = datetime.date.today()
+        if cambios:
+            print(f"🔄 Índice de proveedores: {len(cambios)} cambios desde {desde}")
+
+    def _buscar_en_sap(self, clave):
+        """
+        Fallback ante un miss: consulta puntual de proveedores por CardCode /
+        FederalTaxID, con igualdad exacta (usa el índice de SAP). El CardCode puede
+        estar con guion (PN99520000-7) o sin él (PN995200007). Un RUT que no existe
+        se recuerda SAP_VENDOR_MISS_TTL_S segundos.
+        """
+        sin_guion = clave.replace("-", "")
+        with sap_session() as sap:
+            ok, data = sap.get(
+                "BusinessPartners?$select=CardCode,CardName,FederalTaxID"
+                f"&$filter=CardType eq 'S' and (CardCode eq 'PN{clave}' or CardCode eq 'PN{sin_guion}'"
+                f" or FederalTaxID eq '{clave}')"
+            )
+
+        if ok and isinstance(data, dict) and data.get("value"):
+            vendor = data["value"][0]
+            with self._lock:
+                self._agregar(vendor)
+            return {"CardCode": vendor.get("CardCode"), "CardName": vendor.get("CardName")}
+        if ok:
+            with self._lock:
+                self._ausentes[clave] = time.time() + SAP_VENDOR_MISS_TTL_S
+        return None
+
+    def _agregar(self, v):
+        vendor = {"CardCode": v.get("CardCode"), "CardName": v.get("CardName")}
+        for rut in (v.get("CardCode"), v.get("FederalTaxID")):
+            clave = normalizar_rut(rut)
+            if clave:
+                self._por_rut[clave] = vendor
+                self._ausentes.pop(clave, None)
+
+
+vendor_index = VendorIndex()
+
+
+# === TOKENS Y TRIGRAMAS PARA BÚSQUEDA DIFUSA ===
+def _tokens(texto: str):
+    return set(re.findall(r"[A-Z0-9]+", _normalize(texto)))
+
+
+def _trigramas(texto: str):
+    base = " ".join(sorted(_tokens(texto)))
+    if not base:
+        return set()
+    base = f"  {base} "
+    return {base[i:i + 3] for i in range(len(base) - 2)}
+
+
+class ItemIndex:
+    """
+    Índice local de artículos SAP para emparejar descripciones del OCR.
+    Combina similitud de trigramas (Dice) y de tokens, sin ir a SAP.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._por_trigrama = {}
+        self._origen = None
+        self._lock = threading.Lock()
+
+    def buscar(self, descripcion: str, k: int = 5):
+        """Retorna hasta k candidatos [{ItemCode, ItemName, score}] ordenados por puntaje."""
+        consulta_tri = _trigramas(descripcion)
+        if not consulta_tri:
+            return []
+        consulta_tok = _tokens(descripcion)
+
+        self._sincronizar()
+        with self._lock:
+            items, por_trigrama = self._items, self._por_trigrama
+
+        comunes = Counter()
+        for tri in consulta_tri:
+            for idx in por_trigrama.get(tri, ()):
+                comunes[idx] += 1
+
+        candidatos = []
+        for idx, n in comunes.items():
+            item = items[idx]
+            dice = 2 * n / (len(consulta_tri) + len(item["tri"]))
+            tok = len(consulta_tok & item["tok"]) / len(consulta_tok | item["tok"])
+            candidatos.append((round(0.7 * dice + 0.3 * tok, 4), idx))
+
+        candidatos.sort(key=lambda c: c[0], reverse=True)
+        return [
+            {"ItemCode": items[idx]["ItemCode"], "ItemName": items[idx]["ItemName"], "score": score}
+            for score, idx in candidatos[:k]
+        ]
+
+    def mejor(self, descripcion: str, minimo: float = SAP_ITEM_MATCH_MIN):
+        """Mejor candidato si supera el puntaje mínimo, o None."""
+        candidatos = self.buscar(descripcion, k=1)
+        if candidatos and candidatos[0]["score"] >= minimo:
+            return candidatos[0]
+        return None
+
+    def _sincronizar(self):
+        filas = master_data.get("items")
+        with self._lock:
+            if filas is self._origen:
+                return
+
+        items, por_trigrama = [], {}
+        for fila in filas:
+            nombre = fila.get("ItemName") or ""
+            tri = _trigramas(nombre)
+            if not tri:
+                continue
+            idx = len(items)
+            items.append({
+                "ItemCode": fila.get("ItemCode"),
+                "ItemName": nombre,
+                "tri": tri,
+                "tok": _tokens(nombre),
+            })
+            for t in tri:
+                por_trigrama.setdefault(t, []).append(idx)
+
+        with self._lock:
+            self._items, self._por_trigrama, self._origen = items, por_trigrama, filas
+        print(f"🗂️ Índice de artículos reconstruido ({len(items)} artículos)")
+
+
+item_index = ItemIndex()
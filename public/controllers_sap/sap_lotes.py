@@ -0,0 +1,122 @@
+import os
+
+from controllers_sap.sap_service import SAP_BATCH_SIZE, SAPError
+from controllers_sap.sap_outbox import es_transitorio, Transitorio
+
+# Máximo de documentos por operación masiva
+SAP_CONVERSION_LOTE_MAX = int(os.getenv("SAP_CONVERSION_LOTE_MAX", "200"))
+# Filas por sentencia en las actualizaciones masivas (SQL Server admite 2100 parámetros)
+SQL_FILAS_POR_SENTENCIA = 200
+
+
+def items_del_body(lista, **defectos):
+    """
+    Normaliza la lista de documentos de un request masivo: acepta DocEntries sueltos
+    o dicts {"DocEntry", ...}; completa con `defectos` y descarta repetidos.
+    Lanza ValueError si algún DocEntry no es válido.
+    """
+    items, vistos = [], set()
+    for item in lista or []:
+        datos = dict(defectos)
+        if isinstance(item, dict):
+            datos.update({k: v for k, v in item.items() if v is not None})
+            doc_entry = item.get("DocEntry")
+        else:
+            doc_entry = item
+        try:
+            doc_entry = int(doc_entry)
+        except (TypeError, ValueError):
+            raise ValueError(f"DocEntry inválido: {doc_entry}")
+        if doc_entry not in vistos:
+            vistos.add(doc_entry)
+            items.append({**datos, "DocEntry": doc_entry})
+    return items
+
+
+def mensaje_sap(data):
+    """Texto legible de un error devuelto por SAP ({"error": {"message": {"value"}}} o texto)."""
+    if isinstance(data, dict):
+        error = data.get("error")
+        if isinstance(error, dict):
+            mensaje = error.get("message")
+            return mensaje.get("value") if isinstance(mensaje, dict) else str(mensaje)
+        return str(error or data)
+    return str(data)
+
+
+def leer_documentos(sap, entidad, doc_entries, select):
+    """
+    Lee varios documentos con $batch. Retorna ({DocEntry: documento}, {DocEntry: error});
+    lanza Transitorio si SAP no responde.
+    """
+    documentos, errores = {}, {}
+    for i in range(0, len(doc_entries), SAP_BATCH_SIZE):
+        lote = doc_entries[i:i + SAP_BATCH_SIZE]
+        ops = [{"method": "GET", "endpoint": f"{entidad}({doc_entry})?$select={select}"} for doc_entry in lote]
+        for doc_entry, (ok, data) in zip(lote, sap.batch(ops)):
+            if ok and isinstance(data, dict):
+                documentos[doc_entry] = data
+            elif es_transitorio(data):
+                raise Transitorio(f"SAP no disponible al leer {entidad}: {data}")
+            else:
+                errores[doc_entry] = f"No se encontró {entidad}({doc_entry}) en SAP"
+    return documentos, errores
+
+
+def crear_en_lote(sap, entidad, por_enviar):
+    """
+    Crea documentos con $batch, cada uno en su propio changeset (uno rechazado no
+    revierte a los demás). por_enviar: lista de (clave, payload).
+    Retorna (creados {clave: {DocEntry, DocNum}}, errores {clave: mensaje}, sin_respuesta).
+    """
+    creados, errores, sin_respuesta = {}, {}, 0
+    for i in range(0, len(por_enviar), SAP_BATCH_SIZE):
+        lote = por_enviar[i:i + SAP_BATCH_SIZE]
+        ops = [{"method": "POST", "endpoint": entidad, "payload": payload} for _, payload in lote]
+        for (clave, _), (ok, resp) in zip(lote, sap.batch(ops)):
+            if ok and isinstance(resp, dict):
+                creados[clave] = {"DocEntry": resp.get("DocEntry"), "DocNum": resp.get("DocNum")}
+            elif es_transitorio(resp) or not isinstance(resp, dict):
+                sin_respuesta += 1
+            else:
+                errores[clave] = mensaje_sap(resp)
+    return creados, errores, sin_respuesta
+
+
+def creados_por_etiqueta(sap, job, entidad):
+    """
+    Documentos de `entidad` que este trabajo ya creó en SAP (por la etiqueta en
+    Comments), para cuando se perdió la respuesta de un $batch anterior.
+    Retorna {BaseEntry de la primera línea: {DocEntry, DocNum}}.
+    """
+    creados = {}
+    try:
+        for doc in sap.iter_collection(entidad, select="DocEntry,DocNum,DocumentLines",
+                                       filter=f"contains(Comments,'{job.etiqueta}')"):
+            lineas = doc.get("DocumentLines") or []
+            if lineas and lineas[0].get("BaseEntry") is not None:
+                creados[int(lineas[0]["BaseEntry"])] = {"DocEntry": doc.get("DocEntry"), "DocNum": doc.get("DocNum")}
+    except SAPError as e:
+        raise Transitorio(f"No se pudo verificar qué documentos {entidad} ya existen en SAP: {e}")
+    return creados
+
+
+def valores_sql(filas):
+    """Marcadores '(?, ?), (?, ?)' y parámetros planos para una cláusula VALUES."""
+    marcadores = ", ".join("(" + ", ".join("?" * len(fila)) + ")" for fila in filas)
+    return marcadores, [valor for fila in filas for valor in fila]
+
+
+def en_tramos(filas):
+    """Parte las filas para no exceder el límite de parámetros por sentencia."""
+    for i in range(0, len(filas), SQL_FILAS_POR_SENTENCIA):
+        yield filas[i:i + SQL_FILAS_POR_SENTENCIA]
+
+
+def con_claves_int(dic):
+    """Las claves de un dict del contexto vuelven como texto desde JSON."""
+    return {int(k): v for k, v in (dic or {}).items()}
+
+
+def con_claves_str(dic):
+    return {str(k): v for k, v in dic.items()}
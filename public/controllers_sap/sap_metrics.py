@@ -0,0 +1,159 @@
+import os
+import re
+import json
+import time
+import threading
+from flask import Blueprint, jsonify
+
+# Emite una línea JSON por cada llamada a SAP (útil para grep / agregadores de logs)
+SAP_METRICS_LOG = os.getenv("SAP_METRICS_LOG", "1") == "1"
+
+# Límites superiores (ms) de los buckets del histograma de latencia
+BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+
+def clave_endpoint(endpoint: str):
+    """
+    Agrupa endpoints por entidad, sin query ni claves:
+    'PurchaseOrders(12)/Close?x=1' → 'PurchaseOrders/Close'.
+    """
+    ruta = (endpoint or "").split("?", 1)[0].strip("/")
+    return re.sub(r"\([^)]*\)", "", ruta) or "/"
+
+
+class _Histograma:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observar(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, limite in enumerate(BUCKETS_MS):
+            if ms <= limite:
+                self.buckets[i] += 1
+                break
+
+    def percentil(self, p):
+        """Aproximación por bucket: límite superior del bucket que contiene el percentil."""
+        if not self.count:
+            return None
+        objetivo = p * self.count
+        acumulado = 0
+        for limite, n in zip(BUCKETS_MS, self.buckets):
+            acumulado += n
+            if acumulado >= objetivo:
+                return self.max_ms if limite == float("inf") else min(limite, self.max_ms)
+        return self.max_ms
+
+    def resumen(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.percentil(0.50),
+            "p95_ms": self.percentil(0.95),
+            "p99_ms": self.percentil(0.99),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {
+                ("+Inf" if limite == float("inf") else str(limite)): n
+                for limite, n in zip(BUCKETS_MS, self.buckets)
+            },
+        }
+
+
+class SAPMetrics:
+    """
+    Métricas en memoria de las llamadas al Service Layer, agrupadas por
+    verbo y entidad: latencia, códigos de respuesta, bytes y reintentos.
+    También cuenta logins y refrescos de sesión.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._por_endpoint = {}
+            self._eventos = {"logins": 0, "login_errors": 0, "session_refreshes": 0, "reauth": 0}
+            self._desde = time.time()
+
+    def registrar(self, method, endpoint, status, ms, bytes_enviados=0, bytes_recibidos=0, reintentos=0, error=None):
+        clave = f"{method.upper()} {clave_endpoint(endpoint)}"
+        with self._lock:
+            m = self._por_endpoint.get(clave)
+            if m is None:
+                m = self._por_endpoint[clave] = {
+                    "latencia": _Histograma(),
+                    "status": {},
+                    "errors": 0,
+                    "retries": 0,
+                    "bytes_out": 0,
+                    "bytes_in": 0,
+                }
+            m["latencia"].observar(ms)
+            codigo = str(status) if status is not None else "error"
+            m["status"][codigo] = m["status"].get(codigo, 0) + 1
+            if error is not None or (status or 0) >= 400:
+                m["errors"] += 1
+            m["retries"] += reintentos
+            m["bytes_out"] += bytes_enviados
+            m["bytes_in"] += bytes_recibidos
+
+        if SAP_METRICS_LOG:
+            linea = {
+                "method": method.upper(),
+                "endpoint": clave_endpoint(endpoint),
+                "status": status,
+                "ms": round(ms, 1),
+                "bytes_out": bytes_enviados,
+                "bytes_in": bytes_recibidos,
+                "retries": reintentos,
+            }
+            if error is not None:
+                linea["error"] = str(error)[:200]
+            print(f"📊 sap_call {json.dumps(linea, ensure_ascii=False)}")
+
+    def evento(self, nombre):
+        with self._lock:
+            self._eventos[nombre] = self._eventos.get(nombre, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {
+                clave: {
+                    **m["latencia"].resumen(),
+                    "status": dict(m["status"]),
+                    "errors": m["errors"],
+                    "retries": m["retries"],
+                    "bytes_out": m["bytes_out"],
+                    "bytes_in": m["bytes_in"],
+                }
+                for clave, m in self._por_endpoint.items()
+            }
+            return {
+                "desde": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._desde)),
+                "eventos": dict(self._eventos),
+                "endpoints": dict(sorted(endpoints.items(), key=lambda e: e[1]["count"] * (e[1]["avg_ms"] or 0), reverse=True)),
+            }
+
+
+sap_metrics = SAPMetrics()
+
+
+sap_metrics_bp = Blueprint("sap_metrics_bp", __name__)
+
+
+@sap_metrics_bp.route("/sap/metrics", methods=["GET"])
+def metrics():
+    return jsonify({"status": "ok", "data": sap_metrics.snapshot()}), 200
+
+
+@sap_metrics_bp.route("/sap/metrics/reset", methods=["POST"])
+def metrics_reset():
+    sap_metrics.reset()
+    print("🧹 Métricas SAP reiniciadas")
+    return jsonify({"status": "ok", "mensaje": "Métricas reiniciadas."}), 200
@@ -0,0 +1,333 @@
+import os
+import time
+import datetime
+import threading
+from flask import Blueprint, jsonify
+
+from controllers_sap.sap_service import sap_pool, sap_breaker
+from bd import get_connection
+
+# Activa la sincronización en segundo plano y la lectura desde el espejo
+SAP_MIRROR_ENABLED = os.getenv("SAP_MIRROR_ENABLED", "0") == "1"
+# Intervalo entre ciclos de sincronización (segundos)
+SAP_MIRROR_INTERVAL_S = int(os.getenv("SAP_MIRROR_INTERVAL_S", "60"))
+# Antigüedad máxima del espejo para servir los dashboards desde él (segundos)
+SAP_MIRROR_MAX_AGE_S = int(os.getenv("SAP_MIRROR_MAX_AGE_S", "300"))
+
+# Documentos que se replican y campos de cabecera que se guardan de cada uno
+DOCUMENTOS_ESPEJO = {
+    "PurchaseRequests": "DocEntry,DocNum,DocDate,DocDueDate,DocumentStatus,Requester,"
+                        "UpdateDate,UpdateTime,DocumentLines",
+    "PurchaseOrders": "DocEntry,DocNum,CardCode,CardName,DocDate,DocDueDate,DocTotal,DocCurrency,"
+                      "DocumentStatus,UpdateDate,UpdateTime,DocumentLines",
+    "PurchaseDeliveryNotes": "DocEntry,DocNum,CardCode,CardName,DocDate,DocDueDate,DocTotal,DocCurrency,"
+                             "DocumentStatus,Comments,UpdateDate,UpdateTime,DocumentLines",
+}
+
+_CABECERA = [
+    ("DOC_NUM", "DocNum"), ("CARD_CODE", "CardCode"), ("CARD_NAME", "CardName"),
+    ("DOC_DATE", "DocDate"), ("DOC_DUE_DATE", "DocDueDate"), ("DOC_TOTAL", "DocTotal"),
+    ("DOC_CURRENCY", "DocCurrency"), ("DOCUMENT_STATUS", "DocumentStatus"),
+    ("REQUESTER", "Requester"), ("COMMENTS", "Comments"),
+    ("UPDATE_DATE", "UpdateDate"), ("UPDATE_TIME", "UpdateTime"),
+]
+_LINEA = [
+    ("LINE_NUM", "LineNum"), ("ITEM_CODE", "ItemCode"), ("ITEM_DESCRIPTION", "ItemDescription"),
+    ("WAREHOUSE_CODE", "WarehouseCode"), ("QUANTITY", "Quantity"), ("UNIT_PRICE", "UnitPrice"),
+    ("LINE_VENDOR", "LineVendor"), ("LINE_VENDOR_NAME", "LineVendorName"), ("REQUESTER", "Requester"),
+]
+
+_DDL = [
+    """
+    IF OBJECT_ID('SAP_DOCUMENTOS', 'U') IS NULL
+    CREATE TABLE SAP_DOCUMENTOS (
+        TIPO VARCHAR(40) NOT NULL,
+        DOC_ENTRY INT NOT NULL,
+        DOC_NUM INT NULL,
+        CARD_CODE NVARCHAR(50) NULL,
+        CARD_NAME NVARCHAR(200) NULL,
+        DOC_DATE VARCHAR(30) NULL,
+        DOC_DUE_DATE VARCHAR(30) NULL,
+        DOC_TOTAL DECIMAL(19, 6) NULL,
+        DOC_CURRENCY VARCHAR(10) NULL,
+        DOCUMENT_STATUS VARCHAR(20) NULL,
+        REQUESTER NVARCHAR(100) NULL,
+        COMMENTS NVARCHAR(MAX) NULL,
+        UPDATE_DATE VARCHAR(30) NULL,
+        UPDATE_TIME VARCHAR(20) NULL,
+        SINCRONIZADO DATETIME NOT NULL DEFAULT GETDATE(),
+        CONSTRAINT PK_SAP_DOCUMENTOS PRIMARY KEY (TIPO, DOC_ENTRY)
+    )
+    """,
+    """
+    IF OBJECT_ID('SAP_DOCUMENTO_LINEAS', 'U') IS NULL
+    CREATE TABLE SAP_DOCUMENTO_LINEAS (
+        TIPO VARCHAR(40) NOT NULL,
+        DOC_ENTRY INT NOT NULL,
+        LINE_NUM INT NOT NULL,
+        ITEM_CODE NVARCHAR(50) NULL,
+        ITEM_DESCRIPTION NVARCHAR(200) NULL,
+        WAREHOUSE_CODE NVARCHAR(20) NULL,
+        QUANTITY DECIMAL(19, 6) NULL,
+        UNIT_PRICE DECIMAL(19, 6) NULL,
+        LINE_VENDOR NVARCHAR(50) NULL,
+        LINE_VENDOR_NAME NVARCHAR(200) NULL,
+        REQUESTER NVARCHAR(100) NULL,
+        CONSTRAINT PK_SAP_DOCUMENTO_LINEAS PRIMARY KEY (TIPO, DOC_ENTRY, LINE_NUM)
+    )
+    """,
+    """
+    IF OBJECT_ID('SAP_SYNC_ESTADO', 'U') IS NULL
+    CREATE TABLE SAP_SYNC_ESTADO (
+        TIPO VARCHAR(40) NOT NULL PRIMARY KEY,
+        ULTIMA_UPDATE_DATE VARCHAR(30) NULL,
+        ULTIMA_SYNC DATETIME NULL,
+        DOCUMENTOS INT NULL
+    )
+    """,
+]
+
+
+def asegurar_tablas():
+    """Crea las tablas del espejo si no existen."""
+    conn = get_connection()
+    cur = conn.cursor()
+    for ddl in _DDL:
+        cur.execute(ddl)
+    conn.commit()
+    conn.close()
+
+
+# === SINCRONIZACIÓN INCREMENTAL ===
+def _filtro_marca(marca):
+    """
+    Filtro por marca de agua 'YYYY-MM-DD HH:MM:SS' (UpdateDate + UpdateTime). Se
+    relee el segundo de la marca (ge) para no perder cambios del mismo segundo.
+    Una marca antigua solo con fecha relee ese día completo.
+    """
+    fecha, _, hora = marca.partition(" ")
+    if not hora:
+        return f"UpdateDate ge '{fecha}'"
+    return f"UpdateDate gt '{fecha}' or (UpdateDate eq '{fecha}' and UpdateTime ge '{hora}')"
+
+
+def _marca_documento(documento):
+    fecha = str(documento.get("UpdateDate") or "")[:10]
+    hora = str(documento.get("UpdateTime") or "00:00:00")[:8]
+    return f"{fecha} {hora}" if fecha else ""
+
+
+def sincronizar(tipo):
+    """
+    Replica en las tablas locales los documentos `tipo` modificados desde
+    la última marca de agua (UpdateDate + UpdateTime). La primera vez trae solo
+    los abiertos. Retorna la cantidad de documentos actualizados.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT ULTIMA_UPDATE_DATE, ULTIMA_SYNC FROM SAP_SYNC_ESTADO WHERE TIPO = ?", (tipo,))
+    row = cur.fetchone()
+    marca = row[0] if row and row[0] else None
+    # Si se invalida durante este ciclo (ULTIMA_SYNC pasa a NULL) no se marca como al día
+    invalidado_al_inicio = not row or row[1] is None
+
+    filtro = _filtro_marca(marca) if marca else "DocumentStatus eq 'bost_Open'"
+
+    sap = sap_pool.acquire()
+    try:
+        documentos = list(sap.iter_collection(tipo, select=DOCUMENTOS_ESPEJO[tipo], filter=filtro))
+    finally:
+        sap_pool.release(sap)
+
+    if documentos:
+        _guardar(cur, tipo, documentos)
+        marca = max(_marca_documento(d) for d in documentos) or marca
+
+    cur.execute("""
+        MERGE SAP_SYNC_ESTADO AS T
+        USING (SELECT ? AS TIPO, ? AS ULTIMA_UPDATE_DATE, ? AS DOCUMENTOS, ? AS INVALIDADO_AL_INICIO) AS S
+        ON T.TIPO = S.TIPO
+        WHEN MATCHED THEN UPDATE SET ULTIMA_UPDATE_DATE = S.ULTIMA_UPDATE_DATE,
+                                     ULTIMA_SYNC = CASE WHEN T.ULTIMA_SYNC IS NULL AND S.INVALIDADO_AL_INICIO = 0
+                                                        THEN NULL ELSE GETDATE() END,
+                                     DOCUMENTOS = S.DOCUMENTOS
+        WHEN NOT MATCHED THEN INSERT (TIPO, ULTIMA_UPDATE_DATE, ULTIMA_SYNC, DOCUMENTOS)
+                              VALUES (S.TIPO, S.ULTIMA_UPDATE_DATE, GETDATE(), S.DOCUMENTOS);
+    """, (tipo, marca, len(documentos), 1 if invalidado_al_inicio else 0))
+    conn.commit()
+    conn.close()
+    return len(documentos)
+
+
+def _guardar(cur, tipo, documentos):
+    """Reemplaza cabecera y líneas de los documentos modificados en una sola transacción."""
+    cur.fast_executemany = True
+    entries = [(tipo, d["DocEntry"]) for d in documentos]
+    cur.executemany("DELETE FROM SAP_DOCUMENTO_LINEAS WHERE TIPO = ? AND DOC_ENTRY = ?", entries)
+    cur.executemany("DELETE FROM SAP_DOCUMENTOS WHERE TIPO = ? AND DOC_ENTRY = ?", entries)
+
+    columnas = ", ".join(col for col, _ in _CABECERA)
+    marcas = ", ".join("?" for _ in _CABECERA)
+    cur.executemany(
+        f"INSERT INTO SAP_DOCUMENTOS (TIPO, DOC_ENTRY, {columnas}) VALUES (?, ?, {marcas})",
+        [(tipo, d["DocEntry"], *[d.get(campo) for _, campo in _CABECERA]) for d in documentos],
+    )
+
+    lineas = [
+        (tipo, d["DocEntry"], *[l.get(campo) for _, campo in _LINEA])
+        for d in documentos
+        for l in d.get("DocumentLines", [])
+    ]
+    if lineas:
+        columnas = ", ".join(col for col, _ in _LINEA)
+        marcas = ", ".join("?" for _ in _LINEA)
+        cur.executemany(
+            f"INSERT INTO SAP_DOCUMENTO_LINEAS (TIPO, DOC_ENTRY, {columnas}) VALUES (?, ?, {marcas})",
+            lineas,
+        )
+
+
+def invalidar_espejo(*tipos):
+    """
+    Marca el espejo de `tipos` como desactualizado tras una escritura en SAP
+    (conversión, entrada): los tableros leen SAP en vivo, en todos los procesos,
+    hasta que el próximo ciclo, que se adelanta, los vuelva a sincronizar.
+    """
+    tipos = [t for t in tipos if t in DOCUMENTOS_ESPEJO]
+    if not SAP_MIRROR_ENABLED or not tipos:
+        return
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"UPDATE SAP_SYNC_ESTADO SET ULTIMA_SYNC = NULL WHERE TIPO IN ({', '.join('?' * len(tipos))})",
+                    tipos)
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"⚠️ No se pudo invalidar el espejo SAP de {', '.join(tipos)}: {e}")
+    _despertar.set()
+
+
+# === LECTURA DESDE EL ESPEJO ===
+def leer_espejo(tipo, item_code=None):
+    """
+    Documentos abiertos de `tipo` desde las tablas locales, con el mismo formato
+    que entrega SAP: (documentos, {DocEntry: {"DocumentLines": [...]}}, sincronizado).
+    Con `item_code` solo se entregan los documentos con ese ítem, y solo esas líneas.
+    Retorna None si el espejo está deshabilitado o desactualizado; con el
+    circuito SAP abierto se entrega aunque esté desactualizado.
+    """
+    if not SAP_MIRROR_ENABLED:
+        return None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT ULTIMA_SYNC FROM SAP_SYNC_ESTADO WHERE TIPO = ?", (tipo,))
+        row = cur.fetchone()
+        sincronizado = row[0] if row else None
+        vencido = not sincronizado or (datetime.datetime.now() - sincronizado).total_seconds() > SAP_MIRROR_MAX_AGE_S
+        if vencido and not (sincronizado and sap_breaker.abierto):
+            conn.close()
+            return None
+
+        filtro_item = ""
+        params = (tipo,)
+        if item_code:
+            filtro_item = """
+              AND EXISTS (SELECT 1 FROM SAP_DOCUMENTO_LINEAS L
+                          WHERE L.TIPO = D.TIPO AND L.DOC_ENTRY = D.DOC_ENTRY AND L.ITEM_CODE = ?)
+            """
+            params = (tipo, item_code)
+
+        columnas = ", ".join("D." + col for col, _ in _CABECERA)
+        cur.execute(f"""
+            SELECT D.DOC_ENTRY, {columnas}
+            FROM SAP_DOCUMENTOS D
+            WHERE D.TIPO = ? AND D.DOCUMENT_STATUS = 'bost_Open' {filtro_item}
+            ORDER BY D.DOC_ENTRY DESC
+        """, params)
+        documentos = [
+            {"DocEntry": r[0], **{campo: _valor(v) for (_, campo), v in zip(_CABECERA, r[1:])}}
+            for r in cur.fetchall()
+        ]
+
+        cur.execute(f"""
+            SELECT L.DOC_ENTRY, {", ".join("L." + col for col, _ in _LINEA)}
+            FROM SAP_DOCUMENTO_LINEAS L
+            INNER JOIN SAP_DOCUMENTOS D ON D.TIPO = L.TIPO AND D.DOC_ENTRY = L.DOC_ENTRY
+            WHERE L.TIPO = ? AND D.DOCUMENT_STATUS = 'bost_Open' {"AND L.ITEM_CODE = ?" if item_code else ""}
+            ORDER BY L.DOC_ENTRY, L.LINE_NUM
+        """, params)
+        detalles = {}
+        for r in cur.fetchall():
+            linea = {campo: _valor(v) for (_, campo), v in zip(_LINEA, r[1:])}
+            detalles.setdefault(r[0], {"DocEntry": r[0], "DocumentLines": []})["DocumentLines"].append(linea)
+        conn.close()
+
+        return documentos, detalles, sincronizado.isoformat()
+    except Exception as e:
+        print(f"⚠️ No se pudo leer el espejo SAP de {tipo}: {e}")
+        return None
+
+
+def _valor(v):
+    # DECIMAL → float para que el JSON quede igual que la respuesta de SAP
+    return float(v) if hasattr(v, "as_tuple") else v
+
+
+# === HILO DE SINCRONIZACIÓN ===
+_hilo = None
+_despertar = threading.Event()
+
+
+def iniciar_sincronizacion():
+    """Arranca el hilo que sincroniza el espejo cada SAP_MIRROR_INTERVAL_S segundos."""
+    global _hilo
+    if not SAP_MIRROR_ENABLED or _hilo is not None:
+        return
+
+    def ciclo():
+        try:
+            asegurar_tablas()
+        except Exception as e:
+            print(f"❌ No se pudieron crear las tablas del espejo SAP: {e}")
+            return
+        while True:
+            for tipo in DOCUMENTOS_ESPEJO:
+                try:
+                    inicio = time.time()
+                    n = sincronizar(tipo)
+                    print(f"🔄 Espejo SAP {tipo}: {n} documentos en {time.time() - inicio:.2f}s")
+                except Exception as e:
+                    print(f"⚠️ Error sincronizando espejo SAP {tipo}: {e}")
+            # invalidar_espejo adelanta el siguiente ciclo
+            _despertar.wait(SAP_MIRROR_INTERVAL_S)
+            _despertar.clear()
+
+    _hilo = threading.Thread(target=ciclo, name="sap-mirror", daemon=True)
+    _hilo.start()
+
+
+sap_mirror_bp = Blueprint("sap_mirror_bp", __name__)
+
+
+@sap_mirror_bp.route("/sap/espejo/estado", methods=["GET"])
+def estado_espejo():
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT TIPO, ULTIMA_UPDATE_DATE, ULTIMA_SYNC, DOCUMENTOS FROM SAP_SYNC_ESTADO")
+        data = [
+            {
+                "tipo": r[0],
+                "ultima_update_date": r[1],
+                "ultima_sync": r[2].isoformat() if r[2] else None,
+                "documentos_ultimo_ciclo": r[3],
+            }
+            for r in cur.fetchall()
+        ]
+        conn.close()
+        return jsonify({"status": "ok", "habilitado": SAP_MIRROR_ENABLED, "data": data}), 200
+    except Exception as e:
+        print(f"❌ Error en /sap/espejo/estado: {e}")
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
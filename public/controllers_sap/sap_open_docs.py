@@ -1,22 +1,64 @@
-from flask import Blueprint, jsonify
-from controllers_sap.sap_service import SAPServiceLayer
+import os
+import datetime
+from flask import Blueprint, jsonify, request
+from controllers_sap.sap_service import sap_session, SAPError, SAPUnavailable
+from controllers_sap.sap_fanout import obtener_detalles
+from controllers_sap.sap_mirror import leer_espejo
+from controllers_sap.sap_lotes import en_tramos
 from bd import get_connection
 
 sap_open_docs_bp = Blueprint("sap_open_docs_bp", __name__)
 
+# Ítem de combustible que muestran los tableros de documentos abiertos
+ITEM_COMBUSTIBLE = os.getenv("SAP_ITEM_COMBUSTIBLE", "112080001")
+
+# Campos que piden los tableros de pedidos (cabecera y líneas)
+_CAMPOS_PEDIDO = "DocEntry,DocNum,CardCode,CardName,DocDate,DocDueDate,DocTotal,DocCurrency"
+_CAMPOS_LINEA = "LineNum,ItemCode,ItemDescription,WarehouseCode,Quantity"
+
+# Ordenamientos permitidos en /sap/pedidos_abiertos → campo del documento
+_ORDENES_PEDIDO = {
+    "DocEntry": "DocEntry",
+    "DocNum": "DocNum",
+    "DocDate": "DocDate",
+    "DocDueDate": "DocDueDate",
+    "CardName": "CardName",
+    "Total": "DocTotal",
+}
+
+
+def _documentos_abiertos(entidad, select):
+    """
+    Documentos abiertos de `entidad` con sus líneas: desde el espejo local si
+    está sincronizado, o en vivo desde SAP. Retorna (documentos, detalles, meta),
+    donde meta indica la fuente y la fecha de sincronización de los datos.
+    """
+    espejo = leer_espejo(entidad)
+    if espejo is not None:
+        documentos, detalles, sincronizado = espejo
+        return documentos, detalles, {"fuente": "espejo", "sincronizado": sincronizado}
+
+    with sap_session() as sap:
+        documentos = list(sap.iter_collection(
+            entidad,
+            select=select,
+            filter="DocumentStatus eq 'bost_Open'",
+            orderby="DocEntry desc",
+        ))
+        detalles = obtener_detalles(sap, entidad, [d.get("DocEntry") for d in documentos])
+    return documentos, detalles, {"fuente": "sap", "sincronizado": datetime.datetime.now().isoformat()}
+
+
 @sap_open_docs_bp.route("/sap/solicitudes_abiertas", methods=["GET"])
 def get_solicitudes_abiertas():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-        query = (
-            "PurchaseRequests?"
-            "$select=DocNum,DocEntry,DocDate,DocDueDate,DocumentStatus, Requester"
-            "&$filter=DocumentStatus eq 'bost_Open'"
-            "&$orderby=DocEntry desc"
-        )
-        ok, data = sap.get(query)
-        if not ok:
+        try:
+            documentos, detalles, meta = _documentos_abiertos(
+                "PurchaseRequests", "DocNum,DocEntry,DocDate,DocDueDate,DocumentStatus,Requester"
+            )
+        except SAPUnavailable:
+            return jsonify({"status": "error", "mensaje": "SAP no disponible."}), 503
+        except SAPError:
             return jsonify({"status": "error", "mensaje": "Error al obtener las solicitudes SAP."}), 500
 
         # Buscar proveedor desde BD local (por si SAP no lo trae)
@@ -31,11 +73,11 @@ def get_solicitudes_abiertas():
         conn.close()
 
         solicitudes = []
-        for d in data.get("value", []):
+        for d in documentos:
             doc_entry = d.get("DocEntry")
-            detalle_ok, detalle_data = sap.get(f"PurchaseRequests({doc_entry})")
+            detalle_data = detalles.get(doc_entry)
 
-            if not detalle_ok or "DocumentLines" not in detalle_data:
+            if not detalle_data or "DocumentLines" not in detalle_data:
                 continue
 
             lineas = detalle_data.get("DocumentLines", [])
@@ -54,7 +96,7 @@ def get_solicitudes_abiertas():
 
                 }
                 for l in lineas
-                if l.get("ItemCode") == "112080001"
+                if l.get("ItemCode") == ITEM_COMBUSTIBLE
             ]
             if not lineas_filtradas:
                 continue
@@ -84,75 +126,153 @@ def get_solicitudes_abiertas():
 
             })
 
-        return jsonify({"status": "ok", "data": solicitudes}), 200
+        return jsonify({"status": "ok", "data": solicitudes, **meta}), 200
 
     except Exception as e:
         print("❌ Error en get_solicitudes_abiertas:", e)
         return jsonify({"status": "error", "mensaje": str(e)}), 500
 
 
-@sap_open_docs_bp.route("/sap/pedidos_abiertos", methods=["GET"])
-def get_pedidos_abiertos():
-    try:
-        sap = SAPServiceLayer()
-        sap.login()
+def _pedidos_crossjoin(item_code, campo, descendente, pagina, por_pagina):
+    """
+    Pedidos abiertos con `item_code` en un $crossjoin: SAP filtra por ítem, ordena,
+    pagina ($top/$skip) y entrega cabecera y líneas juntas, sin un GET de detalle
+    por documento. La página es de líneas del ítem (un pedido suele tener una);
+    sin por_pagina se traen todas. Retorna (pedidos, total de líneas).
+    """
+    pedidos, conteo = {}, {}
+    direccion = "desc" if descendente else "asc"
+    with sap_session() as sap:
+        filas = sap.iter_collection(
+            "$crossjoin(PurchaseOrders,PurchaseOrders/DocumentLines)",
+            expand=f"PurchaseOrders($select={_CAMPOS_PEDIDO}),PurchaseOrders/DocumentLines($select={_CAMPOS_LINEA})",
+            filter=(
+                "PurchaseOrders/DocEntry eq PurchaseOrders/DocumentLines/DocEntry"
+                " and PurchaseOrders/DocumentStatus eq 'bost_Open'"
+                f" and PurchaseOrders/DocumentLines/ItemCode eq '{item_code.replace(chr(39), chr(39) * 2)}'"
+            ),
+            # DocEntry desempata para que las líneas de un pedido queden juntas y el orden sea estable entre páginas
+            orderby=f"PurchaseOrders/{campo} {direccion},PurchaseOrders/DocEntry {direccion}",
+            top=por_pagina or None,
+            skip=(pagina - 1) * por_pagina if por_pagina else None,
+            conteo=conteo,
+        )
+        for fila in filas:
+            cabecera, linea = fila.get("PurchaseOrders") or {}, fila.get("PurchaseOrders/DocumentLines") or {}
+            pedido = pedidos.setdefault(cabecera.get("DocEntry"), {**cabecera, "DocumentLines": []})
+            pedido["DocumentLines"].append(linea)
+    total = conteo.get("total")
+    return list(pedidos.values()), total if total is not None else len(pedidos)
+
+
+def _ordenar_y_paginar(documentos, campo, descendente, pagina, por_pagina):
+    """Orden y página en memoria (espejo local o fallback sin $crossjoin). Retorna (página, total)."""
+    con_valor = sorted((d for d in documentos if d.get(campo) is not None),
+                       key=lambda d: d[campo], reverse=descendente)
+    documentos = con_valor + [d for d in documentos if d.get(campo) is None]
+    total = len(documentos)
+    if por_pagina:
+        documentos = documentos[(pagina - 1) * por_pagina:pagina * por_pagina]
+    return documentos, total
+
+
+def _pedidos_con_item(item_code, campo="DocEntry", descendente=True, pagina=1, por_pagina=0):
+    """
+    Página de pedidos abiertos que tienen `item_code`, cada uno con solo esas
+    líneas: desde el espejo local, o desde SAP filtrando, ordenando y paginando
+    en el servidor. Retorna (pedidos, total, meta).
+    """
+    espejo = leer_espejo("PurchaseOrders", item_code=item_code)
+    if espejo is not None:
+        documentos, detalles, sincronizado = espejo
+        pedidos = [
+            {**d, "DocumentLines": detalles[d["DocEntry"]]["DocumentLines"]}
+            for d in documentos if d.get("DocEntry") in detalles
+        ]
+        return (*_ordenar_y_paginar(pedidos, campo, descendente, pagina, por_pagina),
+                {"fuente": "espejo", "sincronizado": sincronizado})
 
-        # === cargar relación desde la BD local ===
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT NUMERO_PEDIDO, NUMERO_SOLICITUD_SAP, FECHA_EMISION
-            FROM FACTURAS
-            WHERE NUMERO_PEDIDO IS NOT NULL AND NUMERO_SOLICITUD_SAP IS NOT NULL
-        """)
-        relacion_pedido_solicitud = {
-            str(r[0]).strip(): {
-                "solicitud": str(r[1]).strip(),
-                "fecha_emision": str(r[2]) if r[2] else None
-            }
-            for r in cur.fetchall()
-        }
+    try:
+        pedidos, total = _pedidos_crossjoin(item_code, campo, descendente, pagina, por_pagina)
+        return pedidos, total, {"fuente": "sap", "sincronizado": datetime.datetime.now().isoformat()}
+    except SAPUnavailable:
+        # Con SAP caído el fallback solo duplicaría las llamadas fallidas
+        raise
+    except SAPError as e:
+        # Service Layer sin $crossjoin: lista de pedidos + detalle y filtro local
+        print(f"⚠️ $crossjoin no disponible, se filtra el ítem localmente: {e}")
+
+    documentos, detalles, meta = _documentos_abiertos("PurchaseOrders", _CAMPOS_PEDIDO + ",DocumentStatus")
+    pedidos = []
+    for d in documentos:
+        lineas = [l for l in (detalles.get(d.get("DocEntry")) or {}).get("DocumentLines", [])
+                  if l.get("ItemCode") == item_code]
+        if lineas:
+            pedidos.append({**d, "DocumentLines": lineas})
+    return (*_ordenar_y_paginar(pedidos, campo, descendente, pagina, por_pagina), meta)
+
+
+def _relacion_pedidos(doc_nums):
+    """{NUMERO_PEDIDO: {"solicitud", "fecha_emision"}} desde FACTURAS, solo para los pedidos indicados."""
+    relacion = {}
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        for tramo in en_tramos([str(n) for n in doc_nums]):
+            cur.execute(f"""
+                SELECT NUMERO_PEDIDO, NUMERO_SOLICITUD_SAP, FECHA_EMISION
+                FROM FACTURAS
+                WHERE NUMERO_PEDIDO IN ({", ".join("?" * len(tramo))}) AND NUMERO_SOLICITUD_SAP IS NOT NULL
+            """, tramo)
+            for r in cur.fetchall():
+                relacion[str(r[0]).strip()] = {
+                    "solicitud": str(r[1]).strip(),
+                    "fecha_emision": str(r[2]) if r[2] else None
+                }
+    finally:
         conn.close()
+    return relacion
 
-        # === obtener pedidos abiertos desde SAP ===
-        query = (
-            "PurchaseOrders?"
-            "$select=DocNum,DocEntry,CardCode,CardName,DocDate,DocDueDate,DocTotal,DocCurrency,DocumentStatus"
-            "&$filter=DocumentStatus eq 'bost_Open'"
-            "&$orderby=DocEntry desc"
-        )
-        ok, data = sap.get(query)
-        if not ok:
-            return jsonify({"status": "error", "mensaje": "Error al obtener pedidos SAP."}), 500
 
-        pedidos = []
-        for d in data.get("value", []):
-            doc_entry = d.get("DocEntry")
-            doc_num = str(d.get("DocNum"))
+@sap_open_docs_bp.route("/sap/pedidos_abiertos", methods=["GET"])
+def get_pedidos_abiertos():
+    """
+    Pedidos abiertos con líneas del ítem de combustible, enlazados a su solicitud
+    y fecha de emisión desde FACTURAS.
 
-            # === Obtener líneas del pedido ===
-            detalle_ok, detalle_data = sap.get(f"PurchaseOrders({doc_entry})")
-            if not detalle_ok or "DocumentLines" not in detalle_data:
-                continue
+    Query: ?item=112080001&orden=DocDate&dir=desc&pagina=1&por_pagina=50
+    (sin por_pagina se entregan todos).
+    """
+    try:
+        item_code = request.args.get("item", ITEM_COMBUSTIBLE)
+        orden = request.args.get("orden", "DocEntry")
+        descendente = request.args.get("dir", "desc").lower() != "asc"
+        try:
+            pagina = max(1, int(request.args.get("pagina", 1)))
+            por_pagina = max(0, int(request.args.get("por_pagina", 0)))
+        except ValueError:
+            return jsonify({"status": "error", "mensaje": "pagina y por_pagina deben ser números"}), 400
+        if orden not in _ORDENES_PEDIDO:
+            return jsonify({
+                "status": "error",
+                "mensaje": f"orden inválido; use uno de: {', '.join(_ORDENES_PEDIDO)}"
+            }), 400
+
+        # === página de pedidos abiertos con el ítem, ya ordenada (espejo local o SAP) ===
+        try:
+            documentos, total, meta = _pedidos_con_item(item_code, _ORDENES_PEDIDO[orden], descendente,
+                                                        pagina, por_pagina)
+        except SAPUnavailable:
+            return jsonify({"status": "error", "mensaje": "SAP no disponible."}), 503
+        except SAPError:
+            return jsonify({"status": "error", "mensaje": "Error al obtener pedidos SAP."}), 500
 
-            lineas = detalle_data.get("DocumentLines", [])
-            lineas_filtradas = [
-                {
-                    "ItemCode": l.get("ItemCode"),
-                    "ItemDescription": l.get("ItemDescription"),
-                    "WarehouseCode": l.get("WarehouseCode"),
-                    "Quantity": l.get("Quantity"),
-                }
-                for l in lineas
-                if l.get("ItemCode") == "112080001"
-            ]
-            if not lineas_filtradas:
-                continue
+        # === número de solicitud y fecha de emisión desde la BD, solo de esta página ===
+        relacion_pedido_solicitud = _relacion_pedidos([d.get("DocNum") for d in documentos])
 
-            # === obtener número de solicitud y fecha de emisión desde la BD ===
-            info_rel = relacion_pedido_solicitud.get(doc_num, None)
-            num_solicitud = info_rel["solicitud"] if info_rel else None
-            fecha_emision = info_rel["fecha_emision"] if info_rel else None
+        pedidos = []
+        for d in documentos:
+            info_rel = relacion_pedido_solicitud.get(str(d.get("DocNum")), None)
 
             pedidos.append({
                 "tipo": "Pedido",
@@ -165,24 +285,36 @@ def get_pedidos_abiertos():
                 "Moneda": d.get("DocCurrency"),
                 "Total": d.get("DocTotal"),
                 "Estado": "Abierto",
-                "NUMERO_SOLICITUD_SAP": num_solicitud,
-                "FECHA_EMISION": fecha_emision,
-                "Lineas": lineas_filtradas,
+                "NUMERO_SOLICITUD_SAP": info_rel["solicitud"] if info_rel else None,
+                "FECHA_EMISION": info_rel["fecha_emision"] if info_rel else None,
+                "Lineas": [
+                    {
+                        "ItemCode": l.get("ItemCode"),
+                        "ItemDescription": l.get("ItemDescription"),
+                        "WarehouseCode": l.get("WarehouseCode"),
+                        "Quantity": l.get("Quantity"),
+                    }
+                    for l in d.get("DocumentLines", [])
+                ],
             })
 
-        return jsonify({"status": "ok", "data": pedidos}), 200
+        return jsonify({
+            "status": "ok",
+            "data": pedidos,
+            "total": total,
+            "pagina": pagina if por_pagina else 1,
+            "por_pagina": por_pagina or total,
+            **meta
+        }), 200
 
     except Exception as e:
         print("❌ Error en get_pedidos_abiertos:", e)
         return jsonify({"status": "error", "mensaje": str(e)}), 500
-    
+
 
 @sap_open_docs_bp.route("/sap/entradas_abiertas", methods=["GET"])
 def get_entradas_abiertas():
     try:
-        sap = SAPServiceLayer()
-        sap.login()
-
         # === Cargar relación desde BD local ===
         conn = get_connection()
         cur = conn.cursor()
@@ -209,24 +341,23 @@ def get_entradas_abiertas():
         }
         conn.close()
 
-        # === Obtener entradas abiertas desde SAP ===
-        query = (
-            "PurchaseDeliveryNotes?"
-            "$select=DocNum,DocEntry,CardCode,CardName,DocDate,DocDueDate,DocTotal,"
-            "DocCurrency,DocumentStatus,Comments"
-            "&$filter=DocumentStatus eq 'bost_Open'"
-            "&$orderby=DocEntry desc"
-        )
-
-        ok, data = sap.get(query)
-        if not ok or "value" not in data:
+        # === Obtener entradas abiertas (espejo local o SAP) ===
+        try:
+            documentos, detalles, meta = _documentos_abiertos(
+                "PurchaseDeliveryNotes",
+                "DocNum,DocEntry,CardCode,CardName,DocDate,DocDueDate,DocTotal,"
+                "DocCurrency,DocumentStatus,Comments",
+            )
+        except SAPUnavailable:
+            return jsonify({"status": "error", "mensaje": "SAP no disponible."}), 503
+        except SAPError:
             return jsonify({
                 "status": "error",
                 "mensaje": "Error al obtener entradas desde SAP."
             }), 500
 
         entradas = []
-        for d in data["value"]:
+        for d in documentos:
             doc_num = str(d.get("DocNum")).strip()
             doc_entry = d.get("DocEntry")
 
@@ -238,8 +369,8 @@ def get_entradas_abiertas():
             fecha_emision = info_rel["fecha_emision"] if info_rel else None  
 
             # === Obtener líneas del documento SAP ===
-            detalle_ok, detalle_data = sap.get(f"PurchaseDeliveryNotes({doc_entry})")
-            if not detalle_ok or "DocumentLines" not in detalle_data:
+            detalle_data = detalles.get(doc_entry)
+            if not detalle_data or "DocumentLines" not in detalle_data:
                 continue
 
             lineas = detalle_data.get("DocumentLines", [])
@@ -251,7 +382,7 @@ def get_entradas_abiertas():
                     "Quantity": l.get("Quantity"),
                 }
                 for l in lineas
-                if l.get("ItemCode") == "112080001"
+                if l.get("ItemCode") == ITEM_COMBUSTIBLE
             ]
             if not lineas_filtradas:
                 continue
@@ -274,8 +405,7 @@ def get_entradas_abiertas():
                 "Lineas": lineas_filtradas
             })
 
-        sap.logout()
-        return jsonify({"status": "ok", "data": entradas}), 200
+        return jsonify({"status": "ok", "data": entradas, **meta}), 200
 
     except Exception as e:
         print("❌ Error en get_entradas_abiertas:", e)
@@ -0,0 +1,539 @@
+import os
+import json
+import uuid
+import socket
+import datetime
+import threading
+import requests
+from flask import Blueprint, request, jsonify
+
+from controllers_sap.sap_service import SAPUnavailable
+from bd import get_connection
+
+# Hilos que ejecutan trabajos pendientes del outbox
+SAP_OUTBOX_WORKERS = int(os.getenv("SAP_OUTBOX_WORKERS", "2"))
+# Segundos entre consultas a la tabla cuando no hay trabajo
+SAP_OUTBOX_POLL_S = float(os.getenv("SAP_OUTBOX_POLL_S", "2"))
+# Intentos máximos ante fallas transitorias y base del backoff (segundos)
+SAP_OUTBOX_MAX_INTENTOS = int(os.getenv("SAP_OUTBOX_MAX_INTENTOS", "8"))
+SAP_OUTBOX_BACKOFF_S = float(os.getenv("SAP_OUTBOX_BACKOFF_S", "5"))
+# Un trabajo 'en_proceso' sin renovar su lease pasado este tiempo se considera abandonado (caída del proceso);
+# mientras corre, el worker lo renueva en cada checkpoint y cada SAP_OUTBOX_LEASE_S / 3
+SAP_OUTBOX_LEASE_S = int(os.getenv("SAP_OUTBOX_LEASE_S", "300"))
+# "1" (por defecto) responde de inmediato con el job id; "0" ejecuta en el request y solo encola si SAP falla
+SAP_OUTBOX_ASYNC = os.getenv("SAP_OUTBOX_ASYNC", "1") == "1"
+# Máximo de trabajos que entrega /sap/jobs
+SAP_OUTBOX_LISTAR_MAX = 500
+
+_DDL = [
+    """
+    IF OBJECT_ID('SAP_OUTBOX', 'U') IS NULL
+    CREATE TABLE SAP_OUTBOX (
+        SEQ BIGINT IDENTITY(1,1) PRIMARY KEY,
+        ID_JOB VARCHAR(36) NOT NULL UNIQUE,
+        TIPO VARCHAR(60) NOT NULL,
+        CADENA VARCHAR(120) NOT NULL,
+        PAYLOAD NVARCHAR(MAX) NOT NULL,
+        CONTEXTO NVARCHAR(MAX) NULL,
+        ESTADO VARCHAR(20) NOT NULL,
+        PASO NVARCHAR(200) NULL,
+        INTENTOS INT NOT NULL,
+        PROXIMO_INTENTO DATETIME NOT NULL,
+        RESULTADO NVARCHAR(MAX) NULL,
+        ERROR NVARCHAR(MAX) NULL,
+        TOMADO_POR VARCHAR(120) NULL,
+        TOMADO_EN DATETIME NULL,
+        CREADO DATETIME NOT NULL,
+        ACTUALIZADO DATETIME NOT NULL
+    )
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_SAP_OUTBOX_ESTADO')
+    CREATE INDEX IX_SAP_OUTBOX_ESTADO ON SAP_OUTBOX (ESTADO, CADENA, SEQ)
+    """,
+    """
+    IF OBJECT_ID('SAP_OUTBOX_CADENAS', 'U') IS NULL
+    CREATE TABLE SAP_OUTBOX_CADENAS (
+        ID_JOB VARCHAR(36) NOT NULL,
+        CADENA VARCHAR(120) NOT NULL,
+        PRIMARY KEY (ID_JOB, CADENA)
+    )
+    """,
+    """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_SAP_OUTBOX_CADENAS')
+    CREATE INDEX IX_SAP_OUTBOX_CADENAS ON SAP_OUTBOX_CADENAS (CADENA, ID_JOB)
+    """,
+]
+
+PENDIENTE, EN_PROCESO, OK, ERROR = "pendiente", "en_proceso", "ok", "error"
+
+_TAREAS = {}
+_eventos = {}
+_eventos_lock = threading.Lock()
+_despertar = threading.Event()
+_hilos = []
+_tablas_listas = False
+
+
+class Transitorio(Exception):
+    """Falla que se puede reintentar (SAP o la red no disponibles)."""
+
+
+class TrabajoAjeno(Exception):
+    """El lease venció y el trabajo fue recuperado: este worker ya no es su dueño y debe abandonarlo."""
+
+
+def tarea_outbox(tipo):
+    """Registra la función que ejecuta los trabajos `tipo`: fn(job) → (http_status, cuerpo)."""
+    def registrar(fn):
+        _TAREAS[tipo] = fn
+        return fn
+    return registrar
+
+
+def es_transitorio(respuesta):
+    """
+    True si el (False, data) de SAPServiceLayer corresponde a una falla de red o
+    de disponibilidad y no a un rechazo de negocio de SAP ({"error": {"code", "message"}}).
+    """
+    if isinstance(respuesta, dict):
+        error = respuesta.get("error")
+        return isinstance(error, str)
+    return isinstance(respuesta, str) and ("SAP no" in respuesta or "timeout" in respuesta.lower())
+
+
+def obtener_de_sap(sap, endpoint):
+    """sap.get que distingue 'no existe' (ok=False) de 'SAP no disponible' (lanza Transitorio)."""
+    ok, data = sap.get(endpoint)
+    if not ok and es_transitorio(data):
+        raise Transitorio(f"SAP no disponible al leer {endpoint}: {data}")
+    return ok, data
+
+
+class Job:
+    """Trabajo en ejecución; `contexto` se persiste en cada checkpoint para retomar tras una falla."""
+
+    def __init__(self, id_job, tipo, payload, contexto, intentos, tomado_por=None):
+        self.id = id_job
+        self.tipo = tipo
+        self.payload = payload
+        self.contexto = contexto
+        self.intentos = intentos
+        self.tomado_por = tomado_por
+
+    @property
+    def etiqueta(self):
+        """Marca que se agrega a Comments para reconocer el documento en SAP."""
+        return f"[OBX {self.id[:8]}]"
+
+    def comentario(self, texto):
+        return f"{texto} {self.etiqueta}"
+
+    def checkpoint(self, paso, **datos):
+        """Persiste el avance y renueva el lease; lanza TrabajoAjeno si otro worker recuperó el trabajo."""
+        self.contexto.update(datos)
+        if not _actualizar(self.id, self.tomado_por, PASO=paso, TOMADO_EN=datetime.datetime.now(),
+                           CONTEXTO=json.dumps(self.contexto, ensure_ascii=False, default=str)):
+            raise TrabajoAjeno(f"Job {self.id[:8]} fue recuperado por otro worker")
+        print(f"📌 Job {self.id[:8]} ({self.tipo}): {paso}")
+
+    def crear_en_sap(self, sap, entidad, payload):
+        """
+        POST idempotente de un documento: si un intento anterior ya lo creó
+        (el checkpoint lo registra, o la respuesta se perdió pero el documento
+        tiene la etiqueta en Comments) no se vuelve a crear.
+        Retorna (ok, documento); lanza Transitorio si SAP no está disponible.
+        """
+        clave = f"sap_{entidad}"
+        if clave in self.contexto:
+            return True, self.contexto[clave]
+
+        if self.contexto.get("enviando") == entidad:
+            ok, data = sap.get(f"{entidad}?$select=DocEntry,DocNum&$filter=contains(Comments,'{self.etiqueta}')")
+            if not ok:
+                raise Transitorio(f"No se pudo verificar si {entidad} ya existe en SAP: {data}")
+            if data.get("value"):
+                doc = data["value"][0]
+                print(f"♻️ Job {self.id[:8]}: {entidad} ya existía en SAP (DocEntry={doc.get('DocEntry')})")
+                self.checkpoint(f"{entidad} creado en SAP", enviando=None, **{clave: doc})
+                return True, doc
+        else:
+            self.checkpoint(f"Enviando {entidad} a SAP", enviando=entidad)
+
+        ok, doc = sap.post(entidad, payload)
+        if not ok:
+            if es_transitorio(doc):
+                raise Transitorio(f"SAP no disponible al crear {entidad}: {doc}")
+            return False, doc
+
+        self.checkpoint(f"{entidad} creado en SAP", enviando=None,
+                        **{clave: {"DocEntry": doc.get("DocEntry"), "DocNum": doc.get("DocNum")}})
+        return True, doc
+
+    def hecho(self, paso):
+        """True si el paso ya se completó en un intento anterior (ver marcar)."""
+        return paso in self.contexto.get("pasos", [])
+
+    def marcar(self, paso):
+        self.checkpoint(paso, pasos=[*self.contexto.get("pasos", []), paso])
+
+
+# === TABLA ===
+def asegurar_tablas():
+    global _tablas_listas
+    if _tablas_listas:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    for ddl in _DDL:
+        cur.execute(ddl)
+    conn.commit()
+    conn.close()
+    _tablas_listas = True
+
+
+def _actualizar(id_job, tomado_por=None, **campos):
+    """
+    Actualiza un trabajo. Con `tomado_por` solo lo hace si sigue 'en_proceso' a nombre
+    de ese worker (un lease vencido no pisa al nuevo dueño). Retorna True si actualizó.
+    """
+    campos["ACTUALIZADO"] = datetime.datetime.now()
+    asignaciones = ", ".join(f"{c} = ?" for c in campos)
+    filtro, params = "", []
+    if tomado_por is not None:
+        filtro, params = "AND ESTADO = ? AND TOMADO_POR = ?", [EN_PROCESO, tomado_por]
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(f"UPDATE SAP_OUTBOX SET {asignaciones} WHERE ID_JOB = ? {filtro}",
+                (*campos.values(), id_job, *params))
+    actualizado = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return actualizado
+
+
+# === ENCOLAR / TOMAR ===
+def encolar(tipo, payload, cadena=None):
+    """
+    Registra un trabajo en SAP_OUTBOX y retorna su id.
+    Los trabajos con la misma `cadena` (p. ej. 'PurchaseOrders:15') se ejecutan
+    en orden de llegada, uno a la vez. `cadena` puede ser una lista: un trabajo
+    de lote espera a los anteriores de cada uno de sus documentos, y los
+    posteriores de cualquiera de ellos lo esperan a él.
+    """
+    if tipo not in _TAREAS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    asegurar_tablas()
+    id_job = str(uuid.uuid4())
+    cadenas = [cadena] if isinstance(cadena, str) else list(dict.fromkeys(cadena or []))
+    # La columna CADENA guarda la cadena única; la de un lote es propia y sus documentos van en SAP_OUTBOX_CADENAS
+    principal = cadenas[0] if len(cadenas) == 1 else f"lote:{id_job}"
+    ahora = datetime.datetime.now()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO SAP_OUTBOX (ID_JOB, TIPO, CADENA, PAYLOAD, CONTEXTO, ESTADO, INTENTOS,
+                                PROXIMO_INTENTO, CREADO, ACTUALIZADO)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?)
+    """, (id_job, tipo, principal, json.dumps(payload, ensure_ascii=False, default=str), "{}",
+          PENDIENTE, ahora, ahora, ahora))
+    if cadenas:
+        cur.executemany("INSERT INTO SAP_OUTBOX_CADENAS (ID_JOB, CADENA) VALUES (?, ?)",
+                        [(id_job, c) for c in cadenas])
+    conn.commit()
+    conn.close()
+    print(f"📮 Job {id_job[:8]} encolado ({tipo}, cadena {principal if cadenas else '-'}"
+          f"{f', {len(cadenas)} documentos' if len(cadenas) > 1 else ''})")
+    return id_job
+
+
+def _tomar(id_job=None):
+    """
+    Marca como 'en_proceso' el siguiente trabajo ejecutable (o `id_job` si se indica)
+    y lo retorna como Job. Solo se toma el primero pendiente de cada cadena; un
+    trabajo con varias cadenas espera a los anteriores de todas ellas.
+    El UPDATE condicionado a ESTADO evita que dos workers tomen el mismo trabajo.
+    """
+    ahora = datetime.datetime.now()
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # Recuperar trabajos abandonados por un proceso que se cayó (su lease dejó de renovarse)
+    cur.execute("""
+        UPDATE SAP_OUTBOX SET ESTADO = ?, TOMADO_POR = NULL, ACTUALIZADO = ?
+        WHERE ESTADO = ? AND TOMADO_EN < ?
+    """, (PENDIENTE, ahora, EN_PROCESO, ahora - datetime.timedelta(seconds=SAP_OUTBOX_LEASE_S)))
+
+    filtro, params = "", []
+    if id_job:
+        filtro, params = "AND o.ID_JOB = ?", [id_job]
+    cur.execute(f"""
+        SELECT TOP 1 o.ID_JOB, o.TIPO, o.PAYLOAD, o.CONTEXTO, o.INTENTOS
+        FROM SAP_OUTBOX o WITH (READPAST)
+        WHERE o.ESTADO = ? AND o.PROXIMO_INTENTO <= ? {filtro}
+          AND NOT EXISTS (
+              SELECT 1 FROM SAP_OUTBOX p
+              WHERE p.SEQ < o.SEQ AND p.ESTADO IN (?, ?)
+                AND (p.CADENA = o.CADENA OR EXISTS (
+                    SELECT 1 FROM SAP_OUTBOX_CADENAS pc
+                    JOIN SAP_OUTBOX_CADENAS oc ON oc.CADENA = pc.CADENA
+                    WHERE pc.ID_JOB = p.ID_JOB AND oc.ID_JOB = o.ID_JOB
+                ))
+          )
+        ORDER BY o.SEQ
+    """, (PENDIENTE, ahora, *params, PENDIENTE, EN_PROCESO))
+    row = cur.fetchone()
+    if not row:
+        conn.commit()
+        conn.close()
+        return None
+
+    # Único por toma: si el mismo hilo vuelve a tomar el trabajo, un intento anterior no lo reconoce como propio
+    trabajador = f"{_trabajador()}:{uuid.uuid4().hex[:8]}"
+    cur.execute("""
+        UPDATE SAP_OUTBOX
+        SET ESTADO = ?, INTENTOS = INTENTOS + 1, TOMADO_POR = ?, TOMADO_EN = ?, ACTUALIZADO = ?
+        WHERE ID_JOB = ? AND ESTADO = ?
+    """, (EN_PROCESO, trabajador, ahora, ahora, row[0], PENDIENTE))
+    tomado = cur.rowcount == 1
+    conn.commit()
+    conn.close()
+    if not tomado:
+        return None
+    return Job(row[0], row[1], json.loads(row[2]), json.loads(row[3] or "{}"), row[4] + 1, trabajador)
+
+
+def _trabajador():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+# === EJECUCIÓN ===
+def _ejecutar(job):
+    """Corre la tarea y deja el trabajo en ok / error, o pendiente con backoff si la falla es transitoria."""
+    detener = threading.Event()
+    threading.Thread(target=_latido, args=(job, detener), name=f"sap-outbox-latido-{job.id[:8]}",
+                     daemon=True).start()
+    try:
+        _correr(job)
+    finally:
+        detener.set()
+
+
+def _latido(job, detener):
+    """Renueva TOMADO_EN mientras la tarea corre, aunque un paso (p. ej. un $batch largo) no haga checkpoints."""
+    while not detener.wait(SAP_OUTBOX_LEASE_S / 3):
+        try:
+            if not _actualizar(job.id, job.tomado_por, TOMADO_EN=datetime.datetime.now()):
+                return
+        except Exception as e:
+            print(f"⚠️ No se pudo renovar el lease del job {job.id[:8]}: {e}")
+
+
+def _correr(job):
+    try:
+        http, cuerpo = _TAREAS[job.tipo](job)
+    except TrabajoAjeno as e:
+        print(f"⚠️ {e}; se abandona este intento")
+        return
+    except (Transitorio, SAPUnavailable, requests.RequestException) as e:
+        if job.intentos >= SAP_OUTBOX_MAX_INTENTOS:
+            print(f"❌ Job {job.id[:8]} agotó {job.intentos} intentos: {e}")
+            _finalizar(job, ERROR, 503, {"status": "error", "mensaje": str(e)}, error=str(e))
+        else:
+            espera = min(SAP_OUTBOX_BACKOFF_S * 2 ** (job.intentos - 1), 600)
+            print(f"🔁 Job {job.id[:8]} reintentará en {espera:.0f}s: {e}")
+            if _actualizar(job.id, job.tomado_por, ESTADO=PENDIENTE, ERROR=str(e),
+                           PROXIMO_INTENTO=datetime.datetime.now() + datetime.timedelta(seconds=espera)):
+                _notificar(job.id)
+        return
+    except Exception as e:
+        print(f"❌ Job {job.id[:8]} ({job.tipo}) falló: {e}")
+        _finalizar(job, ERROR, 500, {"status": "error", "mensaje": str(e)}, error=str(e))
+        return
+
+    _finalizar(job, OK if http < 400 else ERROR, http, cuerpo)
+
+
+def _finalizar(job, estado, http, cuerpo, error=None):
+    if not _actualizar(job.id, job.tomado_por, ESTADO=estado, ERROR=error,
+                       RESULTADO=json.dumps({"http": http, "cuerpo": cuerpo}, ensure_ascii=False, default=str)):
+        print(f"⚠️ Job {job.id[:8]} fue recuperado por otro worker; no se registra el resultado de este intento")
+        return
+    print(f"{'✅' if estado == OK else '❌'} Job {job.id[:8]} ({job.tipo}) → {estado}")
+    _notificar(job.id)
+
+
+def _notificar(id_job):
+    with _eventos_lock:
+        evento = _eventos.get(id_job)
+    if evento:
+        evento.set()
+    _despertar.set()
+
+
+def consultar(id_job):
+    """Estado de un trabajo como dict, o None si no existe."""
+    asegurar_tablas()
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ID_JOB, TIPO, CADENA, ESTADO, PASO, INTENTOS, PROXIMO_INTENTO, RESULTADO, ERROR, CREADO, ACTUALIZADO
+        FROM SAP_OUTBOX WHERE ID_JOB = ?
+    """, (id_job,))
+    row = cur.fetchone()
+    conn.close()
+    return _como_dict(row) if row else None
+
+
+def _como_dict(row):
+    resultado = json.loads(row[7]) if row[7] else None
+    return {
+        "job_id": row[0],
+        "tipo": row[1],
+        "cadena": row[2],
+        "estado": row[3],
+        "paso": row[4],
+        "intentos": row[5],
+        "proximo_intento": _iso(row[6]) if row[3] == PENDIENTE else None,
+        "resultado": resultado["cuerpo"] if resultado else None,
+        "http": resultado["http"] if resultado else None,
+        "error": row[8],
+        "creado": _iso(row[9]),
+        "actualizado": _iso(row[10]),
+    }
+
+
+def _iso(valor):
+    return valor.isoformat() if hasattr(valor, "isoformat") else valor
+
+
+def responder(id_job, asincrono=None):
+    """
+    Respuesta HTTP para un trabajo recién encolado: por defecto 202 con el job id
+    (lo ejecuta un worker). En modo síncrono (?async=0 o SAP_OUTBOX_ASYNC=0) lo
+    ejecuta en el mismo request y entrega el resultado como siempre; si SAP no está
+    disponible o hay trabajos previos en su cadena, responde igualmente 202.
+    """
+    if asincrono is None:
+        asincrono = _pide_asincrono()
+
+    if not asincrono:
+        job = _tomar(id_job)
+        if job is not None:
+            _ejecutar(job)
+        else:
+            _esperar(id_job, SAP_OUTBOX_POLL_S * 5)
+        estado = consultar(id_job)
+        if estado and estado["estado"] in (OK, ERROR):
+            return jsonify(estado["resultado"]), estado["http"]
+
+    _despertar.set()
+    return jsonify({
+        "status": "ok",
+        "estado": PENDIENTE,
+        "job_id": id_job,
+        "mensaje": "Operación en cola; consulte /sap/jobs/<job_id> para ver su avance.",
+    }), 202
+
+
+def _pide_asincrono():
+    valor = request.args.get("async")
+    if valor is None:
+        valor = (request.get_json(silent=True) or {}).get("async")
+    if valor is None:
+        return SAP_OUTBOX_ASYNC
+    return str(valor).lower() in ("1", "true", "si", "yes")
+
+
+def _esperar(id_job, timeout):
+    with _eventos_lock:
+        evento = _eventos.setdefault(id_job, threading.Event())
+    try:
+        evento.wait(timeout)
+    finally:
+        with _eventos_lock:
+            _eventos.pop(id_job, None)
+
+
+# === WORKERS ===
+def iniciar_outbox():
+    """Arranca los hilos que procesan SAP_OUTBOX (trabajos asíncronos y reintentos)."""
+    if _hilos:
+        return
+    try:
+        asegurar_tablas()
+    except Exception as e:
+        print(f"❌ No se pudo crear la tabla SAP_OUTBOX: {e}")
+        return
+
+    def ciclo():
+        while True:
+            try:
+                job = _tomar()
+            except Exception as e:
+                print(f"⚠️ Error leyendo SAP_OUTBOX: {e}")
+                job = None
+            if job is None:
+                _despertar.wait(SAP_OUTBOX_POLL_S)
+                _despertar.clear()
+                continue
+            _ejecutar(job)
+
+    for i in range(SAP_OUTBOX_WORKERS):
+        hilo = threading.Thread(target=ciclo, name=f"sap-outbox-{i}", daemon=True)
+        hilo.start()
+        _hilos.append(hilo)
+    print(f"📮 Outbox SAP iniciado ({SAP_OUTBOX_WORKERS} workers)")
+
+
+sap_outbox_bp = Blueprint("sap_outbox_bp", __name__)
+
+
+@sap_outbox_bp.route("/sap/jobs/<id_job>", methods=["GET"])
+def estado_job(id_job):
+    try:
+        job = consultar(id_job)
+    except Exception as e:
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+    if not job:
+        return jsonify({"status": "error", "mensaje": f"No existe el trabajo {id_job}."}), 404
+    return jsonify({"status": "ok", "data": job}), 200
+
+
+@sap_outbox_bp.route("/sap/jobs", methods=["GET"])
+def listar_jobs():
+    estado = request.args.get("estado")
+    try:
+        limite = max(1, min(int(request.args.get("limit", 50)), SAP_OUTBOX_LISTAR_MAX))
+    except ValueError:
+        return jsonify({"status": "error", "mensaje": "El parámetro limit debe ser un entero."}), 400
+    try:
+        asegurar_tablas()
+        conn = get_connection()
+        cur = conn.cursor()
+        filtro = "WHERE ESTADO = ?" if estado else ""
+        cur.execute(f"""
+            SELECT TOP {limite} ID_JOB, TIPO, CADENA, ESTADO, PASO, INTENTOS, PROXIMO_INTENTO,
+                   RESULTADO, ERROR, CREADO, ACTUALIZADO
+            FROM SAP_OUTBOX {filtro}
+            ORDER BY SEQ DESC
+        """, (estado,) if estado else ())
+        data = [_como_dict(r) for r in cur.fetchall()]
+        conn.close()
+    except Exception as e:
+        return jsonify({"status": "error", "mensaje": str(e)}), 500
+    return jsonify({"status": "ok", "data": data}), 200
+
+
+@sap_outbox_bp.route("/sap/jobs/<id_job>/reintentar", methods=["POST"])
+def reintentar_job(id_job):
+    job = consultar(id_job)
+    if not job:
+        return jsonify({"status": "error", "mensaje": f"No existe el trabajo {id_job}."}), 404
+    if job["estado"] != ERROR:
+        return jsonify({"status": "error", "mensaje": f"El trabajo está '{job['estado']}', no se puede reintentar."}), 409
+
+    _actualizar(id_job, ESTADO=PENDIENTE, ERROR=None, RESULTADO=None, INTENTOS=0,
+                PROXIMO_INTENTO=datetime.datetime.now())
+    _despertar.set()
+    return jsonify({"status": "ok", "mensaje": f"Trabajo {id_job} reencolado."}), 200
@@ -1,18 +1,138 @@
 import os
+import time
+import atexit
+import threading
 import requests
 import json
+import uuid
+import random
 import urllib3
+from contextlib import contextmanager
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
 
 from flask import Blueprint, jsonify
 from bd import get_connection
+from controllers_sap.sap_metrics import sap_metrics
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 load_dotenv()
 
+# Duración de la sesión B1SESSION (SessionTimeout del Service Layer, en minutos)
+SAP_SESSION_TIMEOUT_MIN = float(os.getenv("SAP_SESSION_TIMEOUT_MIN", "30"))
+# Margen con el que se renueva la sesión antes de que SAP la expire
+SAP_SESSION_REFRESH_MARGIN_S = float(os.getenv("SAP_SESSION_REFRESH_MARGIN_S", "120"))
+# Máximo de sesiones SAP abiertas a la vez (prestadas + inactivas en el pool): cada una ocupa una licencia.
+# Debe superar SAP_FANOUT_WORKERS, que toman una sesión cada uno además de la del request
+SAP_POOL_SIZE = int(os.getenv("SAP_POOL_SIZE", "8"))
+# Segundos que se espera una sesión libre cuando están todas prestadas (luego SAPUnavailable)
+SAP_POOL_TIMEOUT_S = float(os.getenv("SAP_POOL_TIMEOUT_S", "30"))
+# Filas por página solicitadas al Service Layer (Prefer: odata.maxpagesize)
+SAP_PAGE_SIZE = int(os.getenv("SAP_PAGE_SIZE", "200"))
+# Máximo de operaciones por request $batch
+SAP_BATCH_SIZE = int(os.getenv("SAP_BATCH_SIZE", "50"))
+# Timeouts de conexión y de lectura hacia el Service Layer (segundos)
+SAP_CONNECT_TIMEOUT_S = float(os.getenv("SAP_CONNECT_TIMEOUT_S", "5"))
+SAP_READ_TIMEOUT_S = float(os.getenv("SAP_READ_TIMEOUT_S", "60"))
+# Reintentos para verbos idempotentes y base del backoff exponencial (segundos)
+SAP_MAX_RETRIES = int(os.getenv("SAP_MAX_RETRIES", "2"))
+SAP_BACKOFF_BASE_S = float(os.getenv("SAP_BACKOFF_BASE_S", "0.5"))
+# Fallas consecutivas que abren el circuito y segundos que permanece abierto
+SAP_BREAKER_THRESHOLD = int(os.getenv("SAP_BREAKER_THRESHOLD", "5"))
+SAP_BREAKER_RESET_S = float(os.getenv("SAP_BREAKER_RESET_S", "30"))
+
+_IDEMPOTENTES = {"GET", "DELETE"}
+
+
+class SAPError(Exception):
+    """Error devuelto por el Service Layer en operaciones que no retornan (ok, data)."""
+
+
+class SAPUnavailable(SAPError):
+    """SAP no responde o el circuito está abierto; no se intentó la operación."""
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a SAP tras varias fallas consecutivas (timeouts, errores
+    de conexión o 5xx) para no bloquear workers mientras SAP está degradado.
+    Pasado SAP_BREAKER_RESET_S deja pasar una sola llamada de prueba (half-open)
+    y rechaza las demás hasta conocer su resultado.
+    """
+
+    def __init__(self, threshold=SAP_BREAKER_THRESHOLD, reset_s=SAP_BREAKER_RESET_S):
+        self.threshold = threshold
+        self.reset_s = reset_s
+        self.estado = "closed"
+        self.fallas = 0
+        self.abierto_desde = None
+        self.aperturas = 0
+        # Hilo que hace la llamada de prueba en half-open (login + request pasan por allow())
+        self._probando = None
+        self._prueba_desde = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.estado == "closed":
+                return True
+            ahora = time.monotonic()
+            if self.estado == "open":
+                if ahora - self.abierto_desde < self.reset_s:
+                    return False
+                self.estado = "half_open"
+                self._probando = None
+            # Una prueba que nunca informó resultado (p. ej. excepción ajena a SAP) se da por perdida
+            perdida = ahora - self._prueba_desde > max(self.reset_s, SAP_CONNECT_TIMEOUT_S + SAP_READ_TIMEOUT_S)
+            if self._probando is None or self._probando == threading.get_ident() or perdida:
+                self._probando = threading.get_ident()
+                self._prueba_desde = ahora
+                return True
+            return False
+
+    @property
+    def abierto(self):
+        with self._lock:
+            return self.estado != "closed"
+
+    def record_success(self):
+        with self._lock:
+            if self.estado != "closed":
+                print("✅ Circuito SAP cerrado: SAP responde nuevamente.")
+            self.estado = "closed"
+            self.fallas = 0
+            self._probando = None
+
+    def record_failure(self):
+        with self._lock:
+            self.fallas += 1
+            if self.estado == "half_open" or (self.estado == "closed" and self.fallas >= self.threshold):
+                self.estado = "open"
+                self.abierto_desde = time.monotonic()
+                self.aperturas += 1
+                self._probando = None
+                print(f"🚫 Circuito SAP abierto tras {self.fallas} fallas; reintento en {self.reset_s}s.")
+
+    def state(self):
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "fallas_consecutivas": self.fallas,
+                "prueba_en_curso": self.estado == "half_open" and self._probando is not None,
+                "aperturas": self.aperturas,
+                "reintento_en_s": (
+                    max(0.0, round(self.reset_s - (time.monotonic() - self.abierto_desde), 1))
+                    if self.estado == "open" else None
+                ),
+            }
+
+
+sap_breaker = CircuitBreaker()
+
+
 class SAPServiceLayer:
     def __init__(self):
         self.base_url = os.getenv("SAP_URL")
@@ -22,6 +142,7 @@ class SAPServiceLayer:
         self.session = requests.Session()
         self.cookies = None
         self.logged_in = False
+        self.last_used = 0.0
 
     # === LOGIN ===
     def login(self):
@@ -34,39 +155,133 @@ class SAPServiceLayer:
             "Password": self.password,
         }
 
+        if not sap_breaker.allow():
+            print("🚫 Login SAP omitido: circuito abierto.")
+            return False
+
         try:
             print(f"🔐 Iniciando sesión SAP en: {self.base_url}/Login")
-            r = self.session.post(f"{self.base_url}/Login", json=payload, verify=False)
+            inicio = time.perf_counter()
+            r = self.session.post(f"{self.base_url}/Login", json=payload, verify=False,
+                                  timeout=(SAP_CONNECT_TIMEOUT_S, SAP_READ_TIMEOUT_S))
+            sap_metrics.registrar("POST", "Login", r.status_code, (time.perf_counter() - inicio) * 1000)
+            if r.status_code >= 500:
+                sap_breaker.record_failure()
+            else:
+                sap_breaker.record_success()
+            sap_metrics.evento("logins" if r.status_code == 200 else "login_errors")
             if r.status_code == 200:
                 self.cookies = r.cookies
                 self.logged_in = True
+                self.last_used = time.monotonic()
                 print(f"✅ Sesión SAP iniciada ({self.user}) — duración 30 min")
                 return True
             else:
                 print(f"❌ Error login SAP: {r.text}")
                 return False
+        except requests.RequestException as e:
+            sap_breaker.record_failure()
+            sap_metrics.evento("login_errors")
+            print("❌ Error al conectar con SAP:", e)
+            return False
         except Exception as e:
             print("❌ Error al conectar con SAP:", e)
             return False
-        
+
     def _ensure_session(self):
         if not self.logged_in or not self.cookies:
             self.login()
+        self.last_used = time.monotonic()
+
+    def is_expiring(self, margin_s=SAP_SESSION_REFRESH_MARGIN_S):
+        """True si la sesión está cerrada o a punto de expirar por inactividad."""
+        if not self.logged_in or not self.cookies:
+            return True
+        idle = time.monotonic() - self.last_used
+        return idle >= SAP_SESSION_TIMEOUT_MIN * 60 - margin_s
+
+    def refresh(self):
+        """Fuerza un nuevo login, descartando la cookie B1SESSION actual."""
+        sap_metrics.evento("session_refreshes")
+        self.logged_in = False
+        self.cookies = None
+        self.session.cookies.clear()
+        return self.login()
+
+    # === REQUEST CON TIMEOUT, REINTENTOS Y CIRCUIT BREAKER ===
+    def _request(self, method, endpoint, idempotente=None, **kwargs):
+        """
+        Ejecuta un request HTTP contra el Service Layer.
+        - Timeouts de conexión/lectura en todas las llamadas.
+        - Reintentos con backoff exponencial y jitter solo para verbos idempotentes
+          (o si la conexión no llegó a establecerse).
+        - Reautenticación única ante sesión expirada (401, o 301 en versiones antiguas).
+        Lanza SAPUnavailable si el circuito está abierto o SAP no responde.
+        """
+        if not sap_breaker.allow():
+            sap_metrics.registrar(method, endpoint, None, 0.0, error="circuito abierto")
+            raise SAPUnavailable("SAP no disponible (circuito abierto)")
 
-    def get(self, endpoint):
         self._ensure_session()
+        url = f"{self.base_url}/{endpoint}"
+        if idempotente is None:
+            idempotente = method.upper() in _IDEMPOTENTES
+        intento = 0
+        reautenticado = False
+        inicio = time.perf_counter()
+
+        while True:
+            try:
+                r = self.session.request(method, url, cookies=self.cookies, verify=False,
+                                         timeout=(SAP_CONNECT_TIMEOUT_S, SAP_READ_TIMEOUT_S), **kwargs)
+            except requests.RequestException as e:
+                sap_breaker.record_failure()
+                reintentable = idempotente or isinstance(e, requests.ConnectTimeout)
+                if not reintentable or intento >= SAP_MAX_RETRIES or not sap_breaker.allow():
+                    sap_metrics.registrar(method, endpoint, None, (time.perf_counter() - inicio) * 1000,
+                                          reintentos=intento, error=e)
+                    raise SAPUnavailable(f"SAP no responde ({method} {endpoint}): {e}") from e
+                intento += 1
+                self._esperar_backoff(intento, method, endpoint, e)
+                continue
+
+            if r.status_code in (301, 401) and not reautenticado:
+                print(f"⚠️ Sesión SAP expirada ({method}). Reautenticando...")
+                sap_metrics.evento("reauth")
+                reautenticado = True
+                self.refresh()
+                continue
+
+            if r.status_code >= 500:
+                sap_breaker.record_failure()
+                if idempotente and intento < SAP_MAX_RETRIES and sap_breaker.allow():
+                    intento += 1
+                    self._esperar_backoff(intento, method, endpoint, f"HTTP {r.status_code}")
+                    continue
+            else:
+                sap_breaker.record_success()
+
+            self.last_used = time.monotonic()
+            sap_metrics.registrar(
+                method, endpoint, r.status_code, (time.perf_counter() - inicio) * 1000,
+                bytes_enviados=len(r.request.body or b"") if r.request is not None else 0,
+                bytes_recibidos=len(r.content or b""),
+                reintentos=intento,
+            )
+            return r
+
+    def _esperar_backoff(self, intento, method, endpoint, motivo):
+        espera = SAP_BACKOFF_BASE_S * (2 ** (intento - 1))
+        espera = random.uniform(espera / 2, espera)
+        print(f"🔁 Reintento {intento}/{SAP_MAX_RETRIES} {method} {endpoint} en {espera:.2f}s ({motivo})")
+        time.sleep(espera)
+
+    def get(self, endpoint, headers=None):
         try:
-            url = f"{self.base_url}/{endpoint}"
-            r = self.session.get(url, cookies=self.cookies, verify=False)
+            r = self._request("GET", endpoint, headers=headers)
 
             if r.status_code == 200:
                 return True, r.json()
-            elif r.status_code == 301:
-                print("⚠️ Sesión SAP expirada (GET). Reautenticando...")
-                self.logged_in = False
-                self.login()
-                r = self.session.get(url, cookies=self.cookies, verify=False)
-                return True, r.json()
             else:
                 print(f"❌ Error GET SAP: {r.text}")
                 return False, r.text
@@ -75,28 +290,66 @@ class SAPServiceLayer:
             print("❌ Error GET SAP:", e)
             return False, str(e)
 
+    # === COLECCIONES PAGINADAS ===
+    def iter_collection(self, entity, select=None, filter=None, orderby=None, page_size=SAP_PAGE_SIZE,
+                        expand=None, top=None, skip=None, conteo=None):
+        """
+        Recorre una colección OData página por página siguiendo odata.nextLink,
+        entregando una fila a la vez (sin armar todo el resultado en memoria).
+        `entity` también puede ser un $crossjoin(...), con las columnas en `expand`.
+        top/skip paginan en SAP; si se pasa un dict en `conteo`, se pide
+        $inlinecount y se deja en conteo["total"] el total de filas del filtro.
+        Lanza SAPUnavailable si SAP no responde y SAPError si alguna página falla.
+        """
+        params = []
+        if select:
+            params.append(f"$select={select}")
+        if expand:
+            params.append(f"$expand={expand}")
+        if filter:
+            params.append(f"$filter={filter}")
+        if orderby:
+            params.append(f"$orderby={orderby}")
+        if top is not None:
+            params.append(f"$top={int(top)}")
+        if skip:
+            params.append(f"$skip={int(skip)}")
+        if conteo is not None:
+            params.append("$inlinecount=allpages")
+        endpoint = f"{entity}?{'&'.join(params)}" if params else entity
+        headers = {"Prefer": f"odata.maxpagesize={page_size}"} if page_size else None
+
+        while endpoint:
+            r = self._request("GET", endpoint, headers=headers)
+            try:
+                data = r.json() if r.status_code == 200 else r.text
+            except ValueError:
+                data = r.text
+            if not isinstance(data, dict):
+                print(f"❌ Error GET SAP: {data}")
+                raise SAPError(f"Error leyendo {entity} desde SAP: {data}")
+
+            if conteo is not None and "total" not in conteo:
+                total = data.get("odata.count", data.get("@odata.count"))
+                conteo["total"] = int(total) if total is not None else None
+            yield from data.get("value", [])
+
+            next_link = data.get("odata.nextLink") or data.get("@odata.nextLink")
+            if next_link and self.base_url and next_link.startswith(self.base_url):
+                next_link = next_link[len(self.base_url):]
+            endpoint = next_link.lstrip("/") if next_link else None
+
     def post(self, endpoint, payload):
-        self._ensure_session()
         try:
-            url = f"{self.base_url}/{endpoint}"
-            r = self.session.post(url, json=payload, cookies=self.cookies, verify=False)
+            r = self._request("POST", endpoint, json=payload)
 
             if r.status_code in [200, 201]:
                 try:
                     return True, r.json()
                 except Exception:
                     return True, {"status": "ok", "mensaje": "Operación completada, sin cuerpo JSON."}
-            elif r.status_code == 301:
-                print("⚠️ Sesión SAP expirada (POST). Reautenticando...")
-                self.logged_in = False
-                self.login()
-                r = self.session.post(url, json=payload, cookies=self.cookies, verify=False)
-                if r.status_code in [200, 201]:
-                    return True, r.json()
-                else:
-                    print(f"❌ Error POST SAP tras reintentar: {r.text}")
-                    return False, r.json() if r.text else {"error": "Error desconocido tras reautenticación"}
-
+            elif r.status_code == 204:
+                return True, {"status": "ok", "mensaje": "Operación completada, sin cuerpo JSON."}
             else:
                 print(f"❌ Error POST SAP: {r.text}")
                 try:
@@ -109,28 +362,13 @@ class SAPServiceLayer:
 
 
     def patch(self, endpoint, payload):
-        self._ensure_session()
         try:
-            url = f"{self.base_url}/{endpoint}"
             headers = {"B1S-ReplaceCollectionsOnPatch": "true"}
-
-            r = self.session.patch(url, json=payload, cookies=self.cookies, headers=headers, verify=False)
+            r = self._request("PATCH", endpoint, json=payload, headers=headers)
 
             if r.status_code in [200, 204]:
                 print(f"✅ PATCH ejecutado correctamente en SAP ({endpoint})")
                 return True, "Documento actualizado correctamente"
-
-            elif r.status_code == 301:
-                print("⚠️ Sesión SAP expirada (PATCH). Reautenticando...")
-                self.logged_in = False
-                self.login()
-                r = self.session.patch(url, json=payload, cookies=self.cookies, headers=headers, verify=False)
-                if r.status_code in [200, 204]:
-                    print("✅ PATCH reintentado correctamente.")
-                    return True, "Documento actualizado"
-                else:
-                    print(f"❌ Error PATCH SAP: {r.text}")
-                    return False, r.text
             else:
                 print(f"❌ Error PATCH SAP: {r.text}")
                 return False, r.text
@@ -141,10 +379,8 @@ class SAPServiceLayer:
 
     # === DELETE ===
     def delete(self, endpoint):
-        self._ensure_session()
         try:
-            url = f"{self.base_url}/{endpoint}"
-            r = self.session.delete(url, cookies=self.cookies, verify=False)
+            r = self._request("DELETE", endpoint)
 
             if r.status_code in [200, 204]:
                 print(f"🗑️ Documento eliminado correctamente: {endpoint}")
@@ -158,17 +394,274 @@ class SAPServiceLayer:
             return False, str(e)
 
 
+    # === $BATCH ===
+    def batch(self, operations, atomic=False):
+        """
+        Ejecuta varias operaciones en un único request $batch (multipart/mixed).
+
+        operations: lista de dicts {"method", "endpoint", "payload", "headers"};
+        payload y headers son opcionales.
+        Las lecturas viajan sueltas; cada escritura va en su propio changeset,
+        o todas en uno solo si atomic=True (todo o nada).
+        Retorna una lista de (ok, data) en el mismo orden que operations.
+        """
+        if not operations:
+            return []
+
+        body, boundary, grupos = self._build_batch(operations, atomic)
+        headers = {"Content-Type": f"multipart/mixed;boundary={boundary}"}
+
+        try:
+            # Un $batch solo de lecturas es idempotente y se puede reintentar
+            solo_lecturas = all(op["method"].upper() == "GET" for op in operations)
+            r = self._request("POST", "$batch", data=body.encode("utf-8"), headers=headers,
+                              idempotente=solo_lecturas)
+
+            if r.status_code not in (200, 202):
+                print(f"❌ Error $batch SAP: {r.text}")
+                return [(False, r.text)] * len(operations)
+
+            respuestas = _parse_multipart(r.headers.get("Content-Type", ""), r.content.decode("utf-8", "replace"))
+        except Exception as e:
+            print("❌ Error $batch SAP:", e)
+            return [(False, str(e))] * len(operations)
+
+        # Un changeset fallido responde con un único error para todas sus operaciones
+        resultados = []
+        for grupo, resp in zip(grupos, respuestas):
+            if len(resp) == len(grupo):
+                resultados.extend(resp)
+            else:
+                error = resp[0] if resp else (False, "Sin respuesta en $batch")
+                resultados.extend([error] * len(grupo))
+        faltantes = len(operations) - len(resultados)
+        if faltantes > 0:
+            resultados.extend([(False, "Sin respuesta en $batch")] * faltantes)
+        return resultados
+
+    def _build_batch(self, operations, atomic):
+        """Arma el cuerpo multipart del $batch y la agrupación de operaciones por parte."""
+        prefix = urlparse(self.base_url or "").path.rstrip("/")
+        boundary = f"batch_{uuid.uuid4().hex}"
+        lineas = []
+        grupos = []
+        escrituras = []
+
+        def parte_http(op, content_id=None):
+            parte = ["Content-Type: application/http", "Content-Transfer-Encoding: binary"]
+            if content_id is not None:
+                parte.append(f"Content-ID: {content_id}")
+            parte += ["", f"{op['method'].upper()} {prefix}/{op['endpoint']} HTTP/1.1"]
+            parte += [f"{k}: {v}" for k, v in (op.get("headers") or {}).items()]
+            if op.get("payload") is not None:
+                parte += ["Content-Type: application/json", "",
+                          json.dumps(op["payload"], ensure_ascii=False)]
+            parte.append("")
+            return parte
+
+        def changeset(ops):
+            cs = f"changeset_{uuid.uuid4().hex}"
+            lineas.extend([f"--{boundary}", f"Content-Type: multipart/mixed;boundary={cs}", ""])
+            for i, op in enumerate(ops, start=1):
+                lineas.append(f"--{cs}")
+                lineas.extend(parte_http(op, content_id=i))
+            lineas.extend([f"--{cs}--", ""])
+            grupos.append(ops)
+
+        for op in operations:
+            if op["method"].upper() == "GET":
+                lineas.append(f"--{boundary}")
+                lineas.extend(parte_http(op))
+                grupos.append([op])
+            elif atomic:
+                escrituras.append(op)
+            else:
+                changeset([op])
+        if escrituras:
+            changeset(escrituras)
+
+        lineas.append(f"--{boundary}--")
+        return "\r\n".join(lineas), boundary, grupos
+
     def logout(self):
         """Finaliza la sesión actual en SAP Business One."""
+        if not self.logged_in:
+            return
         try:
             self.post("Logout", {})
             print("🔒 Sesión SAP cerrada correctamente.")
         except Exception as e:
             print(f"⚠️ No se pudo cerrar sesión SAP: {e}")
+        finally:
+            self.logged_in = False
+            self.cookies = None
+
+
+def _parse_multipart(content_type, texto):
+    """
+    Separa una respuesta multipart/mixed del $batch.
+    Cada parte HTTP se convierte en [(ok, data)] y cada changeset en una lista anidada.
+    """
+    boundary = None
+    for token in content_type.split(";"):
+        token = token.strip()
+        if token.lower().startswith("boundary="):
+            boundary = token.split("=", 1)[1].strip('"')
+    if not boundary:
+        return []
+
+    partes = []
+    texto = texto.replace("\r\n", "\n")
+    for bloque in texto.split(f"--{boundary}")[1:]:
+        if bloque.startswith("--"):
+            break
+        cabecera, _, cuerpo = bloque.lstrip("\n").partition("\n\n")
+        tipo = ""
+        for linea in cabecera.splitlines():
+            if linea.lower().startswith("content-type:"):
+                tipo = linea.split(":", 1)[1].strip()
+        if tipo.lower().startswith("multipart/mixed"):
+            partes.append([r[0] for r in _parse_multipart(tipo, cuerpo)])
+        else:
+            partes.append([_parse_http_response(cuerpo)])
+    return partes
+
+
+def _parse_http_response(texto):
+    """Convierte una respuesta HTTP embebida en el $batch a (ok, data)."""
+    texto = texto.strip("\n")
+    cabecera, _, cuerpo = texto.partition("\n\n")
+    status_line = cabecera.split("\n", 1)[0]
+    try:
+        status = int(status_line.split(" ")[1])
+    except (IndexError, ValueError):
+        return False, texto
+
+    cuerpo = cuerpo.strip()
+    try:
+        data = json.loads(cuerpo) if cuerpo else {}
+    except ValueError:
+        data = cuerpo
+    return 200 <= status < 300, data
+
+
+class SAPSessionPool:
+    """
+    Pool de sesiones SAP compartido por todo el proceso.
+    Reutiliza las cookies B1SESSION entre requests en vez de hacer
+    login/logout en cada llamada, y las renueva antes de que expiren.
+    Presta a lo más max_size sesiones a la vez (licencias SAP); el resto espera.
+    """
+
+    def __init__(self, max_size=SAP_POOL_SIZE, timeout_s=SAP_POOL_TIMEOUT_S):
+        self.max_size = max_size
+        self.timeout_s = timeout_s
+        self._idle = []
+        self._prestadas = set()
+        self._cupos = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.logins = 0
+        self.reused = 0
+        self.agotado = 0
+
+    def acquire(self):
+        """
+        Entrega una sesión SAP autenticada (reutilizada o nueva). Lanza
+        SAPUnavailable si las max_size están prestadas y ninguna vuelve en timeout_s.
+        """
+        if not self._cupos.acquire(timeout=self.timeout_s):
+            self._count("agotado")
+            raise SAPUnavailable(f"Sin sesiones SAP libres ({self.max_size} en uso por {self.timeout_s:g}s)")
+        try:
+            sap = self._sesion()
+        except BaseException:
+            self._cupos.release()
+            raise
+        with self._lock:
+            self._prestadas.add(id(sap))
+        return sap
+
+    def _sesion(self):
+        sap = None
+        with self._lock:
+            if self._idle:
+                sap = self._idle.pop()
+
+        if sap is not None and not sap.is_expiring():
+            self._count("reused")
+            return sap
+
+        if sap is not None:
+            print("♻️ Sesión SAP del pool próxima a expirar. Renovando...")
+            sap.refresh()
+        else:
+            sap = SAPServiceLayer()
+            sap.login()
+        self._count("logins")
+        return sap
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def release(self, sap):
+        """Devuelve la sesión al pool (una sola vez por acquire); si está lleno o es inválida, se cierra."""
+        if sap is None:
+            return
+        with self._lock:
+            if id(sap) not in self._prestadas:
+                return
+            self._prestadas.discard(id(sap))
+        try:
+            if not sap.logged_in:
+                return
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append(sap)
+                    return
+            sap.logout()
+        finally:
+            self._cupos.release()
+
+    def close(self):
+        """Cierra todas las sesiones inactivas del pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sap in idle:
+            sap.logout()
+
+    def stats(self):
+        with self._lock:
+            idle, en_uso = len(self._idle), len(self._prestadas)
+        return {"idle": idle, "en_uso": en_uso, "max_size": self.max_size, "logins": self.logins,
+                "reused": self.reused, "agotado": self.agotado}
+
+
+sap_pool = SAPSessionPool()
+atexit.register(sap_pool.close)
+
+
+@contextmanager
+def sap_session():
+    """Presta una sesión del pool durante el bloque `with` y la devuelve al salir."""
+    sap = sap_pool.acquire()
+    try:
+        yield sap
+    finally:
+        sap_pool.release(sap)
 
 
 validacion_bp = Blueprint("validacion_bp", __name__)
 
+@validacion_bp.route("/sap/salud", methods=["GET"])
+def sap_salud():
+    circuito = sap_breaker.state()
+    return jsonify({
+        "status": "ok" if circuito["estado"] == "closed" else "error",
+        "circuito": circuito,
+        "pool": sap_pool.stats(),
+    }), 200
+
 @validacion_bp.route("/validar_docnum/<int:docnum>", methods=["GET"])
 def validar_docnum(docnum):
     try:
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+# Los módulos se importan como en la app (desde public/) y el stand-in de SAP
+# y la BD SQLite reemplazan a los servicios reales antes de cargar controladores
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.bench_sap import preparar_entorno
+
+_STANDIN, _DB = preparar_entorno(argparse.Namespace(seed=7, latency_ms=0.0, jitter_ms=0.0, page_size=20))
+
+
+@pytest.fixture
+def standin():
+    """SAP simulado con un dataset chico y fresco por test."""
+    from tools.sap_standin import generar_dataset
+
+    _STANDIN.cargar(generar_dataset(seed=7, items=20, vendors=10, documentos=10, abiertos=1.0))
+    return _STANDIN
+
+
+@pytest.fixture
+def db():
+    """BD SQLite vacía por test (mismo esquema que la app)."""
+    conn = _DB.get_connection()
+    cur = conn.cursor()
+    for tabla in ("FACTURAS", "DETALLE_PRODUCTO"):
+        cur.execute(f"DELETE FROM {tabla}")
+    conn.commit()
+    conn.close()
+    return _DB
@@ -0,0 +1,63 @@
+from controllers.ocr_plantillas import descuadre
+from controllers.ocr_prompt import compactar_texto, contar_tokens
+
+
+def test_descuadre_factura_que_cuadra():
+    assert descuadre(100, 1000, 100_000, 0, 5_000, 3_000, 19_000, 127_000) is None
+    # Dentro de la tolerancia en pesos por redondeo
+    assert descuadre(100, 1000, 100_000, 0, 5_000, 3_000, 19_000, 127_001) is None
+
+
+def test_descuadre_total_distinto():
+    assert descuadre(100, 1000, 100_000, 0, 5_000, 3_000, 19_000, 130_000).startswith("no cuadra: neto")
+
+
+def test_descuadre_litros_por_precio_base():
+    assert "litros" in descuadre(100, 900, 100_000, 0, 5_000, 3_000, 19_000, 127_000)
+    assert "litros" in descuadre(0, 1000, 100_000, 0, 5_000, 3_000, 19_000, 127_000)
+    # Hasta 1% de diferencia por el redondeo del precio unitario
+    assert descuadre(100, 995, 100_000, 0, 5_000, 3_000, 19_000, 127_000) is None
+
+
+def test_compactar_texto_quita_vacias_repetidas_y_ruido():
+    texto = "\n".join([
+        "FACTURA ELECTRONICA N° 123",
+        "",
+        "R.U.T.: 99.520.000-7",
+        "Timbre Electrónico SII",
+        "Verifique documento: www.sii.cl",
+        "FACTURA  ELECTRONICA   N° 123",
+        "Página 1 de 2",
+        "TOTAL $ 127.000",
+    ])
+    compacto, detalle = compactar_texto(texto)
+    assert compacto == "FACTURA ELECTRONICA N° 123\nR.U.T.: 99.520.000-7\nTOTAL $ 127.000"
+    assert detalle["lineas_originales"] == 8
+    assert detalle["lineas"] == 3
+    assert detalle["recorte"] is None
+
+
+def test_compactar_texto_conserva_relevantes_al_recortar():
+    relleno = [f"linea de relleno sin datos {i}" for i in range(200)]
+    texto = "\n".join(relleno[:100] + ["PETROLEO DIESEL 1.000 LTS", "TOTAL $ 127.000"] + relleno[100:])
+    compacto, detalle = compactar_texto(texto, max_tokens=50)
+    assert detalle["recorte"] == "relevantes"
+    assert "PETROLEO DIESEL 1.000 LTS" in compacto
+    assert "TOTAL $ 127.000" in compacto
+    assert "relleno sin datos 150" not in compacto
+    assert detalle["tokens_texto"] <= 50
+
+
+def test_compactar_texto_trunca_si_sigue_largo():
+    texto = "\n".join(f"TOTAL linea {i}" for i in range(500))
+    compacto, detalle = compactar_texto(texto, max_tokens=100)
+    assert detalle["recorte"] == "truncado"
+    assert compacto.startswith("TOTAL linea 0")
+    assert compacto.endswith("TOTAL linea 499")
+    assert contar_tokens(compacto) <= 110
+
+
+def test_compactar_texto_vacio():
+    assert compactar_texto(None) == ("", {
+        "tokens_texto_original": 0, "tokens_texto": 0, "lineas_originales": 0, "lineas": 0, "recorte": None,
+    })
@@ -0,0 +1,73 @@
+from controllers_sap.sap_service import _parse_multipart, sap_session
+
+
+def test_parse_multipart_partes_sueltas_y_changeset():
+    texto = "\r\n".join([
+        "--batch_1",
+        "Content-Type: application/http",
+        "",
+        "HTTP/1.1 200 OK",
+        "Content-Type: application/json",
+        "",
+        '{"DocEntry": 1}',
+        "--batch_1",
+        "Content-Type: multipart/mixed;boundary=cs_1",
+        "",
+        "--cs_1",
+        "Content-Type: application/http",
+        "",
+        "HTTP/1.1 204 No Content",
+        "",
+        "--cs_1",
+        "Content-Type: application/http",
+        "",
+        "HTTP/1.1 400 Bad Request",
+        "",
+        '{"error": {"message": {"value": "malo"}}}',
+        "--cs_1--",
+        "--batch_1--",
+        "",
+    ])
+    partes = _parse_multipart('multipart/mixed; boundary="batch_1"', texto)
+    assert partes == [
+        [(True, {"DocEntry": 1})],
+        [(True, {}), (False, {"error": {"message": {"value": "malo"}}})],
+    ]
+
+
+def test_parse_multipart_sin_boundary():
+    assert _parse_multipart("application/json", "{}") == []
+
+
+def test_batch_lecturas_y_escrituras(standin):
+    doc = standin.data["PurchaseRequests"][0]["DocEntry"]
+    with sap_session() as sap:
+        resultados = sap.batch([
+            {"method": "GET", "endpoint": f"PurchaseRequests({doc})?$select=DocEntry"},
+            {"method": "GET", "endpoint": "PurchaseRequests(999999)"},
+            {"method": "PATCH", "endpoint": f"PurchaseRequests({doc})", "payload": {"Comments": "batch"}},
+        ])
+
+    assert [ok for ok, _ in resultados] == [True, False, True]
+    assert resultados[0][1]["DocEntry"] == doc
+    assert standin.data["PurchaseRequests"][0]["Comments"] == "batch"
+
+
+def test_batch_atomico_todo_o_nada(standin):
+    fila = standin.data["PurchaseRequests"][0]
+    comentario = fila.get("Comments")
+    with sap_session() as sap:
+        resultados = sap.batch([
+            {"method": "PATCH", "endpoint": f"PurchaseRequests({fila['DocEntry']})", "payload": {"Comments": "x"}},
+            {"method": "PATCH", "endpoint": "PurchaseRequests(999999)", "payload": {"Comments": "x"}},
+        ], atomic=True)
+
+    # Un changeset fallido responde un único error que se replica a todas sus operaciones
+    assert [ok for ok, _ in resultados] == [False, False]
+    assert resultados[0] == resultados[1]
+    assert standin.data["PurchaseRequests"][0].get("Comments") == comentario
+
+
+def test_batch_vacio():
+    with sap_session() as sap:
+        assert sap.batch([]) == []
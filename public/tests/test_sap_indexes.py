@@ -0,0 +1,70 @@
+import pytest
+
+from controllers_sap import sap_indexes
+from controllers_sap.sap_indexes import VendorIndex, digito_verificador, normalizar_rut
+
+
+@pytest.mark.parametrize("rut, esperado", [
+    ("99.520.000-7", "99520000-7"),
+    ("99520000-7", "99520000-7"),
+    ("PN99520000-7", "99520000-7"),
+    ("PN995200007", "99520000-7"),
+    ("995200007", "99520000-7"),
+    ("7.654.321-6", "7654321-6"),
+    ("76.543.212-k", "76543212-K"),
+    ("0099520000-7", "99520000-7"),
+    ("", None),
+    (None, None),
+    ("abc", None),
+])
+def test_normalizar_rut(rut, esperado):
+    assert normalizar_rut(rut) == esperado
+
+
+def test_digito_verificador():
+    assert digito_verificador("99520000") == "7"
+    assert digito_verificador("76543212") == "K"
+
+
+@pytest.fixture
+def indice(standin, monkeypatch):
+    """Índice sobre una carga fija de 'vendors'; los miss consultan al SAP simulado."""
+    socios = standin.data["BusinessPartners"]
+    socios[:] = [
+        {"CardCode": "PN99520000-7", "CardName": "COPEC", "CardType": "S", "FederalTaxID": "99520000-7"},
+        {"CardCode": "PN76543212-K", "CardName": "LARGO", "CardType": "S", "FederalTaxID": "76543212-K"},
+        {"CardCode": "PN965062106", "CardName": "SIN GUION", "CardType": "S", "FederalTaxID": None},
+        {"CardCode": "PN11111111-1", "CardName": "CLIENTE", "CardType": "C", "FederalTaxID": "11111111-1"},
+    ]
+    fija = [socios[0]]
+    monkeypatch.setattr(sap_indexes.master_data, "get", lambda nombre: fija)
+    monkeypatch.setattr(sap_indexes, "SAP_VENDOR_DELTA_S", 10 ** 9)
+    return VendorIndex()
+
+
+def test_buscar_en_el_indice_sin_ir_a_sap(indice, standin):
+    antes = standin.contadores["requests"]
+    assert indice.buscar("99.520.000-7") == {"CardCode": "PN99520000-7", "CardName": "COPEC"}
+    assert standin.contadores["requests"] == antes
+
+
+def test_miss_consulta_sap_por_cardcode_exacto(indice):
+    assert indice.buscar("96.506.210-6") == {"CardCode": "PN965062106", "CardName": "SIN GUION"}
+    # Un RUT corto no calza por prefijo con PN76543212-K
+    assert indice.buscar("7.654.321-6") is None
+    assert indice.buscar("76543212-K") == {"CardCode": "PN76543212-K", "CardName": "LARGO"}
+
+
+def test_cliente_no_es_proveedor_y_el_miss_se_recuerda(indice, standin):
+    assert indice.buscar("11.111.111-1") is None
+    antes = standin.contadores["requests"]
+    assert indice.buscar("11111111-1") is None
+    assert standin.contadores["requests"] == antes
+
+
+def test_miss_vencido_vuelve_a_consultar(indice, standin, monkeypatch):
+    monkeypatch.setattr(sap_indexes, "SAP_VENDOR_MISS_TTL_S", -1)
+    assert indice.buscar("12.345.678-5") is None
+    standin.data["BusinessPartners"].append(
+        {"CardCode": "PN12345678-5", "CardName": "NUEVO", "CardType": "S", "FederalTaxID": "12345678-5"})
+    assert indice.buscar("12.345.678-5") == {"CardCode": "PN12345678-5", "CardName": "NUEVO"}
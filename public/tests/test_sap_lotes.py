@@ -0,0 +1,86 @@
+import pytest
+
+from controllers_sap.sap_convert import ID_PRODUCTO_PEDIDO, _actualizar_bd_lote
+from controllers_sap.sap_lotes import items_del_body
+
+
+def test_items_del_body_acepta_docentries_y_dicts():
+    items = items_del_body([5, "6", {"DocEntry": "7", "Comments": "x"}, {"DocEntry": 8, "Comments": None}],
+                           Comments="defecto")
+    assert items == [
+        {"Comments": "defecto", "DocEntry": 5},
+        {"Comments": "defecto", "DocEntry": 6},
+        {"Comments": "x", "DocEntry": 7},
+        {"Comments": "defecto", "DocEntry": 8},
+    ]
+
+
+def test_items_del_body_descarta_repetidos():
+    assert items_del_body([5, {"DocEntry": 5, "Comments": "otro"}, "5"]) == [{"DocEntry": 5}]
+
+
+@pytest.mark.parametrize("lista", [["abc"], [None], [{"Comments": "sin DocEntry"}]])
+def test_items_del_body_docentry_invalido(lista):
+    with pytest.raises(ValueError):
+        items_del_body(lista)
+
+
+def test_items_del_body_vacio():
+    assert items_del_body(None) == []
+
+
+def _facturas(db, filas):
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO FACTURAS (NUMERO_SOLICITUD_SAP, NUMERO_PEDIDO, BASE_AFECTA, IEV, IEF, TOTAL)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, filas)
+    conn.commit()
+    cur.execute("SELECT NUMERO_SOLICITUD_SAP, ID_FACTURA FROM FACTURAS")
+    ids = {sol: id_factura for sol, id_factura in cur.fetchall()}
+    conn.close()
+    return ids
+
+
+def _consultar(db, sql):
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.execute(sql)
+    filas = cur.fetchall()
+    conn.close()
+    return filas
+
+
+def test_actualizar_bd_lote(db):
+    ids = _facturas(db, [
+        ("100", None, 1000.0, 50.0, 30.0, 1270.0),
+        ("101", None, 2000.0, 100.0, 60.0, 2540.0),
+        ("102", None, 500.0, 0.0, 0.0, 595.0),
+    ])
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO DETALLE_PRODUCTO (ID_FACTURA, CANTIDAD, ID_PRODUCTO) VALUES (?, ?, ?)",
+                (ids["101"], 1, 1))
+    conn.commit()
+    conn.close()
+
+    # 102 se convierte sin cantidad: solo se enlaza el pedido
+    _actualizar_bd_lote([(100, 500, 10), (101, 501, 20), (102, 502, 0)])
+
+    assert dict(_consultar(db, "SELECT NUMERO_SOLICITUD_SAP, NUMERO_PEDIDO FROM FACTURAS")) == {
+        "100": "500", "101": "501", "102": "502",
+    }
+    detalles = {fila[0]: fila[1:] for fila in _consultar(db, """
+        SELECT ID_FACTURA, CANTIDAD, PBASE_SI_U, IEV_U, IEF_U, ID_PRODUCTO FROM DETALLE_PRODUCTO
+    """)}
+    assert set(detalles) == {ids["100"], ids["101"]}
+    assert detalles[ids["100"]] == (10, 100.0, 5.0, 3.0, ID_PRODUCTO_PEDIDO)
+    # El detalle existente se actualiza en vez de duplicarse
+    assert detalles[ids["101"]] == (20, 100.0, 5.0, 3.0, ID_PRODUCTO_PEDIDO)
+
+
+def test_actualizar_bd_lote_enlaza_por_pedido(db):
+    ids = _facturas(db, [(None, "600", 300.0, 30.0, 0.0, 400.0)])
+    _actualizar_bd_lote([(200, 600, 3)])
+    assert _consultar(db, "SELECT ID_FACTURA, CANTIDAD FROM DETALLE_PRODUCTO") == [(ids[None], 3)]
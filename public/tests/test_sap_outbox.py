@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+
+from controllers_sap import sap_outbox
+
+
+@sap_outbox.tarea_outbox("prueba")
+def _prueba(job):
+    return 200, {"status": "ok", "data": job.payload}
+
+
+@pytest.fixture
+def outbox(db):
+    sap_outbox.asegurar_tablas()
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM SAP_OUTBOX_CADENAS")
+    cur.execute("DELETE FROM SAP_OUTBOX")
+    conn.commit()
+    conn.close()
+    return sap_outbox
+
+
+def _tomados(outbox):
+    jobs = {}
+    while (job := outbox._tomar()) is not None:
+        jobs[job.id] = job
+    return jobs
+
+
+def test_misma_cadena_en_orden_de_llegada(outbox):
+    a = outbox.encolar("prueba", {}, "PurchaseOrders:1")
+    b = outbox.encolar("prueba", {}, "PurchaseOrders:1")
+    c = outbox.encolar("prueba", {}, "PurchaseOrders:2")
+
+    # b espera a que termine a; c va por otra cadena
+    tomados = _tomados(outbox)
+    assert list(tomados) == [a, c]
+    outbox._finalizar(tomados[a], outbox.OK, 200, {})
+    assert list(_tomados(outbox)) == [b]
+
+
+def test_lote_espera_a_cada_una_de_sus_cadenas(outbox):
+    a = outbox.encolar("prueba", {}, "PurchaseOrders:1")
+    lote = outbox.encolar("prueba", {}, ["PurchaseOrders:1", "PurchaseOrders:2"])
+    despues = outbox.encolar("prueba", {}, "PurchaseOrders:2")
+    libre = outbox.encolar("prueba", {}, "PurchaseOrders:3")
+
+    # El lote espera a `a`, y el posterior de su segundo documento espera al lote
+    tomados = _tomados(outbox)
+    assert list(tomados) == [a, libre]
+    outbox._finalizar(tomados[a], outbox.OK, 200, {})
+    tomados = _tomados(outbox)
+    assert list(tomados) == [lote]
+    outbox._finalizar(tomados[lote], outbox.OK, 200, {})
+    assert list(_tomados(outbox)) == [despues]
+
+
+def test_lease_vencido_se_retoma_y_el_intento_viejo_no_escribe(outbox, db):
+    id_job = outbox.encolar("prueba", {"n": 1}, "PurchaseOrders:1")
+    viejo = outbox._tomar()
+    assert outbox._tomar() is None
+
+    conn = db.get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE SAP_OUTBOX SET TOMADO_EN = ? WHERE ID_JOB = ?",
+                (datetime.datetime.now() - datetime.timedelta(seconds=outbox.SAP_OUTBOX_LEASE_S + 1), id_job))
+    conn.commit()
+    conn.close()
+
+    nuevo = outbox._tomar()
+    assert nuevo.id == id_job and nuevo.intentos == 2
+    assert nuevo.tomado_por != viejo.tomado_por
+
+    with pytest.raises(outbox.TrabajoAjeno):
+        viejo.checkpoint("paso viejo")
+    outbox._finalizar(viejo, outbox.ERROR, 500, {}, error="viejo")
+    assert outbox.consultar(id_job)["estado"] == outbox.EN_PROCESO
+
+    nuevo.checkpoint("paso nuevo")
+    outbox._ejecutar(nuevo)
+    estado = outbox.consultar(id_job)
+    assert estado["estado"] == outbox.OK
+    assert estado["paso"] == "paso nuevo"
+
+
+def test_lease_vigente_no_se_retoma(outbox):
+    outbox.encolar("prueba", {}, "PurchaseOrders:1")
+    assert outbox._tomar() is not None
+    assert outbox._tomar() is None
+
@@ -0,0 +1,277 @@
+"""
+Benchmark de los endpoints SAP contra el SAP simulado (tools.sap_standin) y una
+BD SQLite (tools.db_standin), sin tocar SAP ni SQL Server reales.
+
+Uso (desde public/):
+    python -m tools.bench_sap --sizes 10,100,1000,5000 --requests 30 --latency-ms 40 \\
+        --output bench_actual.json --compare bench_base.json
+
+Para cada tamaño se generan N documentos abiertos por tipo y se mide latencia
+(p50/p95/p99) y throughput de cada endpoint. El resultado queda en un JSON; con
+--compare se contrasta contra una corrida anterior y el proceso termina con
+código 1 si algún p95 empeora más allá de --tolerancia.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import datetime
+import tempfile
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = {
+    "solicitudes_abiertas": ("GET", "/sap/solicitudes_abiertas"),
+    "pedidos_abiertos": ("GET", "/sap/pedidos_abiertos"),
+    "pedidos_abiertos_pagina": ("GET", "/sap/pedidos_abiertos?orden=DocDate&por_pagina=50"),
+    "entradas_abiertas": ("GET", "/sap/entradas_abiertas"),
+    "convertir_a_pedido": ("POST", "/sap/convertir_a_pedido"),
+    "convertir_a_entrada_directa": ("POST", "/sap/convertir_a_entrada_directa"),
+    "convertir_a_pedidos_lote": ("POST", "/sap/convertir_a_pedido/lote"),
+    "convertir_a_entradas_lote": ("POST", "/sap/convertir_a_entrada_directa/lote"),
+}
+
+
+def preparar_entorno(args):
+    """
+    Levanta el SAP simulado, apunta la app a él y reemplaza el módulo `bd`
+    por la BD SQLite. Debe ejecutarse antes de importar los controladores.
+    """
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from tools.sap_standin import SAPStandIn, create_standin_app
+    from tools import db_standin
+
+    class _Silencioso(WSGIRequestHandler):
+        def log_request(self, *a, **k):
+            pass
+
+    standin = SAPStandIn(data={}, seed=args.seed, latency_ms=args.latency_ms,
+                         jitter_ms=args.jitter_ms, page_size=args.page_size)
+    servidor = make_server("127.0.0.1", 0, create_standin_app(standin), threaded=True,
+                           request_handler=_Silencioso)
+    threading.Thread(target=servidor.serve_forever, name="sap-standin", daemon=True).start()
+
+    os.environ.update({
+        "SAP_URL": f"http://127.0.0.1:{servidor.server_port}/b1s/v1",
+        "SAP_COMPANY": "BENCH",
+        "SAP_USERNAME": "bench",
+        "SAP_PASSWORD": "bench",
+        "SAP_METRICS_LOG": "0",
+        "SAP_MIRROR_ENABLED": os.getenv("SAP_MIRROR_ENABLED", "0"),
+        # Las conversiones se miden completas (SAP + BD), no solo el encolado
+        "SAP_OUTBOX_ASYNC": "0",
+    })
+
+    db_standin.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_sap_"), "bench.sqlite3")
+    db_standin.crear_esquema()
+    sys.modules["bd"] = db_standin
+    return standin, db_standin
+
+
+def crear_app():
+    """App Flask con los blueprints medidos (sin JWT ni OpenAI, que no participan)."""
+    from flask import Flask
+    from controllers_sap.sap_open_docs import sap_open_docs_bp
+    from controllers_sap.sap_convert import sap_convert_bp
+    from controllers_sap.sap_actions import sap_actions_bp
+    from controllers_sap.sap_outbox import sap_outbox_bp, iniciar_outbox
+
+    app = Flask("bench_sap")
+    for bp in (sap_open_docs_bp, sap_convert_bp, sap_actions_bp, sap_outbox_bp):
+        app.register_blueprint(bp)
+    iniciar_outbox()
+    return app
+
+
+def sembrar(standin, db_standin, size, seed):
+    """Carga `size` documentos abiertos por tipo y facturas locales enlazadas a ellos."""
+    from tools.sap_standin import generar_dataset
+    from controllers_sap.sap_cache import master_data
+
+    standin.cargar(generar_dataset(seed, documentos=size, abiertos=1.0))
+    master_data.invalidate()
+
+    rnd = random.Random(seed)
+    conn = db_standin.get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM FACTURAS")
+    cur.execute("DELETE FROM DETALLE_PRODUCTO")
+    filas = []
+    for doc in standin.data["PurchaseRequests"]:
+        base = float(rnd.randint(100_000, 2_000_000))
+        filas.append((str(doc["DocNum"]), doc["CardName"], doc["CardCode"][2:], base,
+                      round(base * 0.05, 2), round(base * 0.03, 2), round(base * 1.27, 2)))
+    cur.executemany("""
+        INSERT INTO FACTURAS (NUMERO_SOLICITUD_SAP, NOMBRE_EMISOR, RUT_EMISOR, BASE_AFECTA, IEV, IEF, TOTAL)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, filas)
+    cur.executemany("UPDATE FACTURAS SET NUMERO_PEDIDO = ? WHERE NUMERO_SOLICITUD_SAP = ?",
+                    [(str(doc["DocNum"]), str(doc["DocNum"])) for doc in standin.data["PurchaseOrders"]])
+    conn.commit()
+    conn.close()
+
+
+def cuerpos(nombre, standin, n, rnd, lote=50):
+    """Payloads de los POST: cada conversión usa un documento abierto distinto."""
+    if nombre in ("convertir_a_pedidos_lote", "convertir_a_entradas_lote"):
+        entidad = "PurchaseRequests" if nombre == "convertir_a_pedidos_lote" else "PurchaseOrders"
+        docs = [d for d in standin.data[entidad] if d["DocumentStatus"] == "bost_Open"]
+        docs = rnd.sample(docs, min(n * lote, len(docs)))
+        return [{"DocEntries": [d["DocEntry"] for d in docs[i:i + lote]]}
+                for i in range(0, len(docs), lote)][:n]
+    if nombre == "convertir_a_pedido":
+        docs = [d for d in standin.data["PurchaseRequests"] if d["DocumentStatus"] == "bost_Open"]
+    elif nombre == "convertir_a_entrada_directa":
+        docs = [d for d in standin.data["PurchaseOrders"] if d["DocumentStatus"] == "bost_Open"]
+    else:
+        return [None] * n
+    docs = rnd.sample(docs, min(n, len(docs)))
+    return [{"DocEntry": d["DocEntry"], "CardCode": d["CardCode"]} for d in docs]
+
+
+def medir(app, metodo, ruta, payloads, concurrencia):
+    """Ejecuta los requests y retorna (latencias_ms, errores, segundos_totales)."""
+    locales = threading.local()
+
+    def uno(payload):
+        cliente = getattr(locales, "cliente", None)
+        if cliente is None:
+            cliente = locales.cliente = app.test_client()
+        inicio = time.perf_counter()
+        resp = cliente.open(ruta, method=metodo, json=payload)
+        ms = (time.perf_counter() - inicio) * 1000
+        return ms, resp.status_code < 400 and (resp.get_json(silent=True) or {}).get("status") != "error"
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        resultados = list(pool.map(uno, payloads))
+    total = time.perf_counter() - inicio
+    return [ms for ms, _ in resultados], sum(1 for _, ok in resultados if not ok), total
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    idx = max(0, min(len(ordenados) - 1, int(round(p * len(ordenados) + 0.5)) - 1))
+    return round(ordenados[idx], 2)
+
+
+def resumir(latencias, errores, segundos):
+    return {
+        "n": len(latencias),
+        "errores": errores,
+        "p50_ms": percentil(latencias, 0.50),
+        "p95_ms": percentil(latencias, 0.95),
+        "p99_ms": percentil(latencias, 0.99),
+        "avg_ms": round(sum(latencias) / len(latencias), 2) if latencias else None,
+        "max_ms": round(max(latencias), 2) if latencias else None,
+        "rps": round(len(latencias) / segundos, 2) if segundos else None,
+    }
+
+
+def comparar(actual, base, tolerancia, piso_ms):
+    """Lista de regresiones de p95 respecto a una corrida anterior."""
+    regresiones = []
+    for size, endpoints in actual["resultados"].items():
+        for nombre, r in endpoints.items():
+            anterior = base.get("resultados", {}).get(size, {}).get(nombre)
+            if not anterior or anterior.get("p95_ms") is None or r.get("p95_ms") is None:
+                continue
+            delta = r["p95_ms"] - anterior["p95_ms"]
+            if delta > piso_ms and r["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+                regresiones.append({
+                    "size": size, "endpoint": nombre,
+                    "p95_base_ms": anterior["p95_ms"], "p95_actual_ms": r["p95_ms"],
+                    "cambio": f"{r['p95_ms'] / anterior['p95_ms'] - 1:+.0%}",
+                })
+    return regresiones
+
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de endpoints SAP contra servicios simulados")
+    parser.add_argument("--sizes", default="10,100,1000,5000", help="documentos abiertos por tipo")
+    parser.add_argument("--requests", type=int, default=20, help="requests por endpoint y tamaño")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia simulada por llamada a SAP")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--lote", type=int, default=50, help="documentos por request en los endpoints *_lote")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warmup", type=int, default=1, help="requests de calentamiento por endpoint")
+    parser.add_argument("--output", default="bench_sap.json")
+    parser.add_argument("--compare", help="JSON de una corrida anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="aumento de p95 permitido (0.15 = 15%%)")
+    parser.add_argument("--piso-ms", type=float, default=5.0, help="ignora regresiones menores a estos ms")
+    parser.add_argument("--verbose", action="store_true", help="muestra los print de la app")
+    args = parser.parse_args()
+
+    standin, db_standin = preparar_entorno(args)
+    app = crear_app()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    nombres = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    rnd = random.Random(args.seed)
+
+    resultado = {
+        "meta": {
+            "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit_actual(),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "verbose")},
+        },
+        "resultados": {},
+    }
+
+    for size in sizes:
+        sembrar(standin, db_standin, size, args.seed)
+        resultado["resultados"][str(size)] = {}
+        for nombre in nombres:
+            metodo, ruta = ENDPOINTS[nombre]
+            salida = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with salida:
+                for payload in cuerpos(nombre, standin, args.warmup, rnd, args.lote):
+                    medir(app, metodo, ruta, [payload], 1)
+                if metodo != "GET":
+                    # El calentamiento cierra documentos: se restauran para la medición
+                    sembrar(standin, db_standin, size, args.seed)
+                payloads = cuerpos(nombre, standin, args.requests, rnd, args.lote)
+                latencias, errores, segundos = medir(app, metodo, ruta, payloads, args.concurrency)
+            r = resumir(latencias, errores, segundos)
+            resultado["resultados"][str(size)][nombre] = r
+            print(f"📏 {size:>5} docs  {nombre:<28} n={r['n']:<4} err={r['errores']:<3} "
+                  f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms rps={r['rps']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"💾 Resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(resultado, base, args.tolerancia, args.piso_ms)
+        for reg in regresiones:
+            print(f"🔺 Regresión {reg['endpoint']} @ {reg['size']} docs: "
+                  f"p95 {reg['p95_base_ms']}ms → {reg['p95_actual_ms']}ms ({reg['cambio']})")
+        if regresiones:
+            sys.exit(1)
+        print(f"✅ Sin regresiones respecto a {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Reemplazo local de `bd.get_connection()` sobre SQLite, para benchmarks y pruebas
+sin SQL Server. Traduce lo justo del T-SQL que usa la app (TOP, GETDATE, ISNULL,
+OUTPUT INSERTED, IF OBJECT_ID ... CREATE TABLE, NVARCHAR(MAX), (VALUES ...) AS v (cols))
+y expone la interfaz de pyodbc que usan los controladores (cursor, execute con
+parámetros posicionales, fetchone/fetchall, executemany, fast_executemany, commit/rollback).
+
+No pretende ser un SQL Server: las consultas que usan MERGE u otras construcciones
+no traducidas fallan con sqlite3.OperationalError.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+
+DB_PATH = os.getenv("DB_STANDIN_PATH", os.path.join(tempfile.gettempdir(), "db_standin.sqlite3"))
+
+# Esquema mínimo de las tablas que tocan los flujos SAP
+ESQUEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS FACTURAS (
+        ID_FACTURA INTEGER PRIMARY KEY AUTOINCREMENT,
+        NUMERO_FACTURA TEXT, NUMERO_SOLICITUD_SAP TEXT, NUMERO_PEDIDO TEXT, ENTRADA_MERCANCIA TEXT,
+        FECHA_EMISION TEXT, RUT_EMISOR TEXT, NOMBRE_EMISOR TEXT,
+        RUT_RECEPTOR TEXT, NOMBRE_RECEPTOR TEXT, DIRECCION_RECEPTOR TEXT, DESPACHO_RECEPTOR TEXT,
+        BASE_AFECTA REAL, FEEP REAL, IEV REAL, IEF REAL, IVA REAL, TOTAL REAL,
+        USUARIO_INGRESO TEXT, FECHA_INGRESO TEXT, HORA_INGRESO TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS IX_FACTURAS_SOLICITUD ON FACTURAS (NUMERO_SOLICITUD_SAP)",
+    "CREATE INDEX IF NOT EXISTS IX_FACTURAS_PEDIDO ON FACTURAS (NUMERO_PEDIDO)",
+    """
+    CREATE TABLE IF NOT EXISTS PRODUCTO (
+        ID_PRODUCTO INTEGER PRIMARY KEY AUTOINCREMENT,
+        NOMBRE_PRODUCTO TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS DETALLE_PRODUCTO (
+        ID_DETALLE INTEGER PRIMARY KEY AUTOINCREMENT,
+        CANTIDAD REAL, PBASE_SI_U REAL, IEV_U REAL, IEF_U REAL, PTOTAL_U REAL, SUBTOTAL REAL,
+        ID_PRODUCTO INTEGER, ID_FACTURA INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS LOGS (
+        ID_LOGS INTEGER PRIMARY KEY AUTOINCREMENT,
+        ID_FACTURA INTEGER, FECHA TEXT, HORA TEXT, ESTADO TEXT, COMENTARIO TEXT
+    )
+    """,
+]
+
+_REEMPLAZOS = [
+    (re.compile(r"IF\s+OBJECT_ID\(\s*'(\w+)'\s*(?:,\s*'U'\s*)?\)\s+IS\s+NULL\s+CREATE\s+TABLE", re.I),
+     "CREATE TABLE IF NOT EXISTS"),
+    (re.compile(r"IF\s+NOT\s+EXISTS\s*\(\s*SELECT[^)]*sys\.indexes[^)]*\)\s*CREATE\s+INDEX", re.I),
+     "CREATE INDEX IF NOT EXISTS"),
+    (re.compile(r"N?VARCHAR\s*\(\s*MAX\s*\)", re.I), "TEXT"),
+    (re.compile(r"\bDATETIME2?\b", re.I), "TEXT"),
+    (re.compile(r"\bGETDATE\(\)", re.I), "CURRENT_TIMESTAMP"),
+    (re.compile(r"\bSYSDATETIME\(\)", re.I), "CURRENT_TIMESTAMP"),
+    (re.compile(r"\bISNULL\(", re.I), "IFNULL("),
+    (re.compile(r"\bLEN\(", re.I), "LENGTH("),
+    (re.compile(r"\bTRY_CAST\(", re.I), "CAST("),
+    (re.compile(r"\b(?:BIG)?INT\s+IDENTITY\s*\(\s*1\s*,\s*1\s*\)\s+PRIMARY\s+KEY", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\bWITH\s*\(\s*(?:NOLOCK|UPDLOCK|ROWLOCK|READPAST|HOLDLOCK)(?:\s*,\s*\w+)*\s*\)", re.I), ""),
+]
+_TOP = re.compile(r"\bSELECT\s+(DISTINCT\s+)?TOP\s*\(?\s*(\d+)\s*\)?\s", re.I)
+_VALUES = re.compile(r"\(\s*VALUES\s+((?:\([^()]*\)\s*,?\s*)+)\)\s*AS\s+(\w+)\s*\(([^)]*)\)", re.I)
+_OUTPUT = re.compile(r"\s+OUTPUT\s+((?:INSERTED|DELETED)\.\w+(?:\s*,\s*(?:INSERTED|DELETED)\.\w+)*)", re.I)
+
+
+def traducir(sql: str) -> str:
+    """Traduce una sentencia T-SQL al dialecto de SQLite (subconjunto usado por la app)."""
+    for patron, reemplazo in _REEMPLAZOS:
+        sql = patron.sub(reemplazo, sql)
+
+    # SELECT TOP n ... → SELECT ... LIMIT n (solo una TOP por sentencia)
+    m = _TOP.search(sql)
+    if m:
+        sql = sql[:m.start()] + f"SELECT {m.group(1) or ''}" + sql[m.end():]
+        sql = sql.rstrip().rstrip(";") + f" LIMIT {m.group(2)}"
+
+    # (VALUES (...), (...)) AS v (A, B) → (SELECT column1 AS A, column2 AS B FROM (VALUES ...)) AS v
+    def _values(m):
+        columnas = [c.strip() for c in m.group(3).split(",")]
+        alias = ", ".join(f"column{i} AS {c}" for i, c in enumerate(columnas, 1))
+        return f"(SELECT {alias} FROM (VALUES {m.group(1).strip()})) AS {m.group(2)}"
+    sql = _VALUES.sub(_values, sql)
+
+    # INSERT ... OUTPUT INSERTED.X VALUES (...) → INSERT ... VALUES (...) RETURNING X
+    m = _OUTPUT.search(sql)
+    if m:
+        columnas = re.sub(r"(?:INSERTED|DELETED)\.", "", m.group(1), flags=re.I)
+        sql = sql[:m.start()] + sql[m.end():]
+        sql = sql.rstrip().rstrip(";") + f" RETURNING {columnas}"
+    return sql
+
+
+class Cursor:
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+        self.fast_executemany = False
+
+    def execute(self, sql, *params):
+        # pyodbc acepta tanto execute(sql, (a, b)) como execute(sql, a, b)
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            params = params[0]
+        self._cur.execute(traducir(sql), tuple(params))
+        return self
+
+    def executemany(self, sql, filas):
+        self._cur.executemany(traducir(sql), [tuple(f) for f in filas])
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchval(self):
+        fila = self._cur.fetchone()
+        return fila[0] if fila else None
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+    def __iter__(self):
+        return iter(self._cur)
+
+
+class Connection:
+    def __init__(self, path=None):
+        self._conn = sqlite3.connect(path or DB_PATH, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self.autocommit = False
+
+    def cursor(self):
+        return Cursor(self._conn)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def crear_esquema(path=None):
+    conn = Connection(path)
+    for sentencia in ESQUEMA:
+        conn._conn.execute(sentencia)
+    conn.commit()
+    conn.close()
+
+
+def get_connection():
+    return Connection()
@@ -0,0 +1,883 @@
+"""
+Servicio local que imita el subconjunto del SAP B1 Service Layer que usa la app,
+para desarrollo, pruebas y benchmarks sin un SAP real.
+
+Uso (desde public/):
+    python -m tools.sap_standin --port 50000 --seed 42 --latency-ms 80 --error-rate 0.01
+    SAP_URL=http://127.0.0.1:50000/b1s/v1 python app.py
+
+Soporta Login/Logout, documentos de compra (PurchaseRequests, PurchaseOrders,
+PurchaseDeliveryNotes, Drafts), datos maestros (Items, BusinessPartners,
+Warehouses, VatGroups), $filter/$select/$orderby/$top/$skip/$inlinecount, paginación con
+odata.maxpagesize, $crossjoin de documentos con sus líneas y $batch con
+changesets atómicos.
+La latencia y los errores se pueden cambiar en caliente con POST /_standin/config.
+"""
+import os
+import re
+import json
+import copy
+import time
+import uuid
+import random
+import argparse
+import datetime
+import threading
+from flask import Flask, request, Response, jsonify
+
+PREFIX = "/b1s/v1"
+
+DOCUMENTOS = ("PurchaseRequests", "PurchaseOrders", "PurchaseDeliveryNotes", "Drafts")
+MAESTROS = {
+    "Items": "ItemCode",
+    "BusinessPartners": "CardCode",
+    "Warehouses": "WarehouseCode",
+    "VatGroups": "Code",
+}
+# ObjectType SAP de cada documento (BaseType en las líneas)
+TIPOS_OBJETO = {
+    "PurchaseRequests": 1470000113,
+    "PurchaseOrders": 22,
+    "PurchaseDeliveryNotes": 20,
+    "Drafts": 112,
+}
+ENTIDAD_POR_TIPO = {v: k for k, v in TIPOS_OBJETO.items()}
+
+PAGINA_POR_DEFECTO = 20
+# Ítem que filtran los tableros de documentos abiertos
+ITEM_COMBUSTIBLE = "112080001"
+
+
+class ErrorSAP(Exception):
+    def __init__(self, status, mensaje, code=-1):
+        super().__init__(mensaje)
+        self.status = status
+        self.code = code
+
+    def cuerpo(self):
+        return {"error": {"code": self.code, "message": {"lang": "en-us", "value": str(self)}}}
+
+
+# === DATOS DE PRUEBA ===
+_PALABRAS = [
+    "TORNILLO", "TUERCA", "ARANDELA", "PERNO", "CABLE", "GUANTE", "CASCO", "FILTRO", "ACEITE",
+    "MANGUERA", "VALVULA", "RODAMIENTO", "CORREA", "PINTURA", "BROCHA", "CINTA", "LIJA", "DISCO",
+]
+_MEDIDAS = ["1/4", "3/8", "1/2", "M6", "M8", "M10", "10MM", "20MM", "1L", "4L", "GRANDE", "CHICO"]
+_MATERIALES = ["ACERO", "INOX", "GALV", "NITRILO", "PVC", "COBRE", "ALUMINIO", "CAUCHO"]
+
+
+def _dv(cuerpo):
+    suma, factor = 0, 2
+    for d in reversed(str(cuerpo)):
+        suma += int(d) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: "0", 10: "K"}.get(resto, str(resto))
+
+
+def generar_dataset(seed=42, items=2000, vendors=300, warehouses=8, documentos=150, lineas=(1, 6), abiertos=0.7,
+                    combustible=0.6):
+    """
+    Genera un conjunto de datos reproducible a partir de una semilla.
+    `documentos` es la cantidad por tipo, `abiertos` la proporción que queda en bost_Open
+    y `combustible` la proporción cuya primera línea es el ítem de combustible.
+    """
+    rnd = random.Random(seed)
+    hoy = datetime.date(2026, 1, 1)
+
+    def fecha(dias_atras):
+        return (hoy - datetime.timedelta(days=dias_atras)).isoformat()
+
+    data = {
+        "Items": [
+            {
+                "ItemCode": f"A{i:06d}",
+                "ItemName": f"{rnd.choice(_PALABRAS)} {rnd.choice(_MATERIALES)} {rnd.choice(_MEDIDAS)}",
+                "ForeignName": None,
+            }
+            for i in range(1, items + 1)
+        ] + [{"ItemCode": ITEM_COMBUSTIBLE, "ItemName": "PETROLEO DIESEL", "ForeignName": None}],
+        "BusinessPartners": [],
+        "Warehouses": [
+            {"WarehouseCode": f"{i:02d}", "WarehouseName": f"BODEGA {i:02d}"} for i in range(1, warehouses + 1)
+        ],
+        "VatGroups": [
+            {"Code": "IVA", "Name": "IVA 19%"},
+            {"Code": "IVA_EXE", "Name": "Exento"},
+        ],
+    }
+    for _ in range(vendors):
+        cuerpo = str(rnd.randint(60_000_000, 99_999_999))
+        rut = f"{cuerpo}-{_dv(cuerpo)}"
+        data["BusinessPartners"].append({
+            "CardCode": f"PN{rut}",
+            "CardName": f"PROVEEDOR {cuerpo[:4]} LTDA",
+            "FederalTaxID": rut,
+            "CardType": "S",
+            "UpdateDate": fecha(rnd.randint(0, 365)),
+        })
+
+    for entidad in DOCUMENTOS:
+        data[entidad] = []
+        if entidad == "Drafts":
+            continue
+        for n in range(1, documentos + 1):
+            vendor = rnd.choice(data["BusinessPartners"])
+            dias = rnd.randint(0, 120)
+            doc_lineas = []
+            con_combustible = rnd.random() < combustible
+            for ln in range(rnd.randint(*lineas)):
+                item = data["Items"][-1] if ln == 0 and con_combustible else rnd.choice(data["Items"][:-1])
+                doc_lineas.append({
+                    "LineNum": ln,
+                    "ItemCode": item["ItemCode"],
+                    "ItemDescription": item["ItemName"],
+                    "Quantity": float(rnd.randint(1, 50)),
+                    "UnitPrice": float(rnd.randint(500, 90_000)),
+                    "WarehouseCode": rnd.choice(data["Warehouses"])["WarehouseCode"],
+                    "TaxCode": "IVA",
+                    "LineVendor": vendor["CardCode"],
+                    "LineVendorName": vendor["CardName"],
+                    "Requester": None,
+                    "LineStatus": "bost_Open",
+                })
+            data[entidad].append({
+                "DocEntry": n,
+                "DocNum": n,
+                "CardCode": vendor["CardCode"],
+                "CardName": vendor["CardName"],
+                "DocDate": fecha(dias),
+                "DocDueDate": fecha(dias - 30),
+                "DocTotal": round(sum(l["Quantity"] * l["UnitPrice"] for l in doc_lineas), 2),
+                "DocCurrency": "$",
+                "DocumentStatus": "bost_Open" if rnd.random() < abiertos else "bost_Close",
+                "Requester": None,
+                "Comments": None,
+                "UpdateDate": fecha(dias),
+                "UpdateTime": "12:00:00",
+                "DocumentLines": doc_lineas,
+            })
+    return data
+
+
+# === $filter ===
+_TOKEN = re.compile(r"\s*(?:(?P<str>'(?:[^']|'')*')|(?P<num>-?\d+(?:\.\d+)?)|(?P<op>[(),])|(?P<id>[A-Za-z_][\w/]*))")
+
+
+def _tokenizar(texto):
+    tokens, pos = [], 0
+    texto = texto.strip()
+    while pos < len(texto):
+        m = _TOKEN.match(texto, pos)
+        if not m:
+            raise ErrorSAP(400, f"Invalid $filter near: {texto[pos:pos + 20]}")
+        pos = m.end()
+        if m.group("str") is not None:
+            tokens.append(("val", m.group("str")[1:-1].replace("''", "'")))
+        elif m.group("num") is not None:
+            num = m.group("num")
+            tokens.append(("val", float(num) if "." in num else int(num)))
+        elif m.group("op") is not None:
+            tokens.append(("op", m.group("op")))
+        else:
+            tokens.append(("id", m.group("id")))
+    return tokens
+
+
+class _Filtro:
+    """
+    Parser descendente del subconjunto de $filter que usa la app:
+    eq/ne/gt/ge/lt/le, and/or/not, paréntesis, contains/startswith/endswith
+    y valores null/true/false. Los campos pueden ser rutas (Entidad/Campo).
+    """
+
+    COMPARADORES = {
+        "eq": lambda a, b: a == b,
+        "ne": lambda a, b: a != b,
+        "gt": lambda a, b: a is not None and b is not None and a > b,
+        "ge": lambda a, b: a is not None and b is not None and a >= b,
+        "lt": lambda a, b: a is not None and b is not None and a < b,
+        "le": lambda a, b: a is not None and b is not None and a <= b,
+    }
+    FUNCIONES = {
+        "contains": lambda a, b: a is not None and str(b).lower() in str(a).lower(),
+        "substringof": lambda b, a: a is not None and str(b).lower() in str(a).lower(),
+        "startswith": lambda a, b: a is not None and str(a).lower().startswith(str(b).lower()),
+        "endswith": lambda a, b: a is not None and str(a).lower().endswith(str(b).lower()),
+    }
+
+    def __init__(self, texto):
+        self.tokens = _tokenizar(texto)
+        self.i = 0
+        self.arbol = self._or()
+        if self.i != len(self.tokens):
+            raise ErrorSAP(400, "Invalid $filter: unexpected trailing tokens")
+
+    def _ver(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def _tomar(self, tipo=None, valor=None):
+        t = self._ver()
+        if (tipo and t[0] != tipo) or (valor and t[1] != valor):
+            raise ErrorSAP(400, f"Invalid $filter: expected {valor or tipo}")
+        self.i += 1
+        return t
+
+    def _or(self):
+        nodo = self._and()
+        while self._ver() == ("id", "or"):
+            self.i += 1
+            nodo = ("or", nodo, self._and())
+        return nodo
+
+    def _and(self):
+        nodo = self._not()
+        while self._ver() == ("id", "and"):
+            self.i += 1
+            nodo = ("and", nodo, self._not())
+        return nodo
+
+    def _not(self):
+        if self._ver() == ("id", "not"):
+            self.i += 1
+            return ("not", self._not())
+        return self._comparacion()
+
+    def _comparacion(self):
+        izq = self._operando()
+        t = self._ver()
+        if t[0] == "id" and t[1] in self.COMPARADORES:
+            self.i += 1
+            return ("cmp", t[1], izq, self._operando())
+        return izq
+
+    def _operando(self):
+        tipo, valor = self._ver()
+        if (tipo, valor) == ("op", "("):
+            self.i += 1
+            nodo = self._or()
+            self._tomar("op", ")")
+            return nodo
+        if tipo == "val":
+            self.i += 1
+            return ("val", valor)
+        if tipo == "id":
+            self.i += 1
+            if valor in ("null", "true", "false"):
+                return ("val", {"null": None, "true": True, "false": False}[valor])
+            if valor in self.FUNCIONES and self._ver() == ("op", "("):
+                self.i += 1
+                a = self._operando()
+                self._tomar("op", ",")
+                b = self._operando()
+                self._tomar("op", ")")
+                return ("fn", valor, a, b)
+            return ("campo", valor)
+        raise ErrorSAP(400, "Invalid $filter: unexpected end")
+
+    def evaluar(self, fila, nodo=None):
+        nodo = self.arbol if nodo is None else nodo
+        tipo = nodo[0]
+        if tipo == "val":
+            return nodo[1]
+        if tipo == "campo":
+            return _en_ruta(fila, nodo[1])
+        if tipo == "and":
+            return bool(self.evaluar(fila, nodo[1])) and bool(self.evaluar(fila, nodo[2]))
+        if tipo == "or":
+            return bool(self.evaluar(fila, nodo[1])) or bool(self.evaluar(fila, nodo[2]))
+        if tipo == "not":
+            return not self.evaluar(fila, nodo[1])
+        if tipo == "cmp":
+            a, b = self.evaluar(fila, nodo[2]), self.evaluar(fila, nodo[3])
+            try:
+                return self.COMPARADORES[nodo[1]](a, b)
+            except TypeError:
+                return False
+        if tipo == "fn":
+            return self.FUNCIONES[nodo[1]](self.evaluar(fila, nodo[2]), self.evaluar(fila, nodo[3]))
+        raise ErrorSAP(400, "Invalid $filter")
+
+
+def _en_ruta(fila, campo):
+    """Valor de un campo o de una ruta 'Entidad/Campo' dentro de la fila."""
+    valor = fila
+    for parte in campo.split("/"):
+        valor = valor.get(parte) if isinstance(valor, dict) else None
+    return valor
+
+
+def _ordenar(filas, orderby):
+    # Orden estable criterio por criterio, del último al primero; los null quedan al final
+    for criterio in reversed([c.strip() for c in orderby.split(",") if c.strip()]):
+        partes = criterio.split()
+        campo, desc = partes[0], len(partes) > 1 and partes[1].lower() == "desc"
+        con_valor = [f for f in filas if _en_ruta(f, campo) is not None]
+        con_valor.sort(key=lambda f: _en_ruta(f, campo), reverse=desc)
+        filas = con_valor + [f for f in filas if _en_ruta(f, campo) is None]
+    return filas
+
+
+def _seleccionar(fila, select):
+    if not select:
+        return copy.deepcopy(fila)
+    return {campo: copy.deepcopy(fila.get(campo)) for campo in select}
+
+
+# === SERVICIO ===
+class SAPStandIn:
+    """Estado en memoria del Service Layer simulado (datos, sesiones y configuración)."""
+
+    def __init__(self, data=None, seed=42, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 session_timeout_min=30, page_size=PAGINA_POR_DEFECTO):
+        self.seed = seed
+        self.config = {
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "error_rate": error_rate,
+            "session_timeout_min": session_timeout_min,
+            "page_size": page_size,
+            # Latencia extra por entidad, p. ej. {"PurchaseOrders": 300}
+            "latency_by_entity": {},
+        }
+        self._rnd = random.Random(seed)
+        self._lock = threading.RLock()
+        self.sesiones = {}
+        self._journal = None
+        self.contadores = {"requests": 0, "errors_injected": 0, "logins": 0, "batches": 0}
+        self.cargar(data if data is not None else generar_dataset(seed))
+
+    def cargar(self, data):
+        with self._lock:
+            self.data = {entidad: list(data.get(entidad, [])) for entidad in (*DOCUMENTOS, *MAESTROS)}
+            self._siguiente = {
+                entidad: max((d["DocEntry"] for d in self.data[entidad]), default=0) + 1
+                for entidad in DOCUMENTOS
+            }
+
+    # --- sesión ---
+    def login(self, cuerpo):
+        if not cuerpo or not cuerpo.get("UserName"):
+            raise ErrorSAP(401, "Fail to get DB Credentials", code=-304)
+        sesion = str(uuid.uuid4())
+        with self._lock:
+            self.sesiones[sesion] = time.monotonic()
+            self.contadores["logins"] += 1
+        return sesion
+
+    def validar_sesion(self, sesion):
+        with self._lock:
+            ultimo = self.sesiones.get(sesion)
+            if ultimo is None or time.monotonic() - ultimo > self.config["session_timeout_min"] * 60:
+                self.sesiones.pop(sesion, None)
+                raise ErrorSAP(401, "Invalid session or session already timeout.", code=301)
+            self.sesiones[sesion] = time.monotonic()
+
+    def logout(self, sesion):
+        with self._lock:
+            self.sesiones.pop(sesion, None)
+
+    # --- latencia y errores inyectados ---
+    def simular_red(self, entidad=None):
+        cfg = self.config
+        espera = cfg["latency_ms"] + cfg["latency_by_entity"].get(entidad, 0)
+        with self._lock:
+            self.contadores["requests"] += 1
+            if cfg["jitter_ms"]:
+                espera += self._rnd.uniform(0, cfg["jitter_ms"])
+            fallar = cfg["error_rate"] and self._rnd.random() < cfg["error_rate"]
+            if fallar:
+                self.contadores["errors_injected"] += 1
+        if espera > 0:
+            time.sleep(espera / 1000)
+        if fallar:
+            raise ErrorSAP(500, "Injected failure (stand-in)", code=-1)
+
+    # --- despacho de operaciones OData ---
+    def despachar(self, method, ruta, cuerpo=None, headers=None):
+        """
+        Ejecuta una operación sobre una ruta relativa a /b1s/v1 ('PurchaseOrders(3)?$select=...').
+        Retorna (status, cuerpo_json_o_None, headers_extra).
+        """
+        headers = headers or {}
+        ruta, _, query = ruta.partition("?")
+        params = _parse_query(query)
+        if ruta.lstrip("/").startswith("$crossjoin("):
+            if method.upper() != "GET":
+                raise ErrorSAP(405, f"Method {method} not allowed on $crossjoin")
+            with self._lock:
+                return 200, self._crossjoin(ruta, params, headers), {}
+        m = re.fullmatch(r"/?(\w+)(?:\((?:'([^']*)'|(\d+))\))?(?:/(\w+))?", ruta)
+        if not m:
+            raise ErrorSAP(404, f"Resource not found for the segment '{ruta}'")
+        entidad, clave_txt, clave_num, accion = m.groups()
+        clave = clave_txt if clave_txt is not None else (int(clave_num) if clave_num else None)
+        if entidad not in self.data:
+            raise ErrorSAP(404, f"Resource not found for the segment '{entidad}'")
+
+        method = method.upper()
+        with self._lock:
+            if clave is None:
+                if method == "GET":
+                    return 200, self._consultar(entidad, ruta, params, headers), {}
+                if method == "POST":
+                    return 201, self._crear(entidad, cuerpo or {}), {}
+                raise ErrorSAP(405, f"Method {method} not allowed on collection")
+
+            fila = self._buscar(entidad, clave)
+            if accion:
+                return self._accion(entidad, fila, accion, method)
+            if method == "GET":
+                return 200, _seleccionar(fila, params.get("$select")), {}
+            if method == "PATCH":
+                self._actualizar(entidad, fila, cuerpo or {}, headers)
+                return 204, None, {}
+            if method == "DELETE":
+                self._tocar(entidad)
+                self.data[entidad].remove(fila)
+                return 204, None, {}
+            raise ErrorSAP(405, f"Method {method} not allowed on entity")
+
+    def _buscar(self, entidad, clave):
+        campo = MAESTROS.get(entidad, "DocEntry")
+        for fila in self.data[entidad]:
+            if fila.get(campo) == clave:
+                return fila
+        raise ErrorSAP(404, "No matching records found (ODBC -2028)", code=-2028)
+
+    def _consultar(self, entidad, ruta, params, headers):
+        filas = self.data[entidad]
+        if "$filter" in params:
+            filtro = _Filtro(params["$filter"])
+            filas = [f for f in filas if filtro.evaluar(f)]
+        else:
+            filas = list(filas)
+        if "$orderby" in params:
+            filas = _ordenar(filas, params["$orderby"])
+
+        return self._paginar(ruta, params, headers, filas, lambda f: _seleccionar(f, params.get("$select")))
+
+    def _crossjoin(self, ruta, params, headers):
+        """
+        $crossjoin(Entidad,Entidad/DocumentLines): una fila por línea de documento, con
+        $expand=Entidad($select=...),Entidad/DocumentLines($select=...) y $filter/$orderby
+        sobre rutas 'Entidad/Campo' y 'Entidad/DocumentLines/Campo'.
+        """
+        m = re.fullmatch(r"/?\$crossjoin\((\w+),\s*(\w+)/(\w+)\)", ruta)
+        if not m or m.group(1) != m.group(2) or m.group(1) not in self.data:
+            raise ErrorSAP(400, f"Unsupported $crossjoin: {ruta}")
+        entidad, coleccion = m.group(1), m.group(3)
+        ruta_lineas = f"{entidad}/{coleccion}"
+
+        filas = []
+        for doc in self.data[entidad]:
+            for linea in doc.get(coleccion) or []:
+                linea = {**linea, "DocEntry": doc.get("DocEntry")}
+                filas.append({entidad: {**doc, coleccion: linea}, "_linea": linea})
+        if "$filter" in params:
+            filtro = _Filtro(params["$filter"])
+            filas = [f for f in filas if filtro.evaluar(f)]
+        if "$orderby" in params:
+            filas = _ordenar(filas, params["$orderby"])
+
+        selects = {}
+        for nombre, campos in re.findall(r"([\w/]+)\(\$select=([^)]*)\)", params.get("$expand", "")):
+            selects[nombre] = [c.strip() for c in campos.split(",") if c.strip()]
+
+        def proyectar(f):
+            doc = {k: v for k, v in f[entidad].items() if k != coleccion}
+            return {
+                entidad: _seleccionar(doc, selects.get(entidad)),
+                ruta_lineas: _seleccionar(f["_linea"], selects.get(ruta_lineas)),
+            }
+        return self._paginar(ruta, params, headers, filas, proyectar)
+
+    def _paginar(self, ruta, params, headers, filas, proyectar):
+        """Aplica $skip/$top y la página preferida; arma odata.nextLink si quedan filas."""
+        skip = int(params.get("$skip", 0))
+        top = int(params["$top"]) if "$top" in params else None
+        pagina = _pagina_preferida(headers) or self.config["page_size"]
+        restantes = filas[skip:] if top is None else filas[skip:skip + top]
+
+        respuesta = {"value": [proyectar(f) for f in restantes[:pagina]]}
+        if params.get("$inlinecount") == "allpages":
+            respuesta["odata.count"] = len(filas)
+        if len(restantes) > pagina:
+            siguiente = {k: v for k, v in params.items() if k != "$skip"}
+            if top is not None:
+                siguiente["$top"] = top - pagina
+            siguiente["$skip"] = skip + pagina
+            respuesta["odata.nextLink"] = f"{ruta.lstrip('/')}?{_armar_query(siguiente)}"
+        return respuesta
+
+    def _crear(self, entidad, cuerpo):
+        if entidad in MAESTROS:
+            campo = MAESTROS[entidad]
+            if not cuerpo.get(campo):
+                raise ErrorSAP(400, f"Field '{campo}' is required")
+            self._tocar(entidad)
+            self.data[entidad].append(copy.deepcopy(cuerpo))
+            return copy.deepcopy(cuerpo)
+
+        if not cuerpo.get("CardCode") and entidad != "PurchaseRequests":
+            raise ErrorSAP(400, "Enter BP code", code=-5002)
+        lineas = cuerpo.get("DocumentLines") or []
+        if not lineas:
+            raise ErrorSAP(400, "Document must have at least one row", code=-5002)
+
+        vendor = next((v for v in self.data["BusinessPartners"] if v["CardCode"] == cuerpo.get("CardCode")), None)
+        hoy = datetime.date.today().isoformat()
+        doc_entry = self._siguiente[entidad]
+        self._siguiente[entidad] += 1
+        doc = {
+            "DocEntry": doc_entry,
+            "DocNum": doc_entry,
+            "CardCode": cuerpo.get("CardCode"),
+            "CardName": vendor["CardName"] if vendor else cuerpo.get("CardName"),
+            "DocDate": cuerpo.get("DocDate") or hoy,
+            "DocDueDate": cuerpo.get("DocDueDate") or cuerpo.get("RequriedDate") or hoy,
+            "DocCurrency": cuerpo.get("DocCurrency", "$"),
+            "DocumentStatus": "bost_Open",
+            "Requester": cuerpo.get("Requester"),
+            "Comments": cuerpo.get("Comments"),
+            "UpdateDate": hoy,
+            "UpdateTime": datetime.datetime.now().strftime("%H:%M:%S"),
+            **{k: v for k, v in cuerpo.items() if k not in ("DocEntry", "DocNum", "DocumentLines")},
+            "DocumentLines": [],
+        }
+        for n, linea in enumerate(lineas):
+            # Las líneas copiadas de un documento base heredan sus valores
+            base = self._linea_base(linea) or {}
+            heredados = ("ItemCode", "ItemDescription", "Quantity", "UnitPrice", "WarehouseCode", "TaxCode")
+            nueva = {
+                "LineNum": n,
+                "UnitPrice": 0.0,
+                **{k: base[k] for k in heredados if k in base},
+                "LineStatus": "bost_Open",
+                **copy.deepcopy(linea),
+            }
+            if not nueva.get("ItemDescription"):
+                item = next((i for i in self.data["Items"] if i["ItemCode"] == nueva.get("ItemCode")), None)
+                nueva["ItemDescription"] = item["ItemName"] if item else None
+            doc["DocumentLines"].append(nueva)
+
+        doc["DocTotal"] = round(sum((l.get("Quantity") or 0) * (l.get("UnitPrice") or 0)
+                                    for l in doc["DocumentLines"]), 2)
+        if entidad != "Drafts":
+            for linea in lineas:
+                self._cerrar_linea_base(linea)
+        self._tocar(entidad)
+        self.data[entidad].append(doc)
+        return copy.deepcopy(doc)
+
+    def _linea_base(self, linea):
+        entidad = ENTIDAD_POR_TIPO.get(linea.get("BaseType"))
+        if not entidad or linea.get("BaseEntry") is None:
+            return None
+        doc = self._buscar(entidad, int(linea["BaseEntry"]))
+        for base in doc["DocumentLines"]:
+            if base.get("LineNum") == linea.get("BaseLine"):
+                if base.get("LineStatus") == "bost_Close":
+                    raise ErrorSAP(400, f"Base document line {entidad}({doc['DocEntry']})/{base['LineNum']} is closed",
+                                   code=-5002)
+                return base
+        raise ErrorSAP(400, f"Base line {linea.get('BaseLine')} not found in {entidad}({doc['DocEntry']})")
+
+    def _cerrar_linea_base(self, linea):
+        base = self._linea_base(linea)
+        if base is None:
+            return
+        entidad = ENTIDAD_POR_TIPO[linea["BaseType"]]
+        doc = self._buscar(entidad, int(linea["BaseEntry"]))
+        self._tocar(entidad, doc)
+        base["LineStatus"] = "bost_Close"
+        if all(l.get("LineStatus") == "bost_Close" for l in doc["DocumentLines"]):
+            doc["DocumentStatus"] = "bost_Close"
+        doc["UpdateDate"] = datetime.date.today().isoformat()
+
+    def _actualizar(self, entidad, fila, cuerpo, headers):
+        reemplazar = str(headers.get("B1S-ReplaceCollectionsOnPatch", "")).lower() == "true"
+        self._tocar(entidad, fila)
+        for campo, valor in cuerpo.items():
+            if campo == "DocumentLines" and not reemplazar and isinstance(fila.get(campo), list):
+                for cambio in valor:
+                    destino = next((l for l in fila[campo] if l.get("LineNum") == cambio.get("LineNum")), None)
+                    if destino is None:
+                        fila[campo].append(copy.deepcopy(cambio))
+                    else:
+                        destino.update(copy.deepcopy(cambio))
+            else:
+                fila[campo] = copy.deepcopy(valor)
+        if entidad in DOCUMENTOS:
+            fila["UpdateDate"] = datetime.date.today().isoformat()
+            fila["UpdateTime"] = datetime.datetime.now().strftime("%H:%M:%S")
+
+    def _accion(self, entidad, fila, accion, method):
+        if method != "POST" or entidad not in DOCUMENTOS:
+            raise ErrorSAP(405, f"Action {accion} not supported")
+        self._tocar(entidad, fila)
+        if accion == "Close":
+            fila["DocumentStatus"] = "bost_Close"
+        elif accion == "Cancel":
+            fila["DocumentStatus"] = "bost_Close"
+            fila["Cancelled"] = "tYES"
+        elif accion == "Reopen":
+            fila["DocumentStatus"] = "bost_Open"
+        else:
+            raise ErrorSAP(404, f"Action {accion} not found")
+        fila["UpdateDate"] = datetime.date.today().isoformat()
+        return 204, None, {}
+
+    # --- $batch ---
+    def ejecutar_batch(self, content_type, cuerpo):
+        boundary = _boundary(content_type)
+        if not boundary:
+            raise ErrorSAP(400, "Missing multipart boundary")
+        with self._lock:
+            self.contadores["batches"] += 1
+        respuesta_boundary = f"batchresponse_{uuid.uuid4().hex}"
+        salida = []
+
+        for tipo, contenido in _partes_multipart(cuerpo, boundary):
+            salida.append(f"--{respuesta_boundary}")
+            if tipo.lower().startswith("multipart/mixed"):
+                cs_boundary = f"changesetresponse_{uuid.uuid4().hex}"
+                salida += [f"Content-Type: multipart/mixed;boundary={cs_boundary}", ""]
+                salida += self._ejecutar_changeset(_boundary(tipo), contenido, cs_boundary)
+                salida.append(f"--{cs_boundary}--")
+            else:
+                status, data = self._ejecutar_parte(contenido)
+                salida += _parte_respuesta(status, data)
+        salida += [f"--{respuesta_boundary}--", ""]
+        return respuesta_boundary, "\r\n".join(salida)
+
+    def _tocar(self, entidad, fila=None):
+        """Respalda (una vez por changeset) la colección y la fila que se van a modificar."""
+        if self._journal is None:
+            return
+        self._journal["listas"].setdefault(entidad, list(self.data[entidad]))
+        if fila is not None and id(fila) not in self._journal["filas"]:
+            self._journal["filas"][id(fila)] = (fila, copy.deepcopy(fila))
+
+    def _ejecutar_changeset(self, boundary, contenido, cs_boundary):
+        """Todo o nada: ante el primer error se restauran los datos y se responde solo ese error."""
+        with self._lock:
+            self._journal = {"listas": {}, "filas": {}, "siguiente": dict(self._siguiente)}
+            try:
+                respuestas = []
+                for _, parte in _partes_multipart(contenido, boundary):
+                    status, data = self._ejecutar_parte(parte)
+                    if status >= 400:
+                        self._deshacer()
+                        return [f"--{cs_boundary}"] + _parte_respuesta(status, data)
+                    respuestas += [f"--{cs_boundary}"] + _parte_respuesta(status, data)
+                return respuestas
+            finally:
+                self._journal = None
+
+    def _deshacer(self):
+        for entidad, lista in self._journal["listas"].items():
+            self.data[entidad] = lista
+        for fila, copia in self._journal["filas"].values():
+            fila.clear()
+            fila.update(copia)
+        self._siguiente = self._journal["siguiente"]
+
+    def _ejecutar_parte(self, parte):
+        texto = parte.replace("\r\n", "\n")
+        _, _, http = texto.partition("\n\n")
+        cabecera, _, cuerpo = http.strip("\n").partition("\n\n")
+        lineas = cabecera.split("\n")
+        method, ruta = lineas[0].split(" ")[:2]
+        headers = dict(l.split(":", 1) for l in lineas[1:] if ":" in l)
+        headers = {k.strip(): v.strip() for k, v in headers.items()}
+        ruta = ruta.split(PREFIX, 1)[-1]
+        try:
+            payload = json.loads(cuerpo) if cuerpo.strip() else None
+            status, data, _ = self.despachar(method, ruta, payload, headers)
+            return status, data
+        except ErrorSAP as e:
+            return e.status, e.cuerpo()
+        except ValueError as e:
+            return 400, ErrorSAP(400, f"Invalid JSON: {e}").cuerpo()
+
+
+def _pagina_preferida(headers):
+    m = re.search(r"odata\.maxpagesize=(\d+)", headers.get("Prefer", ""))
+    return int(m.group(1)) if m else None
+
+
+def _parse_query(query):
+    from urllib.parse import unquote
+    params = {}
+    for par in query.split("&") if query else []:
+        clave, _, valor = par.partition("=")
+        valor = unquote(valor.replace("+", " "))
+        if clave == "$select":
+            params[clave] = [c.strip() for c in valor.split(",") if c.strip()]
+        else:
+            params[unquote(clave)] = valor
+    return params
+
+
+def _armar_query(params):
+    partes = []
+    for clave, valor in params.items():
+        if isinstance(valor, list):
+            valor = ",".join(valor)
+        partes.append(f"{clave}={valor}")
+    return "&".join(partes)
+
+
+def _boundary(content_type):
+    for token in (content_type or "").split(";"):
+        token = token.strip()
+        if token.lower().startswith("boundary="):
+            return token.split("=", 1)[1].strip('"')
+    return None
+
+
+def _partes_multipart(texto, boundary):
+    """Entrega (content_type, contenido) por cada parte de un cuerpo multipart/mixed."""
+    texto = texto.replace("\r\n", "\n")
+    for bloque in texto.split(f"--{boundary}")[1:]:
+        if bloque.startswith("--"):
+            break
+        bloque = bloque.lstrip("\n")
+        cabecera, _, resto = bloque.partition("\n\n")
+        tipo = ""
+        for linea in cabecera.splitlines():
+            if linea.lower().startswith("content-type:"):
+                tipo = linea.split(":", 1)[1].strip()
+        yield tipo, (resto if tipo.lower().startswith("multipart/mixed") else bloque)
+
+
+def _parte_respuesta(status, data):
+    razon = {200: "OK", 201: "Created", 204: "No Content"}.get(status, "Error")
+    parte = ["Content-Type: application/http", "Content-Transfer-Encoding: binary", "",
+             f"HTTP/1.1 {status} {razon}"]
+    if data is not None:
+        parte += ["Content-Type: application/json;odata=minimalmetadata;charset=utf-8", "",
+                  json.dumps(data, ensure_ascii=False)]
+    else:
+        parte.append("")
+    parte.append("")
+    return parte
+
+
+# === APP FLASK ===
+def create_standin_app(standin=None):
+    standin = standin or SAPStandIn()
+    app = Flask("sap_standin")
+    app.config["STANDIN"] = standin
+
+    def error(e):
+        return Response(json.dumps(e.cuerpo()), status=e.status, mimetype="application/json")
+
+    @app.route(f"{PREFIX}/Login", methods=["POST"])
+    def login():
+        try:
+            standin.simular_red("Login")
+            sesion = standin.login(request.get_json(silent=True))
+        except ErrorSAP as e:
+            return error(e)
+        resp = jsonify({
+            "odata.metadata": f"{request.host_url.rstrip('/')}{PREFIX}/$metadata#B1Sessions/@Element",
+            "SessionId": sesion,
+            "Version": "1000190",
+            "SessionTimeout": standin.config["session_timeout_min"],
+        })
+        resp.set_cookie("B1SESSION", sesion, path=PREFIX)
+        resp.set_cookie("ROUTEID", ".node1", path=PREFIX)
+        return resp
+
+    @app.route(f"{PREFIX}/Logout", methods=["POST"])
+    def logout():
+        standin.logout(request.cookies.get("B1SESSION"))
+        return Response(status=204)
+
+    @app.route(f"{PREFIX}/$batch", methods=["POST"])
+    def batch():
+        try:
+            standin.validar_sesion(request.cookies.get("B1SESSION"))
+            standin.simular_red("$batch")
+            boundary, cuerpo = standin.ejecutar_batch(request.headers.get("Content-Type"),
+                                                      request.get_data(as_text=True))
+        except ErrorSAP as e:
+            return error(e)
+        return Response(cuerpo, status=202, mimetype=f"multipart/mixed;boundary={boundary}")
+
+    @app.route(f"{PREFIX}/<path:ruta>", methods=["GET", "POST", "PATCH", "DELETE"])
+    def odata(ruta):
+        query = request.query_string.decode("utf-8")
+        try:
+            standin.validar_sesion(request.cookies.get("B1SESSION"))
+            standin.simular_red(re.split(r"[(/]", ruta, 1)[0])
+            status, data, headers = standin.despachar(
+                request.method, f"{ruta}?{query}" if query else ruta,
+                request.get_json(silent=True), dict(request.headers),
+            )
+        except ErrorSAP as e:
+            return error(e)
+        if data is None:
+            return Response(status=status, headers=headers)
+        return Response(json.dumps(data, ensure_ascii=False), status=status, headers=headers,
+                        mimetype="application/json")
+
+    @app.route("/_standin/config", methods=["GET", "POST"])
+    def config():
+        if request.method == "POST":
+            cambios = request.get_json(silent=True) or {}
+            desconocidas = set(cambios) - set(standin.config)
+            if desconocidas:
+                return jsonify({"status": "error", "mensaje": f"Claves desconocidas: {sorted(desconocidas)}"}), 400
+            standin.config.update(cambios)
+        return jsonify({"status": "ok", "config": standin.config, "contadores": standin.contadores})
+
+    @app.route("/_standin/reset", methods=["POST"])
+    def reset():
+        cuerpo = request.get_json(silent=True) or {}
+        standin.cargar(generar_dataset(cuerpo.get("seed", standin.seed), **cuerpo.get("dataset", {})))
+        return jsonify({"status": "ok", "mensaje": "Datos regenerados."})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAP B1 Service Layer simulado para pruebas y benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("SAP_STANDIN_PORT", "50000")))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--vendors", type=int, default=300)
+    parser.add_argument("--documentos", type=int, default=150, help="documentos por tipo")
+    parser.add_argument("--dataset", help="JSON con los datos a cargar (en vez de generarlos)")
+    parser.add_argument("--dump", help="escribe el dataset generado a este archivo y termina")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=PAGINA_POR_DEFECTO)
+    args = parser.parse_args()
+
+    if args.dataset:
+        with open(args.dataset, encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = generar_dataset(args.seed, items=args.items, vendors=args.vendors, documentos=args.documentos)
+
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        print(f"💾 Dataset escrito en {args.dump}")
+        return
+
+    standin = SAPStandIn(data, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         error_rate=args.error_rate, page_size=args.page_size)
+    print(f"🧪 SAP simulado en http://{args.host}:{args.port}{PREFIX} "
+          f"(latencia {args.latency_ms}±{args.jitter_ms} ms, errores {args.error_rate:.0%})")
+    create_standin_app(standin).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
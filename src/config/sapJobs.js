@@ -0,0 +1,20 @@
+import axios from "axios";
+import BASE_URL from "./apiConfig";
+
+// Las escrituras a SAP responden 202 con job_id: se consulta el job hasta que termine
+export async function esperarJobSap(res, { onPaso, intervaloMs = 1500, maxMs = 120000 } = {}) {
+  if (res.status !== 202 || !res.data?.job_id) return res;
+
+  const limite = Date.now() + maxMs;
+  while (Date.now() < limite) {
+    await new Promise((resolve) => setTimeout(resolve, intervaloMs));
+    const estado = await axios.get(`${BASE_URL}/sap/jobs/${res.data.job_id}`);
+    const job = estado.data.data;
+    if (job.paso && onPaso) onPaso(job.paso);
+    if (job.estado === "ok" || job.estado === "error") {
+      return { ...res, status: job.http, data: job.resultado || { status: "error", mensaje: job.error } };
+    }
+  }
+  // Sigue en cola (p. ej. SAP caído): el outbox lo terminará más tarde
+  return res;
+}
@@ -24,6 +24,15 @@ export default function Dashboard() {
   const [vistaActiva, setVistaActiva] = useState("facturas");
   const [filtro, setFiltro] = useState("");
 
+  const fetchFacturas = async () => {
+    try {
+      const factRes = await api.get("/facturas");
+      setFacturas(factRes.data);
+    } catch (err) {
+      console.error("Error al obtener facturas:", err);
+    }
+  };
+
   const fetchData = async () => {
     try {
       const [logsRes, factRes] = await Promise.all([
@@ -40,8 +49,35 @@ setFacturas(factRes.data);
 
   useEffect(() => {
     fetchData();
-    const interval = setInterval(fetchData, 10000);
-    return () => clearInterval(interval);
+
+    // Sin soporte de SSE se mantiene el sondeo cada 10 s
+    if (typeof EventSource === "undefined") {
+      const interval = setInterval(fetchData, 10000);
+      return () => clearInterval(interval);
+    }
+
+    // Cambios en vivo; el navegador reconecta solo y retoma con Last-Event-ID
+    const source = new EventSource(`${BASE_URL}/eventos`);
+    let recarga = null;
+    const recargarFacturas = () => {
+      clearTimeout(recarga);
+      recarga = setTimeout(fetchFacturas, 500);
+    };
+
+    source.addEventListener("log", (e) => {
+      const log = JSON.parse(e.data);
+      setLogs((prev) =>
+        [log, ...prev.filter((l) => l.ID_LOGS !== log.ID_LOGS)].slice(0, 100)
+      );
+    });
+    source.addEventListener("factura", recargarFacturas);
+    source.addEventListener("documento", recargarFacturas);
+    source.addEventListener("resync", fetchData);
+
+    return () => {
+      clearTimeout(recarga);
+      source.close();
+    };
   }, []);
 
   //MÉTRICAS
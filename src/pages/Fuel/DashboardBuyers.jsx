@@ -3,6 +3,7 @@ import axios from "axios";
 import { CircularProgress, Snackbar, Alert } from "@mui/material";
 import { Button } from "@mui/material";
 import BASE_URL from "../../config/apiConfig";
+import { esperarJobSap } from "../../config/sapJobs";
 import "../../styles/request_dashboard.css";
 
 export default function DashboardBuyers() {
@@ -144,12 +145,18 @@ export default function DashboardBuyers() {
   const convertirAPedido = async (solicitud) => {
     if (!window.confirm(`¿Convertir solicitud N° ${solicitud.DocNum} en pedido SAP?`)) return;
     try {
-      const res = await axios.post(`${BASE_URL}/sap/convertir_a_pedido`, {
+      const res = await esperarJobSap(await axios.post(`${BASE_URL}/sap/convertir_a_pedido`, {
         DocEntry: solicitud.DocEntry,
         CardCode: solicitud.Lineas?.[0]?.LineVendor || "PN99520000-7",
-      });
+      }));
 
-      if (res.data.status === "ok") {
+      if (res.status === 202) {
+        setSnackbar({
+          open: true,
+          type: "info",
+          message: "Conversión en cola; el pedido se creará cuando SAP responda.",
+        });
+      } else if (res.data.status === "ok") {
         setSnackbar({
           open: true,
           type: "success",
@@ -5,6 +5,7 @@ import { Button } from "@mui/material";
 
 import "../../styles/request_dashboard.css";
 import BASE_URL from "../../config/apiConfig";
+import { esperarJobSap } from "../../config/sapJobs";
 
 export default function DashboardStore() {
   const [entradas, setEntradas] = useState([]);
@@ -243,13 +244,20 @@ const cargarDatos = async () => {
         throw new Error(resUpdate.data.mensaje || "Error al actualizar pedido.");
 
       const payloadEntrada = { DocEntry: modalActualizar.doc.DocEntry };
-      const resEntrada = await axios.post(
+      const resEntrada = await esperarJobSap(await axios.post(
         `${BASE_URL}/sap/convertir_a_entrada_directa`,
         payloadEntrada
-      );
+      ));
 
 
-      if (resEntrada.data.status === "ok") {
+      if (resEntrada.status === 202) {
+        setSnackbar({
+          open: true,
+          type: "info",
+          message: "Entrada en cola; se creará cuando SAP responda.",
+        });
+        setModalActualizar({ open: false, doc: null, item: null });
+      } else if (resEntrada.data.status === "ok") {
         setSnackbar({
           open: true,
           type: "success",
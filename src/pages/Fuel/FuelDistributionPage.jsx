@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import "/src/styles/fuel-distribution.css";
 import api from "../../config/axiosInstance";
+import { esperarJobSap } from "../../config/sapJobs";
 
 export default function FuelPurchaseRequest() {
   const [file, setFile] = useState(null);
@@ -127,23 +128,21 @@ const handleProcessOCR = async () => {
       },
     });
 
-    setLoadingStage("Procesando OCR...");
+    // El backend encola el OCR: se consulta el avance real hasta que termine
+    setLoadingStage("En cola para OCR...");
     setUploadProgress(50);
 
-    await new Promise(resolve => {
-      let progress = 50;
-      const interval = setInterval(() => {
-        progress += 5;
-        if (progress >= 100) {
-          clearInterval(interval);
-          resolve();
-        }
-        setUploadProgress(Math.min(progress, 100));
-      }, 200);
-    });
+    // Un PDF ya procesado (cache) llega con el resultado en la misma respuesta
+    let trabajo = res.data.status === "encolado" ? null : { terminado: true, resultado: res.data };
+    while (!trabajo || !trabajo.terminado) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const estado = await api.get(`/upload/estado/${res.data.id_job}`);
+      trabajo = estado.data.data;
+      setLoadingStage(`${trabajo.etapa}...`);
+      setUploadProgress(50 + Math.round((trabajo.progreso || 0) / 2));
+    }
 
-    // ❗ AHORA SÍ EXISTE `res.data`
-    const r = res.data;
+    const r = trabajo.resultado || {};
 
     if (r.status === "rechazado") {
       setMessage(`⚠️ ${r.mensaje}`);
@@ -238,10 +237,18 @@ const handleProcessOCR = async () => {
       };
 
       setUploadProgress(10);
-      const resSAP = await api.post("/sap/crear_solicitud_compra", payloadSAP);
+      const resSAP = await esperarJobSap(await api.post("/sap/crear_solicitud_compra", payloadSAP), {
+        onPaso: (paso) => setLoadingStage(`${paso}...`),
+      });
       
       setUploadProgress(50);
       
+      if (resSAP.status === 202) {
+        setMessage(`⏳ Solicitud SAP en cola (job ${resSAP.data.job_id}); se creará cuando SAP responda.`);
+        setLoading(false);
+        return;
+      }
+
       if (resSAP.data.status !== "ok") {
         setMessage(`⚠️ Error SAP: ${resSAP.data.mensaje}`);
         setLoading(false);